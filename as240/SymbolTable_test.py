@@ -6,32 +6,34 @@ from as240 import SymbolTable
 from as240 import SyntaxError
 
 class ST_test(unittest.TestCase):
-    
+
+    def setUp(self):
+        self.st = SymbolTable()
+
     def testAddingLabel(self):
         """Adding a new label will succeed. """
         labels = ['Hi', 'Label', 'LongLabel_really_really_long']
         addr = 1200
         line = 1
         for l in labels:
-            SymbolTable.add_label(l, addr, line)
+            self.st.add_label(l, addr, line)
             addr += 1400
             line += 1
         
     def testRetrievingLabel(self):
         """Retriving a defined label will return the stored value."""
-        SymbolTable.clear()
         labels = ['Hi', 'Label', 'LongLabel_really_really_long']
         addr = 1200
         line = 1
         for l in labels:
-            SymbolTable.add_label(l, addr, line)
+            self.st.add_label(l, addr, line)
             addr += 1400
             line += 1
 
         addr = 1200
         line = 1
         for l in labels:
-            a = SymbolTable.lookup_label(l, line)
+            a = self.st.lookup_label(l, line)
             self.assertEqual(a, addr)
             addr += 1400
             line += 1
@@ -44,30 +46,37 @@ class ST_test(unittest.TestCase):
         addr = 2000
         line = 1
         for l in labels:
-            SymbolTable.add_label(l, addr, line)
+            self.st.add_label(l, addr, line)
             addr += 100
             line += 1
-            self.assertRaises(SyntaxError, SymbolTable.add_label, l, addr, line)
+            self.assertRaises(SyntaxError, self.st.add_label, l, addr, line)
 
     def testBadRetrieval(self):
         """ Retrieving an undefined label will raise a SyntaxError. """
         labels = ['Sane', 'Insane', 'M', '43', '18_240']
         line = 1
         for l in labels:
-            self.assertRaises(SyntaxError, SymbolTable.lookup_label, l, line)
-            
+            self.assertRaises(SyntaxError, self.st.lookup_label, l, line)
+
+    def testSeparateTables(self):
+        """ Labels added to one symbol table are not in another one."""
+        self.st.add_label('Shared', 1200, 1)
+        other = SymbolTable()
+        self.assertRaises(SyntaxError, other.lookup_label, 'Shared', 1)
+        other.add_label('Shared', 1400, 1)
+        self.assertEqual(self.st.lookup_label('Shared', 1), 1200)
+        self.assertEqual(other.lookup_label('Shared', 1), 1400)
+
     def testPrintingEmpty(self):
         """ An empty symbol table, when printed, will return empty message."""
-        SymbolTable.clear()
-        s = SymbolTable.printable_string()
+        s = self.st.printable_string()
         self.assertEqual(s, 'Symbol table is empty')
         
     def testPrintingNormal(self):
         """ A symbol table, with normal sized labels, gets printed properly."""
-        SymbolTable.clear()
-        SymbolTable.add_label("STARTING", 1200, 1)
-        SymbolTable.add_label("ENDINGPT", 1400, 2)
-        s = SymbolTable.printable_string()
+        self.st.add_label("STARTING", 1200, 1)
+        self.st.add_label("ENDINGPT", 1400, 2)
+        s = self.st.printable_string()
         expect = (" Label    Address\n"
                   "--------  -------\n"
                   "ENDINGPT   $0578\n"
@@ -79,16 +88,15 @@ class ST_test(unittest.TestCase):
         A symbol table with labels > 40 chars, gets printed truncated,
         including the ending message about significance of labels.
         """
-        SymbolTable.clear()
-        SymbolTable.add_label("ALongLongLongVeryLongExtremelyQuiteLongLabel", 
+        self.st.add_label("ALongLongLongVeryLongExtremelyQuiteLongLabel", 
                               1200, 1)
-        SymbolTable.add_label("AnotherLongLongLongVeryLongExtremelyQuiteLongLabel", 
+        self.st.add_label("AnotherLongLongLongVeryLongExtremelyQuiteLongLabel", 
                               1400, 2)
-        SymbolTable.add_label("ALabelThatIsVeryVeryVeryVeryLongWithSameFirstCharacters", 
+        self.st.add_label("ALabelThatIsVeryVeryVeryVeryLongWithSameFirstCharacters", 
                               1600, 3)
-        SymbolTable.add_label("ALabelThatIsVeryVeryVeryVeryLongWithSameFirstCharactersAsAnotherLabel", 
+        self.st.add_label("ALabelThatIsVeryVeryVeryVeryLongWithSameFirstCharactersAsAnotherLabel", 
                               1800, 4)
-        s = SymbolTable.printable_string()
+        s = self.st.printable_string()
                   #1234567890123456789012345678901234567890
         expect = ("                 Label                    Address\n"
                   "----------------------------------------  -------\n"
@@ -2,272 +2,224 @@
 
 from __future__ import print_function
 from optparse import OptionParser
+from multiprocessing import Pool, cpu_count
+from functools import partial
+import hashlib
+import json
+import tempfile
+import os
 import sys
 import re
 import random
 
+sys.dont_write_bytecode = True
+
+# isa240.py, the instruction set shared with sim240, is in the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from isa240 import opcode_templates, long_instructions, rd_shift, rs_shift
+
+# Errors in an included file carry its name (file_name), which is None for
+# the program being assembled
+
 class ParseError(Exception):
 
-    def __init__(self, line_number, reason_text):
+    def __init__(self, line_number, reason_text, file_name=None):
         self.line_number = line_number
         self.reason_text = reason_text
+        self.file_name = file_name
 
     def __str__(self):
-        return ("Parse Error on line " + str(self.line_number) + ":  " + str(self.reason_text))
+        return ("Parse Error on line " + str(self.line_number) +
+                in_file(self.file_name) + ":  " + str(self.reason_text))
 
 class SyntaxError(Exception):
 
-    def __init__(self, line_number, reason_text):
+    def __init__(self, line_number, reason_text, file_name=None):
         self.line_number = line_number
         self.reason_text = reason_text
+        self.file_name = file_name
 
     def __str__(self):
-        return ("Syntax Error on line " + str(self.line_number) + ":  " + str(self.reason_text))
+        return ("Syntax Error on line " + str(self.line_number) +
+                in_file(self.file_name) + ":  " + str(self.reason_text))
+
+def in_file(file_name):
+    if file_name:
+        return " of " + file_name
+    return ""
 
 class OpcodeInfo:
 
-    opcode_info = {'ADD' : { 'format' : 'short',
-                             'field1' : 'op1',
+    opcode_info = {'ADD' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',  # register, number
-                             'op2_type' : 'register',
-                             'encoding' : '0000111000' },
-                   'ADDSP' : { 'format' : 'long',
-                               'field1' : 'zero',
+                             'op2_type' : 'register' },
+                   'ADDSP' : { 'field1' : 'zero',
                                'field2' : 'zero',
                                'field3' : 'op1',  # Long format, 2nd word
                                'num_operands' : 1,
-                               'op1_type' : 'number',
-                               'encoding' : '0000111100' },
-                   'AND' : { 'format' : 'short',
-                             'field1' : 'op1',
+                               'op1_type' : 'number' },
+                   'AND' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0001101000' },
-                   'ASHR' : { 'format' : 'short',
-                              'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'ASHR' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0010011000' },
-                   'BRA' : { 'format' : 'long',
-                             'field1' : 'zero',
+                              'op1_type' : 'register' },
+                   'BRA' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0010100000' },
-                   'BRC' : { 'format' : 'long',
-                             'field1' : 'zero',
+                             'op1_type' : 'number' },
+                   'BRC' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0100100000' },
-                   'BRN' : { 'format' : 'long',
-                             'field1' : 'zero',
+                             'op1_type' : 'number' },
+                   'BRN' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0010110000' },
-                   'BRV' : { 'format' : 'long',
-                             'field1' : 'zero',
+                             'op1_type' : 'number' },
+                   'BRV' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0010111000' },
-                   'BRZ' : { 'format' : 'long',
-                             'field1' : 'zero',
+                             'op1_type' : 'number' },
+                   'BRZ' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0010101000' },
-                   'CMI' : { 'format' : 'long',
-                             'field1' : 'op1',
+                             'op1_type' : 'number' },
+                   'CMI' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'field3' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'number',
-                             'encoding' : '0100010000' },
-                   'CMR' : { 'format' : 'short',
-                             'field1' : 'op1',
+                             'op2_type' : 'number' },
+                   'CMR' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0100011000' },
-                   'DECR' : { 'format' : 'short',
-                              'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'DECR' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0001011000' },
-                   'INCR' : { 'format' : 'short',
-                              'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'INCR' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0001010000' },
-                   'JSR' : { 'format' : 'long',
-                             'field1' : 'zero',
+                              'op1_type' : 'register' },
+                   'JSR' : { 'field1' : 'zero',
                              'field2' : 'zero',
                              'field3' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'number',
-                             'encoding' : '0011011000' },
-                   'LDA' : { 'format' : 'long',
-                             'field1' : 'op1',
+                             'op1_type' : 'number' },
+                   'LDA' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'field3' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'number',
-                             'encoding' : '0000010000' },
-                   'LDI' : { 'format' : 'long',
-                             'field1' : 'op1',
+                             'op2_type' : 'number' },
+                   'LDI' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'field3' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'number',
-                             'encoding' : '0000110000' },
-                   'LDR' : { 'format' : 'short',
-                             'field1' : 'op1',
+                             'op2_type' : 'number' },
+                   'LDR' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0000100000' },
-                   'LDSF' : { 'format' : 'long',
-                              'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'LDSF' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'field3' : 'op2',
                               'num_operands' : 2,
                               'op1_type' : 'register',
-                              'op2_type' : 'number',
-                              'encoding' : '0100000000' },
-                   'LDSP' : { 'format' : 'short',
-                              'field1' : 'op1',
+                              'op2_type' : 'number' },
+                   'LDSP' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0011110000' },
-                   'LSHL' : { 'format' : 'short',
-                              'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'LSHL' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0010000000' },
-                   'LSHR' : { 'format' : 'short',
-                              'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'LSHR' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0010010000' },
-                   'MOV' : { 'format' : 'short',
-                             'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'MOV' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0011101000' },
-                   'NEG' : { 'format' : 'short',
-                             'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'NEG' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'register',
-                             'encoding' : '0001001000' },
-                   'NOT' : { 'format' : 'short',
-                             'field1' : 'op1',
+                             'op1_type' : 'register' },
+                   'NOT' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'register',
-                             'encoding' : '0001100000' },
-                   'OR' : { 'format' : 'short',
-                            'field1' : 'op1',
+                             'op1_type' : 'register' },
+                   'OR' : { 'field1' : 'op1',
                             'field2' : 'op2',
                             'num_operands' : 2,
                             'op1_type' : 'register',
-                            'op2_type' : 'register',
-                            'encoding' : '0001110000' },
-                   'POP' : { 'format' : 'short',
-                             'field1' : 'op1',
+                            'op2_type' : 'register' },
+                   'POP' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'register',
-                             'encoding' : '0011010000' },
-                   'PUSH' : { 'format' : 'short',
-                              'field1' : 'op1',
+                             'op1_type' : 'register' },
+                   'PUSH' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0011001000' },
-                   'ROL' : { 'format' : 'short',
-                             'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'ROL' : { 'field1' : 'op1',
                              'field2' : 'op1',
                              'num_operands' : 1,
-                             'op1_type' : 'register',
-                             'encoding' : '0010001000' },
-                   'RTN' : { 'format' : 'short',
-                             'field1' : 'zero',
+                             'op1_type' : 'register' },
+                   'RTN' : { 'field1' : 'zero',
                              'field2' : 'zero',
-                             'num_operands' : 0,
-                             'encoding' : '0011100000' },
-                   'STA' : { 'format' : 'long',
-                             'field1' : 'op2',
+                             'num_operands' : 0 },
+                   'STA' : { 'field1' : 'op2',
                              'field2' : 'op2',
                              'field3' : 'op1',
                              'num_operands' : 2,
                              'op1_type' : 'number',
-                             'op2_type' : 'register',
-                             'encoding' : '0000011000' },
-                   'STOP' : { 'format' : 'short',
-                              'field1' : 'zero',
+                             'op2_type' : 'register' },
+                   'STOP' : { 'field1' : 'zero',
                               'field2' : 'zero',
-                              'num_operands' : 0,
-                              'encoding' : '0011000000' },
-                   'STR' : { 'format' : 'short',
-                             'field1' : 'op1',
+                              'num_operands' : 0 },
+                   'STR' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0000101000' },
-                   'STSF' : { 'format' : 'long',
-                              'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'STSF' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'field3' : 'op2',
                               'num_operands' : 2,
                               'op1_type' : 'register',
-                              'op2_type' : 'number',
-                              'encoding' : '0100001000' },
-                   'STSP' : { 'format' : 'short',
-                              'field1' : 'op1',
+                              'op2_type' : 'number' },
+                   'STSP' : { 'field1' : 'op1',
                               'field2' : 'op1',
                               'num_operands' : 1,
-                              'op1_type' : 'register',
-                              'encoding' : '0011111000' },
-                   'SUB' : { 'format' : 'short',
-                             'field1' : 'op1',
+                              'op1_type' : 'register' },
+                   'SUB' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0001000000' },
-                   'XOR' : { 'format' : 'short',
-                             'field1' : 'op1',
+                             'op2_type' : 'register' },
+                   'XOR' : { 'field1' : 'op1',
                              'field2' : 'op2',
                              'num_operands' : 2,
                              'op1_type' : 'register',
-                             'op2_type' : 'register',
-                             'encoding' : '0001111000' },
+                             'op2_type' : 'register' },
                    }
 
     @classmethod
@@ -292,10 +244,10 @@ class OpcodeInfo:
 
     @classmethod
     def operation_size(cls, opcode):
-        if cls.opcode_info[opcode]['format'] == 'short':
-            return 1
-        else:
+        if opcode in long_instructions:
             return 2
+        else:
+            return 1
 
     @classmethod
     def field1_is(cls, opcode):
@@ -310,104 +262,21 @@ class OpcodeInfo:
         return cls.opcode_info[opcode]['field3']
 
     @classmethod
-    def encoding_is(cls, opcode):
-        return cls.opcode_info[opcode]['encoding']
+    def template_is(cls, opcode):
+        """ The instruction's first word, with its register fields zero """
+        return opcode_templates[opcode]
 
     @classmethod
     def format_is_long(cls, opcode):
-        return cls.opcode_info[opcode]['format'] == 'long'
+        return opcode in long_instructions
 
 class AsmLine:
     """Class to represent a single line in the assembly file"""
 
-    # Any valid ASM line matches one of the following regular expressions
-    # A line without any fields
-    re_blank  = re.compile("""
-                           ^    # Start of line
-                           \s*  # zero or more whitespace characters
-                           $    # end of line
-                           """, re.VERBOSE)
-
-    # A line with only the label field
-    re_label =  re.compile("""
-                           ^      # Start of line
-                           (\S+)  # One or more non-whitespace characters (save as group[0])
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with a label and an opcode
-    re_labop  = re.compile("""
-                           ^      # Start of line
-                           (\S+)  # One or more non-whitespace characters (save as group[0])
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[1])
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with a label, opcode and one operand
-    re_labop1 = re.compile("""
-                           ^      # Start of line
-                           (\S+)  # One or more non-whitespace characters (save as group[0])
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[1])
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[2])
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with a label, opcode and two operands
-    re_labop2 = re.compile("""
-                           ^      # Start of line
-                           (\S+)  # One or more non-whitespace characters (save as group[0]:label)
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[1]:opcode)
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[2]:operand1)
-                           \s*    # Zero or more whitespace characters
-                           ,      # A comma
-                           \s*    # Zero or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[3]:operand2)
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with just an opcode (no label)
-    re_opcode = re.compile("""
-                           ^      # Start of line
-                           \s+    # One or more whitespace characters (no label)
-                           (\S+)  # One or more non-whitespace characters (save as group[0]:opcode)
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with an opcode and a single operand (no label)
-    re_op1    = re.compile("""
-                           ^      # Start of line
-                           \s+    # One or more whitespace characters (no label)
-                           (\S+)  # One or more non-whitespace characters (save as group[0]:opcode)
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[1]:operand1)
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
-
-    # A line with an opcode and two operands (no label)
-    re_op2    = re.compile("""
-                           ^      # Start of line
-                           \s+    # One or more whitespace characters (no label)
-                           (\S+)  # One or more non-whitespace characters (save as group[0]:opcode)
-                           \s+    # One or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[1]:operand1)
-                           \s*    # Zero or more whitespace characters
-                           ,      # A comma
-                           \s*    # Zero or more whitespace characters
-                           (\S+)  # One or more non-whitespace characters (save as group[2]:operand2)
-                           \s*    # Zero or more whitespace characters
-                           $      # end of line
-                           """, re.VERBOSE)
+    # Any valid ASM line is made of whitespace separated fields: a label
+    # (only if the line doesn't start with whitespace), then an opcode, then
+    # up to two operands.  Two operands are separated by a comma, with or
+    # without whitespace around it.
 
     # Validation regular expression: matches a label
     re_vallabel  = re.compile("""
@@ -428,13 +297,9 @@ class AsmLine:
                               $                 # end of operand (string
                               """, re.VERBOSE)
 
-    # Validation RE: checks an operand is a register specifier
-    re_valop_reg = re.compile("""
-                              ^      # Start of line
-                              R      # The letter R
-                              [0-7]  # a number between 0 and 7
-                              $      # end of line
-                              """, re.VERBOSE)
+    # Validation set: the register specifiers an operand may be (fields hold
+    # no whitespace, so looking them up is all a regular expression would do)
+    valop_regs = frozenset(['R0', 'R1', 'R2', 'R3', 'R4', 'R5', 'R6', 'R7'])
 
     # Validation RE: checks an operand is a hex number
     re_valop_hex = re.compile("""
@@ -444,16 +309,14 @@ class AsmLine:
                               $                 # end of operand (string
                               """, re.VERBOSE)
 
-    # Validation RE: checks an opcode is a pseudo-operation
-    re_pseudo    = re.compile("""
-                              ^                 # Start of operand (string)
-                              \.                # A period (backspace escaped, as a period is a RE any-character marker)
-                              (ORG|DW|EQU)      # Either ORG or DW or EQU
-                              $                 # end of operand (string
-                              """, re.VERBOSE)
+    # Validation set: the pseudo-operations an opcode may be
+    pseudo_opcodes = frozenset(['.ORG', '.DW', '.EQU', '.INCLUDE'])
 
-    def __init__(self, line, line_number, mem_address):
+    def __init__(self, line, line_number, mem_address, symbols=None):
         self.text = line
+        if symbols is None:      # a line on its own gets a table of its own
+            symbols = SymbolTable()
+        self.symbols = symbols   # where labels are added and looked up
         self.opcode = None
         self.label  = None
         self.operand1 = None
@@ -465,6 +328,7 @@ class AsmLine:
         self.line_number = line_number
         self.mem_address = mem_address
         self.is_pseudo_operation = False
+        self.include_name = None # File named by a .INCLUDE, as written
         self.__parseInitial()
         self.__validate()
 
@@ -545,83 +409,52 @@ class AsmLine:
         else :
             p_line = self.text
 
+        fields = p_line.upper().split()
         # is the line blank?
-        match = self.re_blank.search(p_line)
-        if match:
+        if not fields:
             self.is_valid = True
             return
 
-        # is the line a label-only line?
-        match = self.re_label.search(p_line)
-        if match:
-            self.is_valid = True
-            self.label = match.groups()[0].upper()
-            return
-
-        # Does the line only have a label and operand?
-        match = self.re_labop.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.label  = g[0].upper()
-            self.opcode = g[1].upper()
-            return
-
-        # must check the two-operand versions before the one-operand, else
-        # a comma without whitespace separating the operands will get viewed as
-        # a single operand
-        match = self.re_labop2.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.label    = g[0].upper()
-            self.opcode   = g[1].upper()
-            self.operand1 = g[2].upper()
-            self.operand2 = g[3].upper()
-            return
-
-        # Is this a 2 operand, no label line?
-        match = self.re_op2.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.opcode   = g[0].upper()
-            self.operand1 = g[1].upper()
-            self.operand2 = g[2].upper()
-            return
-
-       # Opcode only line?
-        match = self.re_opcode.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.opcode = g[0].upper()
-            return
-
-        # Label + opcode + operand line?
-        match = self.re_labop1.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.label    = g[0].upper()
-            self.opcode   = g[1].upper()
-            self.operand1 = g[2].upper()
-            return
-
-        # Opcode + one operand?
-        match = self.re_op1.search(p_line)
-        if match:
-            self.is_valid = True
-            g = match.groups()
-            self.opcode   = g[0].upper()
-            self.operand1 = g[1].upper()
-            return
-
-        raise ParseError(self.line_number,
-                         """Line can't be parsed into label, opcode,
+        if not p_line[0].isspace():
+            self.label = fields.pop(0)
+            # is the line a label-only line?
+            if not fields:
+                self.is_valid = True
+                return
+        self.opcode = fields[0]
+        if len(fields) > 1:
+            # must check for two operands before one, else a comma without
+            # whitespace separating the operands will get viewed as a
+            # single operand
+            operands = self.__split_operands(" ".join(fields[1:]))
+            if operands:
+                (self.operand1, self.operand2) = operands
+            elif len(fields) == 2:
+                self.operand1 = fields[1]
+            else:
+                raise ParseError(self.line_number,
+                                 """Line can't be parsed into label, opcode,
                          operand fields""")
+        self.is_valid = True
 
 
+    def __split_operands(self, text):
+        """ Split the operand fields of a line, joined by single spaces, into
+        two operands around a comma.  The comma may have whitespace on either
+        side, but neither operand may hold any.  Like a greedy regular
+        expression, the last comma that works is the one used.
+        Returns (operand1, operand2), or None if there aren't two operands.
+        """
+        c_index = text.rfind(',')
+        while c_index > 0:
+            operand1 = text[:c_index].rstrip()
+            operand2 = text[c_index + 1:].lstrip()
+            if (operand1 and operand2 and ' ' not in operand1 and
+                ' ' not in operand2):
+                return (operand1, operand2)
+            c_index = text.rfind(',', 0, c_index)
+        return None
+
     def __validate(self):
         """ Check if the fields are actually valid labels, opcodes, etc.
         Provide helpful error messages where possible.
@@ -630,8 +463,7 @@ class AsmLine:
             self.__validate_label(self.label)
 
         if self.opcode:
-            match = self.re_pseudo.search(self.opcode)
-            if match:
+            if self.opcode in self.pseudo_opcodes:
                 self.__validate_pseudo_opcode(self.opcode)
             else:
                 self.__validate_opcode(self.opcode)
@@ -685,13 +517,17 @@ class AsmLine:
         table).  A valid label will be placed in the symbol table by this
         function.
         """
-        match = self.re_vallabel.search(label)
+        match = self.re_vallabel.match(label)
         if match:
             if (self.opcode == '.EQU'):
-                addr = int(self.operand1[1:], 16); # Strip $ from constant
-                SymbolTable.add_label(label, addr, self.line_number)
+                # an operand that isn't a hex value is reported when the
+                # .EQU itself is validated
+                if (self.operand1 and
+                    self.re_valop_hex.match(self.operand1)):
+                    addr = int(self.operand1[1:], 16); # Strip $ from constant
+                    self.symbols.add_label(label, addr, self.line_number)
             else:
-                SymbolTable.add_label(label, self.mem_address, self.line_number)
+                self.symbols.add_label(label, self.mem_address, self.line_number)
         else:
             raise SyntaxError(self.line_number, "Invalid label (" + label +
                               ").  Labels may only consist of alphanumeric " +
@@ -717,7 +553,7 @@ class AsmLine:
                 raise SyntaxError(self.line_number,
                                   "A .EQU pseudo-operation requires one " +
                                   "operand, but you provided none.")
-            match = self.re_valop_hex.search(self.operand1)
+            match = self.re_valop_hex.match(self.operand1)
             if not match:
                 raise SyntaxError(self.line_number,
                                   "A .EQU pseudo-operation requires the " +
@@ -733,7 +569,7 @@ class AsmLine:
                                   self.operand1 + " and " + self.operand2 +
                                   ")")
             if self.operand1:
-                match = self.re_valop_hex.search(self.operand1)
+                match = self.re_valop_hex.match(self.operand1)
                 if not match:
                     raise SyntaxError(self.line_number,
                                       "A .DW pseudo-operation requires the " +
@@ -757,12 +593,34 @@ class AsmLine:
                 raise SyntaxError(self.line_number,
                                   "A .ORG pseudo-operation requires one " +
                                   "operand, but you provided none.")
-            match = self.re_valop_hex.search(self.operand1)
+            match = self.re_valop_hex.match(self.operand1)
             if not match:
                 raise SyntaxError(self.line_number,
                                   "A .ORG pseudo-operation requires the " +
                                   "operand be a hex value (like $01FF), but " +
                                   "you provided " + self.operand1)
+
+        #INCLUDE: no label allowed.  Requires a single operand, the name of
+        #the file to link with (relative to this one), quoted or not
+        elif p_opcode == ".INCLUDE":
+            if self.label:
+                raise SyntaxError(self.line_number,
+                                  "A .INCLUDE pseudo-operation is not " +
+                                  "allowed to have a label.  You provided " +
+                                  "one (" + self.label + ").")
+            if self.operand2:
+                raise SyntaxError(self.line_number,
+                                  "A .INCLUDE pseudo-operation requires a " +
+                                  "single operand, but you provided two (" +
+                                  self.operand1 + " and " + self.operand2 +
+                                  ")")
+            if not self.operand1:
+                raise SyntaxError(self.line_number,
+                                  "A .INCLUDE pseudo-operation requires " +
+                                  "one operand, the file to include, but " +
+                                  "you provided none.")
+            # the fields are upper case, but the file name keeps its case
+            self.include_name = self.text.split(';', 1)[0].split()[1].strip('"')
         self.is_pseudo_operation = True
 
     def __validate_operand_type(self, operand_number):
@@ -780,23 +638,21 @@ class AsmLine:
             operand_string = "second"
 
         if required_type == 'register':
-            match = self.re_valop_reg.search(operand)
-            if not match:
+            if operand not in self.valop_regs:
                 raise SyntaxError(self.line_number,
                                   "A " + self.opcode + " instruction " +
                                   "requires the " + operand_string +
                                   " operand be a register (R0-R7), " +
                                   "but you provided " + operand)
         else:
-            match = self.re_valop_num.search(operand)
+            match = self.re_valop_num.match(operand)
             if not match:
                 raise SyntaxError(self.line_number,
                                   "A " + self.opcode + " instruction " +
                                   "requires the " + operand_string +
                                   " operand be a label or hex value (like" +
                                   " $01FF), but you provided " + operand)
-            match = self.re_valop_reg.search(operand)
-            if match:
+            if operand in self.valop_regs:
                 raise SyntaxError(self.line_number,
                                   "A " + self.opcode + " statement " +
                                   "requires the " + operand_string +
@@ -811,7 +667,7 @@ class AsmLine:
         """
         if self.opcode == ".ORG":
             return
-        if self.opcode == ".EQU":
+        if self.opcode == ".EQU" or self.opcode == ".INCLUDE":
             return
         if self.mem_address == None:
             raise SyntaxError(self.line_number,
@@ -828,8 +684,8 @@ class AsmLine:
             return int(self.operand1[1:], 16)  #operand1 hex string to integer
         elif self.mem_address == None:     # beginning of a file, before an ORG
             return None
-        elif self.opcode == ".EQU":
-            return self.mem_address     # .EQU takes no memory
+        elif self.opcode == ".EQU" or self.opcode == ".INCLUDE":
+            return self.mem_address     # .EQU and .INCLUDE take no memory
         elif self.opcode == ".DW":
             return self.mem_address + 1 # .DW always takes up one word
         elif self.opcode:
@@ -844,46 +700,29 @@ class AsmLine:
         elif self.opcode == '.DW':
             self.word1 = int(self.operand1[1:], 16)
             return
-        elif self.opcode == '.EQU' or self.opcode == '.ORG':
+        elif self.opcode in ('.EQU', '.ORG', '.INCLUDE'):
             return
         else:
-            mach_code = (OpcodeInfo.encoding_is(self.opcode) +
-                         self.__assemble_field(OpcodeInfo.field1_is(self.opcode)) +
-                         self.__assemble_field(OpcodeInfo.field2_is(self.opcode))
-                        )
-            self.word1 = int(mach_code, 2)
+            self.word1 = (OpcodeInfo.template_is(self.opcode) |
+                          self.__assemble_field(OpcodeInfo.field1_is(self.opcode)) << rd_shift |
+                          self.__assemble_field(OpcodeInfo.field2_is(self.opcode)) << rs_shift)
         if OpcodeInfo.format_is_long(self.opcode):
             self.word2 = self.__assemble_long(self.opcode)
 
     def __assemble_register(self, reg_string):
-        """ Given a string like R4, return the 3 character binary string
-        representing the register number (i.e. '100').  This value will be
-        used when assembling the register fields of the instruction.
+        """ Given a string like R4, return the register number (i.e. 4).
+        This value will be shifted into a register field of the instruction.
         """
-        if reg_string == 'R0':
-            return '000'
-        if reg_string == 'R1':
-            return '001'
-        if reg_string == 'R2':
-            return '010'
-        if reg_string == 'R3':
-            return '011'
-        if reg_string == 'R4':
-            return '100'
-        if reg_string == 'R5':
-            return '101'
-        if reg_string == 'R6':
-            return '110'
-        if reg_string == 'R7':
-            return '111'
+        if reg_string in self.valop_regs:
+            return int(reg_string[1])
         raise ValueError("DEBUG: Invalid register string: " + reg_string)
 
     def __assemble_field(self, field_string):
         """ Given a string representing what goes in a field
-        (i.e. zero, op1, op2) return the binary string for that field.
+        (i.e. zero, op1, op2) return the number for that field.
         """
         if field_string == 'zero':
-           return '000'
+           return 0
         elif field_string == 'op1':
            return self.__assemble_register(self.operand1)
         elif field_string == 'op2':
@@ -901,51 +740,65 @@ class AsmLine:
         else:
           raise ValueError("DEBUG: Invalid field3 in opcode_info for " + opcode)
 
-        match = self.re_valop_hex.search(val)
+        match = self.re_valop_hex.match(val)
         if match:
             return int(val[1:], 16) # The operand is a hex string, so int it.
         else:
-            return SymbolTable.lookup_label(val, self.line_number)
+            return self.symbols.lookup_label(val, self.line_number,
+                                             self.mem_address + 1)
 
 class SymbolTable:
+    """The labels of one program and their values.  Each assembly has its
+    own, so programs can be assembled one after another (or at the same
+    time) without their labels mixing.
+    """
 
-    table = {}
+    def __init__(self, allow_external=False):
+        self.table = {}
+        self.lines = {}     # label -> line number it was declared on
+        # (address, label, line number) of the words that hold a label this
+        # table doesn't have, if it allows them (for link() to fill in)
+        self.external_references = [] if allow_external else None
 
-    @classmethod
-    def add_label(cls, label, mem_address, line_number):
-        if label in cls.table:
+    def add_label(self, label, mem_address, line_number):
+        if label in self.table:
             raise SyntaxError(line_number, "Duplicate label (" + label +
                               ").  Label has already been declared on a " +
                               "previous line.")
-        cls.table[label] = mem_address
+        self.table[label] = mem_address
+        self.lines[label] = line_number
 
-    @classmethod
-    def lookup_label(cls, label, line_number):
-        """ returns mem_address """
-        if label in cls.table:
-            return cls.table[label]
+    def lookup_label(self, label, line_number, address=None):
+        """ returns mem_address.  If the table allows external labels, one
+        it doesn't have is recorded as a reference from the word at address,
+        and 0 returned in its place.
+        """
+        if label in self.table:
+            return self.table[label]
+        elif self.external_references is not None and address is not None:
+            self.external_references.append((address, label, line_number))
+            return 0
         else:
             raise SyntaxError(line_number,
                               "The label " + label +
                               " has not been defined anywhere.")
 
-    @classmethod
-    def clear(cls):
+    def clear(self):
         """
         Deletes all symbols in the symbol table.  Primarily used for
         testing.  Not anticipated to be used in normal assembly.
         """
-        cls.table = {}
+        self.table = {}
+        self.lines = {}
 
-    @classmethod
-    def printable_string(cls):
-        if not cls.table:
+    def printable_string(self):
+        if not self.table:
             return "Symbol table is empty"
         else:
             max_len = 0
             long_label = False
 
-            for key in cls.table.keys():
+            for key in self.table.keys():
                 if len(key) > max_len:
                     max_len = len(key)
 
@@ -959,7 +812,7 @@ class SymbolTable:
             ret_val = "{0:^{1}}  Address\n{2}  -------\n".format('Label',
                       max_len, '-' * max_len)
 
-            for label, address in sorted(cls.table.items()):
+            for label, address in sorted(self.table.items()):
                 printable_label = label
                 if len(label) > 40:
                     printable_label = label[:40]
@@ -970,6 +823,352 @@ class SymbolTable:
               ret_val += "Remaining characters are still significant.\n"
             return ret_val
 
+class AssemblyError(Exception):
+    """Raised by assemble() when the source has syntax errors.  errors holds
+    the SyntaxErrors in the order they were found (assembly gives up after
+    MAX_SYNTAX_ERRORS + 1 of them, as the command line does).
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+
+    def __str__(self):
+        return "\n".join([str(e) for e in self.errors])
+
+MAX_SYNTAX_ERRORS = 5
+
+class ObjectModule:
+    """One source file assembled on its own, before it is linked with the
+    files it includes (and the program that includes it).  It is plain
+    data, written out as JSON for an ObjectCache.
+        name    : the file it was assembled from (None for source given as
+                  a string)
+        entries : (address, line number, words, list texts) for each source
+                  line with words, in address order.  The list texts are
+                  its .list lines, after the address and word.
+        symbols : label -> (value, line number), for every label it declares
+        labels  : label -> address, for the labels that mark an address
+        references : (address, label, line number) for each word holding a
+                  label the file doesn't declare, left 0 for link()
+        includes : (file name, line number) for each .INCLUDE, in order
+    """
+
+    def __init__(self, name, entries, symbols, labels, references, includes):
+        self.name = name
+        self.entries = entries
+        self.symbols = symbols
+        self.labels = labels
+        self.references = references
+        self.includes = includes
+
+    def to_json(self):
+        return json.dumps({'format' : OBJECT_FORMAT,
+                           'entries' : self.entries,
+                           'symbols' : self.symbols,
+                           'labels' : self.labels,
+                           'references' : self.references,
+                           'includes' : self.includes})
+
+    @classmethod
+    def from_json(cls, text, name):
+        """ The ObjectModule to_json() wrote, for the file called name.
+        Raises ValueError if it isn't one, or is of another format.
+        """
+        obj = json.loads(text)
+        if obj.get('format') != OBJECT_FORMAT:
+            raise ValueError("object module of another format")
+        return cls(name,
+                   [(address, line_number, words, [str(t) for t in texts])
+                    for (address, line_number, words, texts)
+                    in obj['entries']],
+                   dict((str(label), tuple(value))
+                        for (label, value) in obj['symbols'].items()),
+                   dict((str(label), address)
+                        for (label, address) in obj['labels'].items()),
+                   [(address, str(label), line_number)
+                    for (address, label, line_number) in obj['references']],
+                   [(str(include), line_number)
+                    for (include, line_number) in obj['includes']])
+
+OBJECT_FORMAT = 1
+
+def assemble_module(source, name=None):
+    """ Assemble one source file (a string or lines) on its own, leaving
+    the labels it uses but doesn't declare for link() to fill in.  Returns
+    its ObjectModule.
+    Raises AssemblyError if any line has a syntax error, and ParseError if
+    a line can't be broken into fields.
+    """
+    if isinstance(source, basestring):
+        source = source.splitlines(True)
+    symbols = SymbolTable(allow_external=True)
+    line_number = 1
+    mem_address = None  # In case there is no .ORG statement, need to detect
+    code = []
+    includes = []
+    errors = []
+
+    # First pass, assemble as much as possible.  Build symbol table
+    for line in source:
+        try:
+            a = AsmLine(line, line_number, mem_address, symbols)
+        except SyntaxError, se:
+            errors.append(se)
+            if len(errors) > MAX_SYNTAX_ERRORS:
+                break
+        else:
+            code.append(a)
+            mem_address = a.next_mem_address()
+            if a.include_name:
+                includes.append((a.include_name, line_number))
+        line_number += 1
+
+    if errors:
+        raise AssemblyError(errors)
+
+    # Second pass, fill in the words that use labels
+    code.sort()
+    entries = []
+    labels = {}
+    for c in code:
+        c.assemble()
+        if c.label and c.opcode != '.EQU':
+            labels[c.label] = c.mem_address
+        if c.word1 != None:
+            words = [c.word1]
+            if c.word2 != None:
+                words.append(c.word2)
+            # each .list line is "%04X %04X" of the address and word, then
+            # the text
+            texts = [s[9:] for s in str(c).split("\n")]
+            entries.append((c.mem_address, c.line_number, words, texts))
+    return ObjectModule(name, entries,
+                        dict((label, (value, symbols.lines[label]))
+                             for (label, value) in symbols.table.items()),
+                        labels, symbols.external_references, includes)
+
+class ObjectCache:
+    """A directory of ObjectModules, each named by the SHA-1 of the source
+    text it was assembled from.  A file that hasn't changed since it was
+    last assembled (under any name, for any program that includes it) is
+    read back rather than assembled again.  The key covers the object
+    format and the instruction set too, so objects an as240 with other
+    opcodes wrote aren't used.  Several processes can share a directory.
+        hits, misses : how many modules were read back and assembled
+    """
+
+    stamp = "as240 object %d %r %r\n" % (OBJECT_FORMAT,
+                                         sorted(opcode_templates.items()),
+                                         sorted(long_instructions))
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, text):
+        """ The file the object module for source text is kept in """
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        key = hashlib.sha1(self.stamp + text).hexdigest()
+        return os.path.join(self.directory, key + ".obj")
+
+    def module(self, text, name):
+        """ The ObjectModule for source text (of the file called name), from
+        the cache if it is there, else assembled and added to it.
+        Raises AssemblyError and ParseError as assemble_module() does.
+        """
+        path = self.path(text)
+        try:
+            with open(path, 'r') as fh:
+                module = ObjectModule.from_json(fh.read(), name)
+            self.hits += 1
+            return module
+        except (IOError, ValueError, KeyError, TypeError):
+            pass   # not there yet, or not readable: assembled again
+        module = assemble_module(text, name)
+        self.misses += 1
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # written under a temporary name, so no process reads half of it
+            (fd, temp_name) = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(module.to_json())
+            os.rename(temp_name, path)
+        except (IOError, OSError):
+            pass   # a cache that can't be written only costs the time
+        return module
+
+def link(modules):
+    """ Link object modules into one program.  The words that hold a label
+    one module uses and another declares get its value, and the words of
+    all of them are put together in address order.  modules[0] is the
+    program; the rest are the files it includes.  Returns the Image.
+    Raises AssemblyError if a label is declared in more than one module,
+    or used but declared in none, or if two modules put words at the same
+    address.
+    """
+    def file_name(module):  # for errors, which don't name the program
+        if module is modules[0]:
+            return None
+        return module.name
+
+    def description(module):
+        return file_name(module) or "the program"
+
+    symbols = SymbolTable()
+    declared_in = {}
+    labels = {}
+    errors = []
+    for m in modules:
+        for (label, (value, line_number)) in sorted(m.symbols.items(),
+                                                    key=lambda s: s[1][1]):
+            if label in declared_in:
+                errors.append(SyntaxError(line_number, "Duplicate label (" +
+                              label + ").  Label has already been declared " +
+                              "in " + description(declared_in[label]) + ".",
+                              file_name(m)))
+            else:
+                symbols.add_label(label, value, line_number)
+                declared_in[label] = m
+        labels.update(m.labels)
+
+    owners = {}
+    for m in modules:
+        for (address, line_number, words, texts) in m.entries:
+            for a in range(address, address + len(words)):
+                if owners.get(a, m) is not m:
+                    errors.append(SyntaxError(line_number, "Address " +
+                                  "%04X is also used by " % a +
+                                  description(owners[a]) + ".",
+                                  file_name(m)))
+                owners[a] = m
+
+    entries = []
+    for m in modules:
+        values = {}
+        for (address, label, line_number) in m.references:
+            if label in symbols.table:
+                values[address] = symbols.table[label]
+            else:
+                errors.append(SyntaxError(line_number, "The label " + label +
+                              " has not been defined anywhere.",
+                              file_name(m)))
+        for (address, line_number, words, texts) in m.entries:
+            if values:
+                words = [values.get(address + i, w)
+                         for (i, w) in enumerate(words)]
+            entries.append((address, line_number, words, texts, m.name))
+
+    if errors:
+        raise AssemblyError(errors[:MAX_SYNTAX_ERRORS + 1])
+    entries.sort(key=lambda e: e[0])  # stable: the program's words first
+    return Image(entries, symbols, labels)
+
+class Image:
+    """An assembled program, as data rather than .list and memory file text.
+        words   : (address, word) for every word of the program, in address
+                  order (the words of the .list file)
+        symbol_table : the program's SymbolTable
+        symbols : label -> value, for every entry of the symbol table
+        labels  : label -> address, for the labels that mark an address
+                  (every symbol but those defined with .EQU)
+        lines   : address -> line number of the source line the word at
+                  that address was assembled from
+        files   : address -> the file that line is in (None for source
+                  given as a string)
+        entries : (address, line number, words, list texts, file) for each
+                  source line with words, in address order (see ObjectModule)
+    """
+
+    def __init__(self, entries, symbol_table, labels):
+        self.entries = entries
+        self.symbol_table = symbol_table
+        self.symbols = symbol_table.table
+        self.labels = labels
+        self.words = []
+        self.lines = {}
+        self.files = {}
+        for (address, line_number, words, texts, file_name) in entries:
+            for (i, word) in enumerate(words):
+                self.words.append((address + i, word))
+                self.lines[address + i] = line_number
+                self.files[address + i] = file_name
+
+    def list_lines(self):
+        """ The lines of the .list file, after its heading """
+        return ["%04X %04X%s" % (address + i, word, texts[i])
+                for (address, line_number, words, texts, file_name)
+                in self.entries
+                for (i, word) in enumerate(words)]
+
+    def memory_lines(self):
+        """ The memory file, a line for each source line with words (a
+        second word goes on a line of its own).  Words that are zero are
+        left out, so a line may be blank.
+        """
+        ret_val = []
+        FORMAT_STRING = "%04X %04X"
+        for (address, line_number, words, texts, file_name) in self.entries:
+            line = ""
+            if words[0]:
+                line = FORMAT_STRING % (address, words[0])
+            if len(words) > 1 and words[1]:
+                line += "\n" + FORMAT_STRING % (address + 1, words[1])
+            ret_val.append(line)
+        return ret_val
+
+def assemble(source, name=None, cache=None):
+    """ Assemble a program, given its source as a string or as lines (an
+    open .asm file will do), and link it with the files it .INCLUDEs (and
+    they include, each once).  An included file is found relative to the
+    file that includes it: name, for the program, or the current directory
+    if it has none.  Returns its Image.
+    With cache, an ObjectCache, files that haven't changed since they were
+    last assembled aren't assembled again.
+    Raises AssemblyError if any line has a syntax error (an undefined label
+    included), and ParseError if a line can't be broken into fields.
+    The program gets a SymbolTable of its own, so assemble() can be called
+    for one program after another, or from several threads at once.
+    """
+    if not isinstance(source, basestring):
+        source = "".join(source)
+    modules = [object_module(source, name, cache)]
+    included = set()
+    if name:
+        included.add(os.path.realpath(name))
+    for m in modules:      # modules grows as their includes are found
+        directory = os.path.dirname(m.name or "")
+        for (include_name, line_number) in m.includes:
+            path = os.path.join(directory, include_name)
+            if os.path.realpath(path) in included:
+                continue
+            included.add(os.path.realpath(path))
+            try:
+                with open(path, 'r') as fh:
+                    text = fh.read()
+            except IOError:
+                raise AssemblyError([SyntaxError(line_number,
+                                     "The included file " + include_name +
+                                     " can't be read.",
+                                     None if m is modules[0] else m.name)])
+            try:
+                modules.append(object_module(text, path, cache))
+            except AssemblyError, ae:
+                for se in ae.errors:
+                    se.file_name = path
+                raise
+            except ParseError, pe:
+                pe.file_name = path
+                raise
+    return link(modules)
+
+def object_module(text, name, cache):
+    if cache is None:
+        return assemble_module(text, name)
+    return cache.module(text, name)
+
 
 # Command line processing
 # -h, --help	Provide short help text and usage information
@@ -978,19 +1177,32 @@ class SymbolTable:
 # -s [<filename>]	Output the symbol list as <basename>.sym or <filename> if specified
 # -	Send .list output to stdout (for piping into sim240) rather than a file.
 # -version	Print the version of as240 and quit.
+# -j, --jobs N	Assemble every .asm file under the arguments (directories or
+#    files) in N processes (0 for one per core), writing <basename>.list,
+#    <basename>.hex and <basename>.sym next to each, then print a summary.
+# -c, --cache DIRECTORY	Keep the object module of each file assembled in
+#    DIRECTORY, keyed by a hash of its text, and read it back rather than
+#    assembling the file again while the text is unchanged (the default is
+#    $AS240_CACHE, if it is set).
+# .INCLUDE <filename> in a file assembles that file (relative to the one
+#    including it) on its own, and links the two: labels declared in one
+#    can be used in the other.  Each file keeps its own .ORG sections.
 # If syntax errors are encountered, up to 5 will be printed on SYSERR.  The
 #    the assembler will be terminated and the number of syntax errors set as
-#    the exit code
+#    the exit code.  With --jobs, the exit code is 1 if any file had errors.
 
 def parse_command_line():
     """Deep and thorough parsing of command line options.
 
     Do all command line processing.  Read the ASM file.
     Returns:
-        asm_data : A string with the entire contents of the assembly file
-        file_list, file_mem, file_sym : file objects for the output files
+        options : the parsed options (options.trees holds the arguments
+                  for --jobs)
+        files : file_asm, file_list, file_mem, file_sym, file objects for
+                the assembly file and the output files (None for --jobs)
     """
-    usage = "usage: %prog [options] ASM_FILE"
+    usage = ("usage: %prog [options] ASM_FILE\n"
+             "       %prog --jobs N DIRECTORY_OR_ASM_FILE...")
     program_version = "2.0"  # Perl version went to 1.5 or so
 
     parser = OptionParser(usage=usage, version="%prog " + program_version)
@@ -1016,8 +1228,34 @@ def parse_command_line():
                       help="list file will be output to STDOUT.  \
                             No other files created",
                       default=False)
+    parser.add_option("-j", "--jobs",
+                      dest="jobs",
+                      metavar = "N",
+                      type="int",
+                      help="Assemble every .asm file in the given directories \
+                            (and their subdirectories) in N processes, 0 for \
+                            one per core.  Each gets .list, .hex and .sym \
+                            files next to it.  Prints a summary of syntax \
+                            errors",
+                      default=None)
+    parser.add_option("-c", "--cache",
+                      dest="cache",
+                      metavar = "DIRECTORY",
+                      help="Keep object modules in DIRECTORY, and use them \
+                            for files (the program or ones it includes) \
+                            that haven't changed rather than assembling \
+                            them again.  Defaults to $AS240_CACHE",
+                      default=os.environ.get("AS240_CACHE"))
 
     (options, args) = parser.parse_args()
+    if options.jobs is not None:
+        if len(args) == 0:
+            parser.error("incorrect number of arguments")
+        if options.jobs < 0:
+            parser.error("--jobs can't be negative")
+        options.trees = args
+        return [options, None]
+
     if len(args) > 1:
         parser.error("incorrect number of arguments")
     if (len(args) == 0) and not (options.output_to_stdout):
@@ -1056,56 +1294,129 @@ def parse_command_line():
         else:
             file_sym = open('/dev/null', 'w')
 
-    return [file_asm, file_list, file_mem, file_sym]
+    return [options, [file_asm, file_list, file_mem, file_sym]]
 
-def main():
+def write_image(image, file_list, file_mem, file_sym):
+    """ Write an assembled program out as its .list, memory and symbol
+    files, and close them.
+    """
+    # Print the symbol table
+    print(image.symbol_table.printable_string(), file=file_sym)
+    file_sym.close()
 
-    (file_asm, file_list, file_mem, file_sym) =  parse_command_line()
+    print("addr data  label   opcode  operands", file=file_list)
+    print("---- ----  -----   ------  --------", file=file_list)
 
-    line_number = 1
-    mem_address = None  # In case there is no .ORG statement, need to detect
-    code = []
-    syntax_errors = 0
-    MAX_SYNTAX_ERRORS = 5
+    for s in image.list_lines():
+        print(s, file=file_list)
+    for s in image.memory_lines():
+        print(s, file=file_mem)
 
-    # First pass, assemble as much as possible.  Build symbol table
-    for line in file_asm:
-        try:
-            a = AsmLine(line, line_number, mem_address)
-        except SyntaxError, se:
-            syntax_errors += 1
-            print(se, file=sys.stderr)
-            if syntax_errors > MAX_SYNTAX_ERRORS:
-                sys.exit(syntax_errors)
-
-        code.append(a)
-        line_number += 1
-        mem_address = a.next_mem_address()
+    file_list.close()
+    file_mem.close()
 
-    if syntax_errors > 0:
-        sys.exit(syntax_errors)
+def find_asm_files(trees):
+    """ Return the .asm files in each of trees (directories, searched all
+    the way down, or files, taken as they are), in sorted order.
+    """
+    asm_names = []
+    for tree in trees:
+        if not os.path.isdir(tree):
+            asm_names.append(tree)
+            continue
+        for (dirpath, dirnames, filenames) in os.walk(tree):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".asm"):
+                    asm_names.append(os.path.join(dirpath, filename))
+    return asm_names
+
+def assemble_file(asm_name, cache=None):
+    """ Assemble one file of a --jobs batch, writing <basename>.list,
+    <basename>.hex and <basename>.sym next to it.  As for a single file,
+    the output files are left empty if it has syntax errors.  cache is an
+    ObjectCache, or None.
+    Returns (asm_name, errors): the messages of its syntax errors, with a
+    ParseError, or the file not being readable, counted as one.
+    """
+    basefile = asm_name[:asm_name.rfind('.')]
+    try:
+        file_asm = open(asm_name, 'r')
+    except IOError, e:
+        return (asm_name, [str(e)])
+    file_list = open(basefile + ".list", 'w')
+    file_mem = open(basefile + ".hex", 'w')
+    file_sym = open(basefile + ".sym", 'w')
+    try:
+        image = assemble(file_asm, asm_name, cache)
+    except AssemblyError, ae:
+        errors = [str(se) for se in ae.errors]
+    except ParseError, pe:
+        errors = [str(pe)]
+    else:
+        errors = []
+        write_image(image, file_list, file_mem, file_sym)
+    finally:
+        for f in [file_asm, file_list, file_mem, file_sym]:
+            f.close()
+    return (asm_name, errors)
+
+def assemble_tree(trees, jobs, cache=None):
+    """ Assemble every .asm file in trees, spread over a pool of jobs
+    processes (one per core if jobs is 0), sharing cache (an ObjectCache,
+    or None), then print a summary: each
+    file's syntax error count, its errors under it, and the totals.
+    Returns the number of files that had errors.
+    """
+    asm_names = find_asm_files(trees)
+    if jobs == 0:
+        jobs = cpu_count()
+    jobs = max(1, min(jobs, len(asm_names)))
+    # a few chunks per process evens out files of different lengths
+    chunk = max(1, len(asm_names) // (jobs * 4))
+
+    pool = Pool(jobs)
+    failed = 0
+    total_errors = 0
+    for (asm_name, errors) in pool.imap(partial(assemble_file, cache=cache),
+                                        asm_names, chunk):
+        if errors:
+            failed += 1
+            total_errors += len(errors)
+            print("%s: %d syntax error%s" % (asm_name, len(errors),
+                                             "" if len(errors) == 1 else "s"))
+            for e in errors:
+                print("    " + e)
+        else:
+            print("%s: assembled" % asm_name)
+    pool.close()
+    pool.join()
 
-    file_asm.close()
-    # Print the symbol table
-    print(SymbolTable.printable_string(), file=file_sym)
-    file_sym.close()
+    print("Assembled %d of %d files in %d process%s; %d with syntax errors "
+          "(%d errors)" % (len(asm_names) - failed, len(asm_names), jobs,
+                           "" if jobs == 1 else "es", failed, total_errors))
+    return failed
 
-    code.sort()
-    if syntax_errors == 0:
-        print("addr data  label   opcode  operands", file=file_list)
-        print("---- ----  -----   ------  --------", file=file_list)
+def main():
 
-        for c in code:
-            c.assemble()
-            s = str(c)
-            if s != "":
-                print(s, file=file_list)
-                print(c.mem_str(), file=file_mem)
+    (options, files) = parse_command_line()
+    cache = None
+    if options.cache:
+        cache = ObjectCache(options.cache)
+    if options.jobs is not None:
+        failed = assemble_tree(options.trees, options.jobs, cache)
+        sys.exit(1 if failed else 0)
 
-    file_list.close()
-    file_mem.close()
+    (file_asm, file_list, file_mem, file_sym) = files
+    try:
+        image = assemble(file_asm, options.afile, cache)
+    except AssemblyError, ae:
+        for se in ae.errors:
+            print(se, file=sys.stderr)
+        sys.exit(len(ae.errors))
 
-sys.dont_write_bytecode = True
+    file_asm.close()
+    write_image(image, file_list, file_mem, file_sym)
 
 if __name__ == '__main__':
     main()
@@ -2,9 +2,7 @@
 """Unit test for as240 stuff"""
 
 import unittest
-from asmLine import AsmLine
-from as240_exceptions import ParseError
-from as240_exceptions import SyntaxError
+from as240 import AsmLine, SymbolTable, ParseError, SyntaxError
 
 class ParseGoodLines(unittest.TestCase):
     
@@ -173,6 +171,15 @@ class ParseGoodLines(unittest.TestCase):
         self.assertEqual(a.operand2, 'R2')
         self.assertTrue(a.is_valid)
 
+    def testLabel2OperandsComment(self):
+        """A label, opcode and 2 operands can be followed by a comment"""
+        a = AsmLine("LOOP  add\tr1 ,r2  ; add them", 0, 0)
+        self.assertEqual(a.label, 'LOOP')
+        self.assertEqual(a.opcode, 'ADD')
+        self.assertEqual(a.operand1, 'R1')
+        self.assertEqual(a.operand2, 'R2')
+        self.assertTrue(a.is_valid)
+
 class ParseBadLines(unittest.TestCase):
 
     def testBadNumFields(self):
@@ -239,6 +246,15 @@ class ParseBadLines(unittest.TestCase):
         """Operands must be separated by a comma, not a dash"""
         self.assertRaises(ParseError, AsmLine, "Label  AND Operand1 _ Operand2", 15, 0)
 
+    def testBadOperandSeparator3(self):
+        """Operands must not be empty on either side of the comma"""
+        self.assertRaises(ParseError, AsmLine, "Label  AND , Operand2", 16, 0)
+        self.assertRaises(ParseError, AsmLine, "Label  AND Operand1 ,", 17, 0)
+
+    def testBadOperandSeparator4(self):
+        """Only one comma separates the operands"""
+        self.assertRaises(ParseError, AsmLine, "Label  AND R1 ,, R2", 18, 0)
+
 class ParseBadSemantics(unittest.TestCase):
 
     def rotate_list(self, l):
@@ -436,10 +452,31 @@ class ParseBadSemantics(unittest.TestCase):
         a = AsmLine('Jimmy .EQU $FFFF' , 1, 12)
         self.assertTrue(a.is_valid)
 
+    def testPseudoINCLUDE(self):
+        """No label is allowed on a .INCLUDE pseudo instruction line"""
+        self.assertRaises(SyntaxError, AsmLine, "Lib .INCLUDE lib.asm", 1, 1)
+
+    def testPseudoINCLUDE2(self):
+        """Operand cannot be blank on .INCLUDE pseudo instruction line"""
+        self.assertRaises(SyntaxError, AsmLine, "   .INCLUDE  ", 1, 1)
+
+    def testPseudoINCLUDE3(self):
+        """Cannot have 2 operands on .INCLUDE pseudo instruction line"""
+        self.assertRaises(SyntaxError, AsmLine, "   .INCLUDE a.asm, b.asm", 1, 1)
+
+    def testPseudoINCLUDE_Good(self):
+        """The .INCLUDE file name keeps its case, and takes no memory"""
+        a = AsmLine('  .include "Lib/Math.asm"  ; shared', 1, 12)
+        self.assertTrue(a.is_valid)
+        self.assertEqual(a.include_name, 'Lib/Math.asm')
+        self.assertEqual(a.next_mem_address(), 12)
+
     def testDuplicateLabels(self):
         """A label may not be declared twice"""
-        a = AsmLine('StarWars .EQU $FF00', 1, 14)
-        self.assertRaises(SyntaxError, AsmLine, "StarWars LDA R2, $14", 2, 24)
+        symbols = SymbolTable()
+        a = AsmLine('StarWars .EQU $FF00', 1, 14, symbols)
+        self.assertRaises(SyntaxError, AsmLine, "StarWars LDA R2, $14", 2, 24,
+                          symbols)
 
     
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+#! /usr/bin/python
+"""Unit test for assemble() and assembling a tree of files"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from as240 import assemble, assemble_file, find_asm_files
+from as240 import assemble_module, link, ObjectCache
+from as240 import AssemblyError, OpcodeInfo
+import isa240   # importable once as240 is
+
+PROGRAM = """        .ORG $100
+START   LDI  R1, $3
+LOOP    DECR R1
+        BRZ  DONE
+        BRA  LOOP
+DONE    STOP
+COUNT   .EQU $2A
+"""
+
+class Assemble_test(unittest.TestCase):
+
+    def testImage(self):
+        """The image holds every word, the symbols, labels and line map."""
+        image = assemble(PROGRAM)
+        self.assertEqual(image.words[0], (0x100, 0x0C09))
+        self.assertEqual(image.words[1], (0x101, 0x0003))
+        self.assertEqual(len(image.words), 8)
+        self.assertEqual(image.symbols['COUNT'], 0x2A)
+        self.assertNotIn('COUNT', image.labels)
+        self.assertEqual(image.labels['DONE'], 0x107)
+        self.assertEqual(image.lines[0x105], 5)
+
+    def testBackToBack(self):
+        """A program can be assembled again, without duplicate labels."""
+        first = assemble(PROGRAM)
+        second = assemble(PROGRAM)
+        self.assertEqual(first.words, second.words)
+        self.assertEqual(first.symbols, second.symbols)
+
+    def testConcurrent(self):
+        """Programs assembled at the same time keep their labels apart."""
+        images = {}
+        def run(n):
+            source = PROGRAM.replace("$100", "$%X" % (n * 0x100))
+            for i in range(20):
+                images[n] = assemble(source)
+        threads = [threading.Thread(target=run, args=(n,))
+                   for n in range(1, 5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for n in range(1, 5):
+            self.assertEqual(images[n].labels['START'], n * 0x100)
+
+    def testSyntaxErrors(self):
+        """Syntax errors are raised together, an undefined label included."""
+        try:
+            assemble(" .ORG $0\n BAD R1\n ADD R1\n")
+            self.fail("no AssemblyError")
+        except AssemblyError, ae:
+            self.assertEqual([e.line_number for e in ae.errors], [2, 3])
+        try:
+            assemble(" .ORG $0\n BRA NOWHERE\n")
+            self.fail("no AssemblyError")
+        except AssemblyError, ae:
+            self.assertEqual(len(ae.errors), 1)
+
+LIBRARY = """        .ORG $200
+DOUBLE  ADD  R1, R1
+        BRA  DONE
+TWO     .EQU $2
+"""
+
+MAIN = """        .INCLUDE lib.asm
+        .ORG $0
+START   LDI  R1, TWO
+        JSR  DOUBLE
+DONE    STOP
+"""
+
+class Link_test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.main = os.path.join(self.dir, "main.asm")
+        self.lib = os.path.join(self.dir, "lib.asm")
+        open(self.main, "w").write(MAIN)
+        open(self.lib, "w").write(LIBRARY)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testInclude(self):
+        """Labels are resolved both ways between a program and its include."""
+        image = assemble(open(self.main), self.main)
+        words = dict(image.words)
+        self.assertEqual(words[0x3], 0x200)     # JSR DOUBLE
+        self.assertEqual(words[0x202], 0x4)     # BRA DONE
+        self.assertEqual(image.labels['DOUBLE'], 0x200)
+        self.assertEqual(image.symbols['TWO'], 0x2)
+        self.assertEqual(image.files[0x200], self.lib)
+        self.assertEqual(image.files[0x0], self.main)
+        self.assertEqual(image.lines[0x200], 2)
+
+    def testModule(self):
+        """A module leaves the labels it doesn't declare to the linker."""
+        module = assemble_module(LIBRARY, "lib.asm")
+        self.assertEqual(module.references, [(0x202, 'DONE', 3)])
+        self.assertEqual(module.symbols['TWO'], (0x2, 4))
+        image = link([assemble_module(MAIN), module])
+        self.assertEqual(dict(image.words)[0x202], 0x4)
+
+    def testLinkErrors(self):
+        """Errors in an included file name it; the program's don't."""
+        open(self.lib, "w").write(LIBRARY + " BRA NOWHERE\n")
+        try:
+            assemble(open(self.main), self.main)
+            self.fail("no AssemblyError")
+        except AssemblyError, ae:
+            self.assertEqual(ae.errors[0].file_name, self.lib)
+            self.assertEqual(ae.errors[0].line_number, 5)
+        try:
+            assemble(MAIN + "DOUBLE .DW $1\n .INCLUDE gone.asm\n", self.main)
+            self.fail("no AssemblyError")
+        except AssemblyError, ae:
+            self.assertEqual(len(ae.errors), 1)
+            self.assertEqual(ae.errors[0].line_number, 7)
+        os.remove(self.lib)
+        try:
+            link([assemble_module(MAIN), assemble_module(LIBRARY, "lib.asm"),
+                  assemble_module(" .ORG $201\nTWO .EQU $3\n .DW $5\n",
+                                  "x.asm")])
+            self.fail("no AssemblyError")
+        except AssemblyError, ae:
+            self.assertEqual([(e.file_name, e.line_number)
+                              for e in ae.errors],
+                             [("x.asm", 2), ("x.asm", 3)])
+
+    def testCache(self):
+        """Files that haven't changed are read back, not assembled again."""
+        cache = ObjectCache(os.path.join(self.dir, "cache"))
+        first = assemble(open(self.main), self.main, cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        second = assemble(open(self.main), self.main, cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(first.words, second.words)
+        self.assertEqual(first.list_lines(), second.list_lines())
+        self.assertEqual(second.files[0x200], self.lib)
+        assemble(MAIN.replace("$0", "$10"), self.main, cache)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+class ISA_test(unittest.TestCase):
+
+    def testOpcodes(self):
+        """The opcodes are the shared ISA's instructions, and decode back."""
+        self.assertEqual(sorted(OpcodeInfo.opcode_info), isa240.instructions)
+        for opcode in isa240.instructions:
+            word = isa240.encode(opcode, 5, 3)
+            self.assertEqual(isa240.decode_states[word >> isa240.opcode_shift],
+                             opcode)
+
+    def testEncoding(self):
+        """Register fields go where the shared ISA puts them."""
+        image = assemble(" .ORG $0\n ADD R5, R3\n STA $10, R6\n")
+        self.assertEqual(image.words[0][1], isa240.encode('ADD', 5, 3))
+        self.assertEqual(image.words[1][1], isa240.encode('STA', 6, 6))
+        self.assertEqual(image.words[2][1], 0x10)
+
+class AssembleTree_test(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tree, "sub"))
+        open(os.path.join(self.tree, "good.asm"), "w").write(PROGRAM)
+        open(os.path.join(self.tree, "sub", "bad.asm"), "w").write(
+            " .ORG $0\n BAD R1\n")
+        open(os.path.join(self.tree, "notes.txt"), "w").write("not asm\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def testFindFiles(self):
+        """Every .asm file in the tree is found, subdirectories included."""
+        names = find_asm_files([self.tree])
+        self.assertEqual(names, [os.path.join(self.tree, "good.asm"),
+                                 os.path.join(self.tree, "sub", "bad.asm")])
+
+    def testAssembleFile(self):
+        """Each file gets its outputs, or its syntax errors counted."""
+        good = os.path.join(self.tree, "good.asm")
+        self.assertEqual(assemble_file(good), (good, []))
+        list_lines = open(os.path.join(self.tree, "good.list")).readlines()
+        self.assertEqual(len(list_lines), 10)
+        self.assertTrue(os.path.exists(os.path.join(self.tree, "good.hex")))
+        self.assertTrue(os.path.exists(os.path.join(self.tree, "good.sym")))
+        bad = os.path.join(self.tree, "sub", "bad.asm")
+        (name, errors) = assemble_file(bad)
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
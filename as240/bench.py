@@ -0,0 +1,153 @@
+#!/usr/bin/python
+"""Benchmark for as240 on large generated programs.
+
+Generates an assembly program of the given number of lines (100000 by
+default), shaped like generated test programs and macro-expanded sources:
+labelled and unlabelled instructions with every operand form, comments,
+blank lines and pseudo-operations.  It is run through an as240 module the
+way main() runs a file, and the first pass (breaking lines into fields and
+validating them) and the second pass (assembling and formatting the .list
+and memory lines) are timed separately, best of the repeats.  Both are
+reported in lines/sec.
+
+To Run : python bench.py [options]       (python bench.py -h for options)
+To compare against an older version of the assembler, check it out to a
+file (for example git show HEAD~1:as240/as240.py > old_as240.py) and pass
+it with -m.  -o writes the generated program out, to time as240 itself.
+"""
+
+from __future__ import print_function
+from optparse import OptionParser
+from time import time
+from os import path
+import imp
+import sys
+
+sys.dont_write_bytecode = True
+
+LINES_PER_SECTION = 1000  # lines between .ORG statements
+
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option("-m", "--module", dest="module",
+                      default=path.join(path.dirname(path.abspath(__file__)),
+                                        "as240.py"),
+                      help="as240 module to benchmark")
+    parser.add_option("-n", "--lines", dest="lines", type="int",
+                      default=100000, help="lines in the generated program")
+    parser.add_option("-r", "--repeats", dest="repeats", type="int",
+                      default=3, help="runs of each pass, best is kept")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="also write the generated program to this file")
+    (options, args) = parser.parse_args()
+    return options
+
+
+def generate_program(num_lines):
+    """ Return the lines of a program num_lines long.  Each section starts
+    with a .ORG (sections overlap in memory, which as240 allows) and labels
+    are numbered by line, so they are all different.
+    """
+    lines = []
+    i = 0
+    while len(lines) < num_lines:
+        if i % LINES_PER_SECTION == 0:
+            lines.append("        .ORG    $%04X\n" %
+                         ((i // LINES_PER_SECTION * 0x800) & 0xF000))
+        kind = i % 10
+        if kind == 0:
+            lines.append("L%d      LDI     R%d, $%X     ; load\n" %
+                         (i, i % 8, i & 0xFFF))
+        elif kind == 1:
+            lines.append("        ADD     R1, R2\n")
+        elif kind == 2:
+            lines.append("        ; a comment line\n")
+        elif kind == 3:
+            lines.append("        BRZ     L%d\n" % (i - 3))
+        elif kind == 4:
+            lines.append("\n")
+        elif kind == 5:
+            lines.append("        STA     L%d, R3\n" % (i - 5))
+        elif kind == 6:
+            lines.append("C%d      .EQU    $%X\n" % (i, i & 0xFFFF))
+        elif kind == 7:
+            lines.append("D%d      .DW     $%X\n" % (i, i & 0xFFFF))
+        elif kind == 8:
+            lines.append("        MOV     R4,R5       ; copy\n")
+        else:
+            lines.append("S%d      DECR    R6\n" % i)
+        i += 1
+    return lines[:num_lines]
+
+
+def first_pass(as240, lines):
+    """ Break every line into fields and validate it, building the symbol
+    table, as main() does.  Returns the AsmLines.
+    """
+    if "table" in vars(as240.SymbolTable):
+        # older versions, with one symbol table for the whole process
+        as240.SymbolTable.clear()
+        symbols = ()
+    else:
+        symbols = (as240.SymbolTable(),)
+    code = []
+    mem_address = None
+    line_number = 1
+    for line in lines:
+        a = as240.AsmLine(line, line_number, mem_address, *symbols)
+        code.append(a)
+        line_number += 1
+        mem_address = a.next_mem_address()
+    return code
+
+
+def second_pass(code):
+    """ Assemble the lines and format them for the .list and memory files,
+    as main() does.  Returns the number of .list lines.
+    """
+    code.sort()
+    list_lines = []
+    mem_lines = []
+    for c in code:
+        c.assemble()
+        s = str(c)
+        if s != "":
+            list_lines.append(s)
+            mem_lines.append(c.mem_str())
+    return len(list_lines)
+
+
+def main():
+    options = parse_args()
+    as240 = imp.load_source("as240_bench", options.module)
+    lines = generate_program(options.lines)
+    if options.output:
+        with open(options.output, "w") as fh:
+            fh.writelines(lines)
+
+    best_first = None
+    best_second = None
+    for i in range(options.repeats):
+        start = time()
+        code = first_pass(as240, lines)
+        first_time = time() - start
+        start = time()
+        second_pass(code)
+        second_time = time() - start
+        if best_first is None or first_time < best_first:
+            best_first = first_time
+        if best_second is None or second_time < best_second:
+            best_second = second_time
+
+    print(options.module)
+    print("%-12s %9s %12s" % ("pass", "time", "lines/sec"))
+    for (name, seconds) in [("fields", best_first),
+                            ("assembly", best_second),
+                            ("total", best_first + best_second)]:
+        print("%-12s %8.3fs %12.0f" % (name, seconds, len(lines) / seconds))
+    print("%d lines" % len(lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# isa240.py: the p18240 instruction set, shared by as240 and sim240
+#
+# The first word of an instruction holds its opcode in IR[15:6] and two
+# register fields, rd in IR[5:3] and rs in IR[2:0]. The opcode is also the
+# control state DECODE goes to (processor/constants.sv defines them as one
+# enum), so every encoding below is a control state's code. Long
+# instructions take a second word, an address or immediate value.
+#
+# state_code_text is the table as constants.sv writes it; everything else
+# is worked out from it once, at import, so encoding and decoding are
+# integer operations:
+#    word = opcode_templates["ADD"] | (rd << rd_shift) | (rs << rs_shift);
+#    state = decode_states[word >> opcode_shift];
+
+# control state codes (opcode_t in processor/constants.sv)
+state_code_text = {
+# Microcode operations (i.e., FSM states)
+   'FETCH'  : '00_0000_0000',
+   'FETCH1' : '00_0000_0001',
+   'FETCH2' : '00_0000_0010',
+   'DECODE' : '00_0000_0100',
+   'STOP'   : '00_1100_0000',
+   'STOP1'  : '00_1100_0001',
+
+# Load operations: MOV, LDA, LDR, LDI
+   'MOV'    : '00_1110_1000',
+   'LDA'    : '00_0001_0000',
+   'LDA1'   : '00_0001_0001',
+   'LDA2'   : '00_0001_0010',
+   'LDA3'   : '00_0001_0011',
+   'LDA4'   : '00_0001_0100',
+   'LDR'    : '00_0010_0000',
+   'LDR1'   : '00_0010_0001',
+   'LDR2'   : '00_0010_0010',
+   'LDI'    : '00_0011_0000',
+   'LDI1'   : '00_0011_0001',
+   'LDI2'   : '00_0011_0010',
+
+# Store operations: STA, STR
+   'STA'    : '00_0001_1000',
+   'STA1'   : '00_0001_1001',
+   'STA2'   : '00_0001_1010',
+   'STA3'   : '00_0001_1011',
+   'STA4'   : '00_0001_1100',
+   'STR'    : '00_0010_1000',
+   'STR1'   : '00_0010_1001',
+   'STR2'   : '00_0010_1010',
+
+# Branch operations: BRA, BRN, BRZ, BRC, BRV
+   'BRA'    : '00_1010_0000',
+   'BRA1'   : '00_1010_0001',
+   'BRA2'   : '00_1010_0010',
+   'BRN'    : '00_1011_0000',
+   'BRN1'   : '00_1011_0001',
+   'BRN2'   : '00_1011_0010',
+   'BRN3'   : '00_1011_0011',
+   'BRZ'    : '00_1010_1000',
+   'BRZ1'   : '00_1010_1001',
+   'BRZ2'   : '00_1010_1010',
+   'BRZ3'   : '00_1010_1011',
+   'BRC'    : '01_0010_0000',
+   'BRC1'   : '01_0010_0001',
+   'BRC2'   : '01_0010_0010',
+   'BRC3'   : '01_0010_0011',
+   'BRV'    : '00_1011_1000',
+   'BRV1'   : '00_1011_1001',
+   'BRV2'   : '00_1011_1010',
+   'BRV3'   : '00_1011_1011',
+
+# Arithmetic operations: ADD, SUB, INCR, DECR, NEG
+   'ADD'    : '00_0011_1000',
+   'SUB'    : '00_0100_0000',
+   'INCR'   : '00_0101_0000',
+   'DECR'   : '00_0101_1000',
+   'NEG'    : '00_0100_1000',
+   'NEG1'   : '00_0100_1001',
+
+# Logical operations: AND, NOT, OR, XOR
+   'AND'    : '00_0110_1000',
+   'NOT'    : '00_0110_0000',
+   'OR'     : '00_0111_0000',
+   'XOR'    : '00_0111_1000',
+
+# Comparison operations: CMI, CMR
+   'CMI'    : '01_0001_0000',
+   'CMI1'   : '01_0001_0001',
+   'CMI2'   : '01_0001_0010',
+   'CMR'    : '01_0001_1000',
+
+# Shift operations: ASHR, LSHL, LSHR, ROL
+   'ASHR'   : '00_1001_1000',
+   'LSHL'   : '00_1000_0000',
+   'LSHR'   : '00_1001_0000',
+   'ROL'    : '00_1000_1000',
+
+# Stack operations: JSR, LDSF, LDSP, POP, PUSH, RTN, STSF, STSP, ADDSP
+   'JSR'    : '00_1101_1000',
+   'JSR1'   : '00_1101_1001',
+   'JSR2'   : '00_1101_1010',
+   'JSR3'   : '00_1101_1011',
+   'JSR4'   : '00_1101_1100',
+   'JSR5'   : '00_1101_1101',
+   'LDSF'   : '01_0000_0000',
+   'LDSF1'  : '01_0000_0001',
+   'LDSF2'  : '01_0000_0010',
+   'LDSF3'  : '01_0000_0011',
+   'LDSF4'  : '01_0000_0100',
+   'LDSP'   : '00_1111_0000',
+   'POP'    : '00_1101_0000',
+   'POP1'   : '00_1101_0001',
+   'POP2'   : '00_1101_0010',
+   'PUSH'   : '00_1100_1000',
+   'PUSH1'  : '00_1100_1001',
+   'PUSH2'  : '00_1100_1010',
+   'RTN'    : '00_1110_0000',
+   'RTN1'   : '00_1110_0001',
+   'RTN2'   : '00_1110_0010',
+   'STSF'   : '01_0000_1000',
+   'STSF1'  : '01_0000_1001',
+   'STSF2'  : '01_0000_1010',
+   'STSF3'  : '01_0000_1011',
+   'STSF4'  : '01_0000_1100',
+   'STSP'   : '00_1111_1000',
+   'ADDSP'  : '00_0011_1100',
+   'ADDSP1' : '00_0011_1101',
+   'ADDSP2' : '00_0011_1110',
+};
+
+# IR fields: the opcode in IR[15:6], rd in IR[5:3] and rs in IR[2:0]
+opcode_shift = 6;
+rd_shift = 3;
+rs_shift = 0;
+reg_mask = 7;
+
+# control state name -> 10 bit code
+state_codes = dict([(name, int(code.replace("_", ""), 2))
+                    for (name, code) in state_code_text.items()]);
+
+# the instructions: the states DECODE goes to for an opcode (a state named
+# without a step number), other than fetching and decoding themselves
+instructions = sorted([name for name in state_codes
+                       if (not name[-1].isdigit() and
+                           name not in ["FETCH", "DECODE"])]);
+
+# instructions that take a second word
+long_instructions = frozenset(["ADDSP", "BRA", "BRC", "BRN", "BRV", "BRZ",
+                               "CMI", "JSR", "LDA", "LDI", "LDSF", "STA",
+                               "STSF"]);
+
+# instruction -> its first word with both register fields 0
+opcode_templates = dict([(name, state_codes[name] << opcode_shift)
+                         for name in instructions]);
+
+# IR[15:6] -> the state DECODE goes to. Any state's code is decoded as that
+# state, as the RTL does; values that aren't a code fall into the SV
+# default case, UNDEF.
+decode_states = ["UNDEF"] * 1024;
+for (name, code) in state_codes.items():
+   decode_states[code] = name;
+
+# Returns the first word of instruction name with registers rd and rs
+def encode(name, rd = 0, rs = 0):
+   return opcode_templates[name] | (rd << rd_shift) | (rs << rs_shift);
@@ -0,0 +1,3133 @@
+# sim240core.py: the p18240 simulator engine behind sim240
+# Adapted from sim240 (version 1.3) by Neil Ryan <nryan@andrew.cmu.edu>
+#
+# Importing this module has no side effects: all machine state (registers,
+# memory, labels, breakpoints, cycle count) lives in Simulator instances, so
+# several can run in one process. The tables below only describe the
+# processor and are shared by every instance.
+#
+#    sim = Simulator(randomize_memory = False);
+#    sim.load_program(open("gcd.list").readlines());
+#    sim.run();
+#    print(sim.read_state()["PC"]);
+from re import match, sub, findall, IGNORECASE
+from random import Random
+from array import array
+from binascii import unhexlify
+from struct import Struct, pack, unpack, calcsize
+from operator import itemgetter
+from os import stat
+from time import time
+from io import BufferedReader
+import gzip
+import json
+import sys
+
+# the instruction set (control state codes and decoding), shared with as240
+from isa240 import state_codes, decode_states
+from isa240 import opcode_shift, rd_shift, rs_shift, reg_mask
+
+wide_header = "Cycle STATE PC   IR   SP   ZNCV MAR  MDR  R0   R1   R2   R3   R4   R5   R6   R7";
+
+# keys are strings indicating menu option
+# values are regex's which match the input for the corresponding menu option
+menu = {
+   'quit'    : '^\s*(q(uit)?|exit)\s*$',
+   'help'    : '^\s*(\?|h(elp)?)\s*$',                         # ? ; h ; help
+   'reset'   : '^\s*reset\s*$',
+   'run'     : '^\s*r(un)?\s*(\d*)?\s*([qiu])?\s*$',           # run ; run 5u ; r 6i
+   'step'    : '^\s*s(tep)?$',                                 # s ; step
+   'ustep'   : '^\s*u(step)?\s*$',                             # u ; ustep
+   'break_cycle' : '^\s*break\s+cycle\s+(\d+)\s*$',           # break cycle [n]
+   'clear_cycle' : '^\s*clear\s+cycle\s+(\d+)\s*$',           # clear cycle [n]
+   'break'   : '^\s*break\s+(\'?\w+\'?|[0-9a-f]{1,4})(\s+if\s+(.*\S))?\s*$', # break [addr/label] (if [cond])
+   'clear'   : '^\s*clear\s+(\*|\'?\w+\'?|[0-9a-f]{1,4})\s*$', # clear [addr/label/*]
+   'watch'   : '^\s*watch\s+(\'?\w+\'?)(:(\'?\w+\'?))?(\s+(rw|r|w))?\s*$', # watch [lo](:[hi]) (r/w/rw)
+   'unwatch' : '^\s*unwatch\s+(\*|\'?\w+\'?)(:(\'?\w+\'?))?\s*$', # unwatch [lo](:[hi]) ; unwatch *
+   'lsbrk'   : '^\s*lsbrk\s*$',
+   'load'    : '^\s*load\s+([\w\.]+)\s*$',                     # load [file]
+   'save'    : '^\s*save\s+([\w\.]+)\s*$',                     # save [file]
+   'set_reg' : '^\s*(\*|pc|sp|ir|mar|mdr|z|c|v|n|r[0-7])\s*=\s*([0-9a-f]{1,4})$',
+   'get_reg' : '^\s*(\*|pc|sp|ir|mar|mdr|z|c|v|n|state|r[0-7*])\s*\?$',
+   'set_mem' : '^\s*m(em)?\[([0-9a-f]{1,4})\]\s*=\s*([0-9a-f]{1,4})$',   # m[10] = 0a10
+   'get_mem' : '^\s*m(em)?\[([0-9a-f]{1,4})(:([0-9a-f]{1,4}))?\]\s*\?$', # m[50]? ; mem[10:20]?
+   'check' : '^\s*check\s+([\w\.]+)\s*$', # check [state filename]
+   'labels' : '^\s*labels\s*$',
+   'stats'  : '^\s*stats\s*$',
+   'back'    : '^\s*back\s*$',
+   'uback'   : '^\s*uback\s*$',
+   'seek'    : '^\s*seek\s+(\d+)\s*$',                          # seek [cycle]
+   'history' : '^\s*history(\s+(\d+))?\s*$',                     # history [kb]
+   'snapshot' : '^\s*snapshot\s+(\w+)\s*$', # snapshot [name]
+   'restore' : '^\s*restore\s+(\w+)\s*$', # restore [name]
+   'profile': '^\s*profile(\s+(on|off|clear|save\s+[\w\.]+))?\s*$', # profile [on/off/clear/save file]
+};
+
+# Next state logic based on current state. Empty strings are states
+# dependent on flags
+nextState_logic = {
+   "FETCH" : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH1'],
+   "FETCH1": ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'FETCH2'],
+   "FETCH2": ['F_A',        'MDR', 'x',    'IR',    'NO_LOAD',    'NO_RD',    'NO_WR',    'DECODE'],
+   "DECODE": ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'NO_WR',    ""], #IR state
+   "LDI"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDI1'],
+   "LDI1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDI2'],
+   "LDI2"  : ['F_A',        'MDR', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "ADD"   : ['F_A_PLUS_B', 'REG', 'REG',  'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "SUB"   : ['F_A_MINUS_B','REG', 'REG',  'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "INCR"  : ['F_A_PLUS_1', 'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "DECR"  : ['F_A_MINUS_1','REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LDR"   : ['F_B',        'x',   'REG',  'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDR1'],
+   "LDR1"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDR2'],
+   "LDR2"  : ['F_A',        'MDR', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRA"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'BRA1'],
+   "BRA1"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'BRA2'],
+   "BRA2"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRN"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    ""], #BRN_next
+   "BRN1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRN2"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'BRN3'],
+   "BRN3"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRZ"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    ""], #BRZ_next
+   "BRZ1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRZ2"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'BRZ3'],
+   "BRZ3"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "STOP"  : ['F_A_MINUS_1','PC',  'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'STOP1'],
+   "STOP1" : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'NO_WR',    'STOP1'], # same as above
+   "BRC"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    ""], #BRC_next
+   "BRC1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRC2"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'BRC3'],
+   "BRC3"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRV"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    ""], #BRV_next
+   "BRV1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "BRV2"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'BRV3'],
+   "BRV3"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "AND"   : ['F_A_AND_B',  'REG', 'REG',  'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "NOT"   : ['F_A_NOT',    'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "OR"    : ['F_A_OR_B',   'REG', 'REG',  'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "XOR"   : ['F_A_XOR_B',  'REG', 'REG',  'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "CMI"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'CMI1'],
+   "CMI1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'CMI2'],
+   "CMI2"  : ['F_A_MINUS_B','REG', 'MDR',  'NONE',  'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "CMR"   : ['F_A_MINUS_B','REG', 'REG',  'NONE',  'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "ASHR"  : ['F_A_ASHR',   'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LSHL"  : ['F_A_SHL',    'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LSHR"  : ['F_A_LSHR',   'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "ROL"   : ['F_A_ROL',    'REG', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "MOV"   : ['F_B',        'x',   'REG',  'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LDA"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDA1'],
+   "LDA1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDA2'],
+   "LDA2"  : ['F_A',        'MDR', 'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDA3'],
+   "LDA3"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDA4'],
+   "LDA4"  : ['F_A',        'MDR', 'x',    'REG',   'LOAD_CC',    'NO_RD',    'NO_WR',    'FETCH'],
+   "STA"   : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STA1'],
+   "STA1"  : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'STA2'],
+   "STA2"  : ['F_A',        'MDR', 'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STA3'],
+   "STA3"  : ['F_B',        'x',   'REG',  'MDR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STA4'],
+   "STA4"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'MEM_WR',   'FETCH'],
+   "STR"   : ['F_A',        'REG', 'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STR1'],
+   "STR1"  : ['F_B',        'x',   'REG',  'MDR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STR2'],
+   "STR2"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'MEM_WR',   'FETCH'],
+   "JSR"   : ['F_A_MINUS_1','SP',  'x',    'SP',    'NO_LOAD',    'NO_RD',    'NO_WR',    'JSR1'],
+   "JSR1"  : ['F_A',        'SP',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'JSR2'],
+   "JSR2"  : ['F_A_PLUS_1', 'PC',  'x',    'MDR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'JSR3'],
+   "JSR3"  : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'MEM_WR',   'JSR4'],
+   "JSR4"  : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'JSR5'],
+   "JSR5"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LDSF"  : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDSF1'],
+   "LDSF1" : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDSF2'],
+   "LDSF2" : ['F_A_PLUS_B', 'MDR', 'SP',   'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'LDSF3'],
+   "LDSF3" : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'MEM_RD',   'NO_WR',    'LDSF4'],
+   "LDSF4" : ['F_A',        'MDR', 'x',    'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "LDSP"  : ['F_A',        'REG', 'x',    'SP',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "POP"   : ['F_A',        'SP',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'POP1'],
+   "POP1"  : ['F_A_PLUS_1', 'SP',  'x',    'SP',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'POP2'],
+   "POP2"  : ['F_A',        'MDR', 'x',    'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "PUSH"  : ['F_A_MINUS_1','SP',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'PUSH1'],
+   "PUSH1" : ['F_A',        'REG', 'x',    'MDR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'PUSH2'],
+   "PUSH2" : ['F_A_MINUS_1','SP',  'x',    'SP',    'NO_LOAD',    'NO_RD',    'MEM_WR',   'FETCH'],
+   "RTN"   : ['F_A',        'SP',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'RTN1'],
+   "RTN1"  : ['F_A_PLUS_1', 'SP',  'x',    'SP',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'RTN2'],
+   "RTN2"  : ['F_A',        'MDR', 'x',    'PC',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "STSF"  : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STSF1'],
+   "STSF1" : ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'STSF2'],
+   "STSF2" : ['F_A_PLUS_B', 'MDR', 'SP',   'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STSF3'],
+   "STSF3" : ['F_A',        'REG', 'x',    'MDR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'STSF4'],
+   "STSF4" : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'MEM_WR',   'FETCH'], # NOTE: bug exists is SV code. NO_LOAD exists twice.
+   "ADDSP" : ['F_A',        'PC',  'x',    'MAR',   'NO_LOAD',    'NO_RD',    'NO_WR',    'ADDSP1'],
+   "ADDSP1": ['F_A_PLUS_1', 'PC',  'x',    'PC',    'NO_LOAD',    'MEM_RD',   'NO_WR',    'ADDSP2'],
+   "ADDSP2": ['F_A_PLUS_B', 'MDR', 'SP',   'SP',    'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "STSP"  : ['F_A',        'SP',  'x',    'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "NEG"   : ['F_A_NOT',    'REG', 'x',    'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'NEG1'],
+   "NEG1"  : ['F_A_PLUS_1', 'REG', 'x',    'REG',   'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'],
+   "UNDEF" : ['x',          'x',   'x',    'NONE',  'NO_LOAD',    'NO_RD',    'NO_WR',    'FETCH'], # default case in SV
+};
+
+# ALU functions as Python expressions. A and B are the ALU inputs and C is
+# the current carry flag; the carry and overflow expressions may also use
+# the result, out. Both the microcoded engine (through alu_fns) and the
+# instruction-level engine are generated from this table.
+alu_exprs = {
+#  function          result                     carry                       overflow
+   'F_A'          : ('A',                       '0',                        '0'),
+   'F_A_PLUS_1'   : ('(A + 1) & 0xffff',        '(A + 1) >> 16',            '(~A & out & 0x8000) >> 15'),
+   'F_A_PLUS_B'   : ('(A + B) & 0xffff',        '(A + B) >> 16',            '((A ^ out) & (B ^ out) & 0x8000) >> 15'),
+   'F_A_PLUS_B_1' : ('(A + B + 1) & 0xffff',    '(A + B + 1) >> 16',        '((A ^ out) & (B ^ out) & 0x8000) >> 15'),
+   'F_A_MINUS_B'  : ('(A - B) & 0xffff',        '1 if (B >= A) else 0',     '((A ^ B) & (A ^ out) & 0x8000) >> 15'),
+   'F_A_MINUS_B_1': ('(A - B - 1) & 0xffff',    '1 if (B + 1 >= A) else 0', '((A ^ B) & (A ^ out) & 0x8000) >> 15'),
+   'F_A_MINUS_1'  : ('(A - 1) & 0xffff',        '1 if (A == 0) else 0',     '(~A & out & 0x8000) >> 15'),
+   'F_B'          : ('B',                       '0',                        '0'),
+   'F_A_NOT'      : ('~A & 0xffff',             '0',                        '0'),
+   'F_A_AND_B'    : ('A & B',                   '0',                        '0'),
+   'F_A_OR_B'     : ('A | B',                   '0',                        '0'),
+   'F_A_XOR_B'    : ('A ^ B',                   '0',                        '0'),
+   'F_A_SHL'      : ('(A << 1) & 0xffff',       '(A >> 14) & 1',            '0'),
+   'F_A_ROL'      : ('((A & 0x7fff) << 1) | C', 'A >> 15',                  '0'),
+   'F_A_LSHR'     : ('A >> 1',                  'A & 1',                    '0'),
+   'F_A_ASHR'     : ('(A & 0x8000) | (A >> 1)', 'A & 1',                    '0'),
+   'x'            : ('0',                       '0',                        '0'),
+};
+
+# states whose next state depends on a flag, and the flag they test
+branch_flags = {"BRN" : "N", "BRZ" : "Z", "BRC" : "C", "BRV" : "V"};
+
+# Substitutes Python expressions for the names (A, B, C, out, ...) used in
+# an alu_exprs entry. Arguments are the expression and a dict of names.
+def subst_alu_expr(expr, names):
+   return sub(r"\b(%s)\b" % "|".join(names),
+              lambda m: names[m.group(1)], expr);
+
+# Builds one Python function per ALU function from alu_exprs. Each takes
+# the two inputs and the carry flag as ints and returns
+# (result, carry, overflow). Returns a dict keyed by ALU function name.
+def compile_alu():
+   fns = {};
+   for name in alu_exprs:
+      (result, carry, overflow) = alu_exprs[name];
+      src = "def alu_fn(A, B, C):\n";
+      src += "   out = %s\n" % result;
+      src += "   return (out, %s, %s)\n" % (carry, overflow);
+      env = {};
+      exec(compile(src, "<alu %s>" % name, "exec"), env);
+      fns[name] = env["alu_fn"];
+   return fns;
+
+alu_fns = compile_alu();
+
+# Compiles nextState_logic into a list indexed by control state number, so
+# cycle() never builds or mutates anything. Each entry is a tuple:
+#  (alu_fn, srcA, srcB, dest, load_CC, mem_rd, mem_wr, next_state,
+#   branch_flag, branch_state)
+# alu_fn comes from compile_alu(). srcA/srcB/dest are keys into state,
+# "REG" for the register file or None when unused. next_state is None for
+# DECODE, which instead indexes decode_table with IR[15:6]. Branch states
+# go to branch_state when the flag named by branch_flag is set, otherwise
+# to next_state.
+# Returns (names, ids, microcode, decode_table).
+def compile_microcode():
+   names = sorted(nextState_logic.keys());
+   ids = {name: i for i, name in enumerate(names)};
+   microcode = [];
+   for name in names:
+      (alu_op, srcA, srcB, dest, load_CC, re, we, next_state) = \
+          nextState_logic[name];
+      branch_flag = None;
+      branch_state = None;
+      if (name == "DECODE"):
+         next_state = None;
+      elif (name in branch_flags):
+         branch_flag = branch_flags[name];
+         branch_state = ids[name + "2"];
+         next_state = ids[name + "1"];
+      else:
+         next_state = ids[next_state];
+      microcode.append((alu_fns[alu_op],
+                        None if (srcA == 'x') else srcA,
+                        None if (srcB == 'x') else srcB,
+                        None if (dest == 'NONE') else dest,
+                        load_CC == 'LOAD_CC', re == 'MEM_RD', we == 'MEM_WR',
+                        next_state, branch_flag, branch_state));
+
+   # IR[15:6] -> control state id
+   decode_table = [ids[name] for name in decode_states];
+   return (names, ids, microcode, decode_table);
+
+(ustate_names, ustate_ids, microcode, decode_table) = compile_microcode();
+fetch_id = ustate_ids["FETCH"];
+stop1_id = ustate_ids["STOP1"];
+# states that fetch and decode, before an instruction's own states
+fetch_ids = set([ustate_ids[name] for name in
+                 ["FETCH", "FETCH1", "FETCH2", "DECODE"]]);
+
+##################################################
+########## INSTRUCTION-LEVEL ENGINE ##############
+##################################################
+
+# When nobody is looking at microstates, step() runs a whole instruction
+# as one generated Python function instead of calling cycle() for each
+# microinstruction. The functions are generated from nextState_logic and
+# alu_exprs by following the microcode from each state DECODE can reach
+# back to FETCH (or STOP1), so registers, MAR/MDR, memory and cycle counts
+# come out exactly as cycle() would leave them. The code is compiled once;
+# each Simulator binds it to its own memory (see Simulator.bind_engine).
+
+# Python expressions for the ALU inputs in generated code
+engine_srcA = {'x' : '0', 'PC' : 'PC', 'SP' : 'SP', 'MDR' : 'MDR',
+               'REG' : 'r[ra]'};
+engine_srcB = {'x' : '0', 'PC' : 'PC', 'SP' : 'SP', 'MDR' : 'MDR',
+               'REG' : 'r[rb]'};
+
+# Python expression for the register field at shift in the instruction word
+# held in var, in generated code
+def ir_field(var, shift):
+   if (shift == 0):
+      return "%s & %d" % (var, reg_mask);
+   return "(%s >> %d) & %d" % (var, shift, reg_mask);
+
+# state keys held in locals by generated code
+engine_regs = ['PC', 'SP', 'IR', 'MAR', 'MDR', 'Z', 'N', 'C', 'V'];
+
+# Raised while generating code for a microcode path the engine doesn't
+# handle: one that reaches DECODE again or never gets back to FETCH.
+class NotCompilable(Exception):
+   pass;
+
+# Appends the Python statements for one control state to lines.
+# Arguments:
+#  * name of the control state, indent of the statements, and the set of
+#    engine_regs written so far (updated)
+def gen_uinstr(name, lines, indent, written):
+   (alu_op, srcA, srcB, dest, load_CC, re, we, next_state) = \
+       nextState_logic[name];
+   pad = " " * indent;
+   names = {'A' : engine_srcA[srcA], 'B' : engine_srcB[srcB]};
+   (result, carry, overflow) = alu_exprs[alu_op];
+
+   if (dest != 'NONE' or load_CC == 'LOAD_CC'):
+      lines.append(pad + "out = " + subst_alu_expr(result, names));
+   # flags that aren't constant are computed before any register changes
+   flags = {'C' : subst_alu_expr(carry, names),
+            'V' : subst_alu_expr(overflow, names)};
+   if (load_CC == 'LOAD_CC'):
+      for flag in ['C', 'V']:
+         if (not flags[flag].isdigit()):
+            lines.append(pad + "%s_out = %s" % (flag, flags[flag]));
+            flags[flag] = flag + "_out";
+   if (re == 'MEM_RD'):
+      lines.append(pad + "if (page_unfilled[MAR >> page_bits]): "
+                   "fill_page(MAR >> page_bits)");
+      lines.append(pad + "mem_data = memory[MAR]");
+   if (we == 'MEM_WR'):
+      lines.append(pad + "if (page_shared[MAR >> page_bits]): "
+                   "preserve_page(MAR >> page_bits)");
+      lines.append(pad + "memory[MAR] = MDR");
+      lines.append(pad + "memory_valid[MAR] = 1");
+      lines.append(pad + "if (MAR in block_covers): invalidate_blocks(MAR)");
+
+   if (dest == 'REG'):
+      lines.append(pad + "r[ra] = out");
+   elif (dest != 'NONE'):
+      lines.append(pad + dest + " = out");
+      written.add(dest);
+      if (dest == 'IR'):
+         lines.append(pad + "ra = " + ir_field("IR", rd_shift));
+         lines.append(pad + "rb = " + ir_field("IR", rs_shift));
+   if (re == 'MEM_RD'):
+      lines.append(pad + "MDR = mem_data");
+      written.add('MDR');
+   if (load_CC == 'LOAD_CC'):
+      lines.append(pad + "Z = 1 if (out == 0) else 0");
+      lines.append(pad + "N = out >> 15");
+      lines.append(pad + "C = " + flags['C']);
+      lines.append(pad + "V = " + flags['V']);
+      written.update(['Z', 'N', 'C', 'V']);
+
+# Appends the statements for the microcode path starting at control state
+# name, up to the point where it returns the number of cycles it took.
+# Paths end at FETCH or STOP1 (setting STATE) or, when to_decode is set,
+# just after DECODE.
+def gen_path(name, lines, indent, written, cycles, visited, to_decode):
+   pad = " " * indent;
+   if (name == "FETCH" or name == "STOP1" or
+       (name == "DECODE" and to_decode)):
+      if (name == "DECODE"):
+         gen_uinstr(name, lines, indent, written);
+         cycles += 1;
+      for reg in engine_regs:
+         if (reg in written):
+            lines.append(pad + "s['%s'] = %s" % (reg, reg));
+      if (name != "DECODE"):
+         lines.append(pad + "s['STATE'] = %d" % ustate_ids[name]);
+      lines.append(pad + "return %d" % cycles);
+      return;
+   if (name == "DECODE" or name in visited):
+      raise NotCompilable(name);
+   visited = visited | set([name]);
+
+   gen_uinstr(name, lines, indent, written);
+   if (name in branch_flags):
+      lines.append(pad + "if (%s):" % branch_flags[name]);
+      gen_path(name + "2", lines, indent + 3, set(written), cycles + 1,
+               visited, to_decode);
+      lines.append(pad + "else:");
+      gen_path(name + "1", lines, indent + 3, set(written), cycles + 1,
+               visited, to_decode);
+   else:
+      gen_path(nextState_logic[name][7], lines, indent, written, cycles + 1,
+               visited, to_decode);
+
+# Generates the function for the microcode path starting at control state
+# name (which, for the fetch path, is simulated even though it is FETCH).
+# The function takes state and its regFile and returns the number of
+# cycles it simulated. Memory and the block cache are globals of the code.
+# Returns the compiled code that defines the function as instr_fn.
+def gen_function(name, to_decode):
+   lines = [];
+   written = set();
+   if (to_decode):
+      gen_uinstr(name, lines, 3, written);
+      gen_path(nextState_logic[name][7], lines, 3, written, 1, set([name]),
+               to_decode);
+   else:
+      gen_path(name, lines, 3, written, 0, set(), to_decode);
+   body = "\n".join(lines);
+   uses_regs = match(r"(?s).*\br[ab]\b", body);
+   src = "def instr_fn(s, r):\n";
+   for reg in engine_regs:
+      if (match(r"(?s).*\b%s\b" % reg, body) or
+          (reg == 'IR' and uses_regs)):
+         src += "   %s = s['%s']\n" % (reg, reg);
+   if (uses_regs):
+      src += "   ra = %s\n   rb = %s\n" % (ir_field("IR", rd_shift),
+                                          ir_field("IR", rs_shift));
+   src += body + "\n";
+   return compile(src, "<instruction %s>" % name, "exec");
+
+# Generates the instruction fetch function (FETCH through DECODE) and the
+# function for each control state DECODE can go to. Entries are None for
+# paths the engine doesn't handle; those fall back to cycle().
+# Returns (fetch_code, instr_codes) where instr_codes is indexed by state
+# number.
+def compile_instructions():
+   fetch_code = gen_function("FETCH", True);
+   instr_codes = [None] * len(ustate_names);
+   for state_id in set(decode_table):
+      try:
+         instr_codes[state_id] = gen_function(ustate_names[state_id], False);
+      except NotCompilable:
+         pass;
+   return (fetch_code, instr_codes);
+
+(fetch_code, instr_codes) = compile_instructions();
+
+########################
+# BASIC BLOCK CACHE
+########################
+
+# Quiet runs go through straight-line runs of instructions (basic blocks)
+# decoded once and kept by start address. A block is a list
+# [instrs, covered, runs, block_fn, inner]: instrs lists (addr, IR,
+# instr_fn) for each instruction and covered lists every address the block
+# was decoded from, immediate words included. A write to a covered address
+# throws the block away. The rest is for the JIT: how many times the block
+# has run, the function it was translated into and the set of addresses of
+# its instructions after the first (None until it is translated).
+
+max_block_len = 64; # instructions decoded into one block at most
+
+# Follows every path through the microcode of the instruction starting at
+# control state name.
+# Returns (words, ends_block): the words it takes up including the opcode
+# (those it steps PC past, and any it reads through PC, like a jump's
+# target), and whether it can leave PC anywhere but just past them.
+def classify_instruction(name):
+   words = 1;
+   ends_block = False;
+   # (control state, words PC has stepped past, word MAR holds or None)
+   paths = [(name, 1, None)];
+   while (paths):
+      (name, step, mar_word) = paths.pop();
+      if (name == "FETCH"):
+         continue;
+      if (name in branch_flags or name == "STOP1"):
+         ends_block = True;
+         if (name == "STOP1"):
+            continue;
+      (alu_op, srcA, srcB, dest, load_CC, re) = nextState_logic[name][0:6];
+      if (re == 'MEM_RD' and mar_word != None):
+         words = max(words, mar_word + 1);
+      if (dest == 'MAR'):
+         mar_word = step if (alu_op == 'F_A' and srcA == 'PC') else None;
+      elif (dest == 'PC'):
+         if (alu_op == 'F_A_PLUS_1' and srcA == 'PC'):
+            step += 1;
+            words = max(words, step);
+         else:
+            ends_block = True;
+      if (name in branch_flags):
+         paths.append((name + "1", step, mar_word));
+         paths.append((name + "2", step, mar_word));
+      else:
+         paths.append((nextState_logic[name][7], step, mar_word));
+   return (words, ends_block);
+
+# Returns the number of cycles taken by FETCH through DECODE
+def count_fetch_cycles():
+   name = "FETCH";
+   cycles = 1;
+   while (name != "DECODE"):
+      name = nextState_logic[name][7];
+      cycles += 1;
+   return cycles;
+
+instr_shapes = [None] * len(ustate_names);
+for state_id in set(decode_table):
+   if (instr_codes[state_id]):
+      instr_shapes[state_id] = classify_instruction(ustate_names[state_id]);
+fetch_cycles = count_fetch_cycles();
+
+########################
+# JIT
+########################
+
+# With the JIT on (--jit), a cached block that has run jit_threshold times
+# is translated into a single Python function, compiled with compile/exec.
+# It comes from the same nextState_logic and alu_exprs as the engine, but
+# the whole block shares its locals: registers stay in locals between
+# instructions, and whatever is known when the block is translated (PC,
+# IR, the register fields, immediate words read from the block's own
+# addresses, and ALU results on those) is folded into constants. Flags
+# that a later instruction of the block sets again before anything reads
+# them aren't computed. Everything is written back to state at the end, so
+# cycle counts, the condition codes and MAR/MDR come out as the engine
+# leaves them. A write to an address some block was decoded from ends the
+# function after that instruction, as execute_block would stop.
+
+jit_threshold = 100; # default runs of a block before it is translated
+
+# values held by translated code: state keys, then registers r0 to r7
+jit_values = engine_regs + ["r%d" % i for i in xrange(8)];
+
+# Translates one block.
+# Arguments:
+#  * instrs and covered, as in block cache entries, and the memory array
+#    the block was decoded from
+class BlockTranslator(object):
+   def __init__(self, instrs, covered, memory):
+      self.instrs = instrs;
+      self.covered = set(covered);
+      self.memory = memory;
+      self.lines = [];
+      self.loads = set(); # values read from state into locals on entry
+
+   # Returns the control states each instruction but the last goes through
+   # (straight-line, as only the last can jump), with the flags each state
+   # that loads them has to compute: those read before being loaded again,
+   # or still set when the function could return.
+   def flag_liveness(self):
+      paths = [];
+      for (addr, ir, instr_fn) in self.instrs[:-1]:
+         name = ustate_names[decode_table[ir >> opcode_shift]];
+         path = [];
+         while (name != "FETCH"):
+            path.append(name);
+            name = nextState_logic[name][7];
+         paths.append(path);
+
+      all_flags = set(['Z', 'N', 'C', 'V']);
+      live = all_flags;
+      needed = [];
+      for path in reversed(paths):
+         if (writes_memory(path)):
+            live = all_flags;
+         path_needed = [];
+         for name in reversed(path):
+            (alu_op, srcA, srcB, dest, load_CC) = nextState_logic[name][0:5];
+            path_needed.append(live if (load_CC == 'LOAD_CC') else set());
+            if (load_CC == 'LOAD_CC'):
+               live = set();
+            if ((dest != 'NONE' or load_CC == 'LOAD_CC') and
+                'C' in alu_inputs(alu_op)):
+               live = live | set(['C']);
+         needed.append(zip(path, reversed(path_needed)));
+      needed.reverse();
+      return needed;
+
+   # Returns the Python expression for a value: its constant, or its local
+   # (which is loaded from state on entry if it's read before being set).
+   # values holds an int for each known value, None for each held in its
+   # local, and "s" for each still only in state.
+   def expr(self, values, name):
+      value = values[name];
+      if (value == "s"):
+         self.loads.add(name);
+         values[name] = None;
+      return str(value) if (isinstance(value, int)) else name;
+
+   # Returns the expression for the page of the address in MAR
+   def mar_page(self, values):
+      if (isinstance(values['MAR'], int)):
+         return str(values['MAR'] >> page_bits);
+      return self.expr(values, 'MAR') + " >> page_bits";
+
+   # Appends the statements for one control state to self.lines, updating
+   # values and written (the names to store back to state).
+   # Arguments:
+   #  * ra and rb: register fields of the instruction
+   #  * flags: the flags to compute if the state loads them
+   #  * fold_reads: whether memory at covered addresses can be read now
+   #  * stop: whether a write into a block has to end the function
+   def gen_uinstr(self, name, values, written, indent, ra, rb, flags,
+                  fold_reads, stop):
+      (alu_op, srcA, srcB, dest, load_CC, re, we) = nextState_logic[name][0:7];
+      pad = " " * indent;
+      lines = self.lines;
+      flags = flags if (load_CC == 'LOAD_CC') else set();
+      inputs = alu_inputs(alu_op) if (dest != 'NONE' or flags) else set();
+      names = {'C' : 'C', 'A' : "r%d" % ra if (srcA == 'REG') else srcA,
+               'B' : "r%d" % rb if (srcB == 'REG') else srcB};
+      for key in ['A', 'B', 'C']:
+         names[key] = self.expr(values, names[key]) if (key in inputs) else '0';
+
+      # the ALU result and flags, as constants if the inputs are
+      (result, carry, overflow) = alu_exprs[alu_op];
+      flag_values = {};
+      if (dest == 'NONE' and not flags):
+         out = None;
+      elif (all(names[key].isdigit() for key in names)):
+         (out, carry_out, overflow_out) = alu_fns[alu_op](
+             int(names['A']), int(names['B']), int(names['C']));
+         flag_values = {'Z' : 1 if (out == 0) else 0, 'N' : out >> 15,
+                        'C' : carry_out, 'V' : overflow_out};
+      else:
+         out = subst_alu_expr(result, names);
+         if (flags):
+            lines.append(pad + "out = " + out);
+            out = "out";
+            names['out'] = out;
+            flag_values = {'Z' : "1 if (out == 0) else 0", 'N' : "out >> 15",
+                           'C' : subst_alu_expr(carry, names),
+                           'V' : subst_alu_expr(overflow, names)};
+
+      # memory is written with MAR and MDR as they were, and read into
+      # MDR after the ALU result is stored
+      if (we == 'MEM_WR'):
+         page = self.mar_page(values);
+         addr = self.expr(values, 'MAR');
+         lines.append(pad + "if (page_shared[%s]): preserve_page(%s)"
+                      % (page, page));
+         lines.append(pad + "memory[%s] = %s"
+                      % (addr, self.expr(values, 'MDR')));
+         lines.append(pad + "memory_valid[%s] = 1" % addr);
+         lines.append(pad + "if (%s in block_covers): invalidate_blocks(%s)%s"
+                      % (addr, addr, "; stop = 1" if (stop) else ""));
+      read = None;
+      if (re == 'MEM_RD'):
+         if (fold_reads and values['MAR'] in self.covered):
+            read = self.memory[values['MAR']];
+         else:
+            page = self.mar_page(values);
+            lines.append(pad + "if (page_unfilled[%s]): fill_page(%s)"
+                         % (page, page));
+            read = "memory[%s]" % self.expr(values, 'MAR');
+            if (dest == 'MAR'):
+               lines.append(pad + "mem_data = " + read);
+               read = "mem_data";
+
+      for flag in ['Z', 'N', 'C', 'V']:
+         if (flag in flags):
+            self.assign(values, flag, flag_values[flag], pad);
+            written.add(flag);
+      if (dest != 'NONE'):
+         dest = "r%d" % ra if (dest == 'REG') else dest;
+         self.assign(values, dest, out, pad);
+         written.add(dest);
+      if (read != None):
+         self.assign(values, 'MDR', read, pad);
+         written.add('MDR');
+
+   # Sets a value to a constant (an int, or an expression that is a number)
+   # or to an expression, assigned to its local
+   def assign(self, values, name, value, pad):
+      if (isinstance(value, int) or value.isdigit()):
+         values[name] = int(value);
+      else:
+         self.lines.append(pad + "%s = %s" % (name, value));
+         values[name] = None;
+
+   # Appends the statements that store values back to state and return
+   # (count, cycles), leaving the control state at name
+   def gen_return(self, name, values, written, indent, count, cycles):
+      pad = " " * indent;
+      for value in jit_values:
+         if (value in written):
+            target = ("r[%s]" % value[1] if (value[0] == 'r') else
+                      "s['%s']" % value);
+            self.lines.append(pad + "%s = %s"
+                              % (target, self.expr(values, value)));
+      if (name != "FETCH"):
+         self.lines.append(pad + "s['STATE'] = %d" % ustate_ids[name]);
+      self.lines.append(pad + "return (%d, %d)" % (count, cycles));
+
+   # Appends the statements for the last instruction of the block, from
+   # control state name on, like gen_path. A branch on a flag that is known
+   # only gets the side it takes.
+   def gen_path(self, name, values, written, indent, ra, rb, count, cycles,
+                wrote):
+      if (name == "FETCH" or name == "STOP1"):
+         self.gen_return(name, values, written, indent, count, cycles);
+         return;
+      self.gen_uinstr(name, values, written, indent, ra, rb,
+                      set(['Z', 'N', 'C', 'V']), not wrote, False);
+      wrote = wrote or (nextState_logic[name][6] == 'MEM_WR');
+      if (name in branch_flags):
+         flag = branch_flags[name];
+         if (not isinstance(values[flag], int)):
+            self.lines.append(" " * indent + "if (%s):"
+                              % self.expr(values, flag));
+            self.gen_path(name + "2", dict(values), set(written), indent + 3,
+                          ra, rb, count, cycles + 1, wrote);
+            self.lines.append(" " * indent + "else:");
+            indent += 3;
+         name = name + ("2" if (values[flag] == 1) else "1");
+      else:
+         name = nextState_logic[name][7];
+      self.gen_path(name, values, written, indent, ra, rb, count, cycles + 1,
+                    wrote);
+
+   # Returns the compiled code that defines the block's function as
+   # block_fn. It takes state and its regFile and returns (count, cycles):
+   # the instructions and cycles it simulated.
+   def compile(self):
+      values = dict.fromkeys(jit_values, "s");
+      written = set();
+      stop = False;
+      cycles = 0;
+      liveness = self.flag_liveness();
+      for (count, (addr, ir, instr_fn)) in enumerate(self.instrs):
+         # the fetch, as execute_block does it
+         values.update(MAR = addr, MDR = ir, IR = ir,
+                       PC = (addr + 1) & 0xffff);
+         written.update(['MAR', 'MDR', 'IR', 'PC']);
+         cycles += fetch_cycles;
+         ra = (ir >> rd_shift) & reg_mask;
+         rb = (ir >> rs_shift) & reg_mask;
+         if (count == len(self.instrs) - 1):
+            name = ustate_names[decode_table[ir >> opcode_shift]];
+            self.gen_path(name, values, written, 3, ra, rb, count + 1,
+                          cycles, False);
+            break;
+         wrote = False;
+         for (name, flags) in liveness[count]:
+            self.gen_uinstr(name, values, written, 3, ra, rb, flags,
+                            not wrote, True);
+            wrote = wrote or (nextState_logic[name][6] == 'MEM_WR');
+            cycles += 1;
+         if (wrote):
+            stop = True;
+            self.lines.append("   if (stop):");
+            self.gen_return("FETCH", values, written, 6, count + 1, cycles);
+
+      src = "def block_fn(s, r):\n";
+      if (stop):
+         src += "   stop = 0\n";
+      for value in jit_values:
+         if (value in self.loads):
+            src += ("   %s = r[%s]\n" % (value, value[1]) if (value[0] == 'r')
+                    else "   %s = s['%s']\n" % (value, value));
+      src += "\n".join(self.lines) + "\n";
+      return compile(src, "<block %04X>" % self.instrs[0][0], "exec");
+
+# Whether any of a list of control states writes memory
+def writes_memory(path):
+   return any(nextState_logic[name][6] == 'MEM_WR' for name in path);
+
+# Returns the set of ALU inputs (A, B and C) an ALU function uses
+def alu_inputs(alu_op):
+   return set(findall(r"\b[ABC]\b", " ".join(alu_exprs[alu_op])));
+
+########################
+# Profiler
+########################
+
+# Counts what run() simulates, instruction by instruction. counts is keyed
+# by (PC, starting control state, opcode state, cycles): that is enough to
+# recover which microstates each instruction went through, so recording
+# stays one dict update per instruction.
+class Profile(object):
+   def __init__(self):
+      self.counts = {};
+
+   def clear(self):
+      self.counts.clear();
+
+   # Records one instruction. pc is where it started, start its control
+   # state then (FETCH unless stopped part way), opcode its decoded state.
+   def record(self, pc, start, opcode, cycles):
+      key = (pc, start, opcode, cycles);
+      self.counts[key] = self.counts.get(key, 0) + 1;
+
+   # Totals the counts per PC, per opcode and per microstate.
+   # Returns a dict: "instructions" and "cycles" are totals, "pcs" maps
+   # addresses, "opcodes" opcode names and "ustates" control state names
+   # to [instructions, cycles] ("ustates" to [cycles] only).
+   def summarize(self):
+      totals = {"instructions" : 0, "cycles" : 0, "pcs" : {}, "opcodes" : {},
+                "ustates" : {}};
+      for (key, times) in self.counts.items():
+         (pc, start, opcode, cycles) = key;
+         totals["instructions"] += times;
+         totals["cycles"] += times * cycles;
+         for (table, name) in [("pcs", pc),
+                               ("opcodes", ustate_names[opcode])]:
+            entry = totals[table].setdefault(name, [0, 0]);
+            entry[0] += times;
+            entry[1] += times * cycles;
+         path = ustate_path(start, opcode, cycles);
+         for state_id in (path if (path != None) else []):
+            entry = totals["ustates"].setdefault(ustate_names[state_id], [0]);
+            entry[0] += times;
+      return totals;
+
+   # Returns the profile as a dict ready for JSON, with addresses as hex
+   # strings next to the label they fall under
+   def to_json(self, labels):
+      totals = self.summarize();
+      pcs = [];
+      for pc in sorted(totals["pcs"]):
+         (instructions, cycles) = totals["pcs"][pc];
+         pcs.append({"addr" : to_4_digit_uc_hex(pc),
+                     "label" : label_for(pc, labels),
+                     "instructions" : instructions, "cycles" : cycles});
+      opcodes = {};
+      for (name, entry) in totals["opcodes"].items():
+         opcodes[name] = {"instructions" : entry[0], "cycles" : entry[1]};
+      ustates = {};
+      for (name, entry) in totals["ustates"].items():
+         ustates[name] = entry[0];
+      return {"instructions" : totals["instructions"],
+              "cycles" : totals["cycles"], "pcs" : pcs,
+              "opcodes" : opcodes, "ustates" : ustates};
+
+   # Returns the hot-spot report as a list of lines, top PCs first
+   def report(self, labels, top = 20):
+      totals = self.summarize();
+      all_cycles = max(totals["cycles"], 1);
+      lines = ["Profile: %d instructions, %d cycles"
+               % (totals["instructions"], totals["cycles"])];
+      lines.append("");
+      lines.append("addr label              instrs     cycles  cycles%");
+      by_cycles = sorted(totals["pcs"].items(), key = lambda e: -e[1][1]);
+      for (pc, (instructions, cycles)) in by_cycles[:top]:
+         lines.append("%04X %-16s %8d %10d %7.1f%%"
+                      % (pc, label_for(pc, labels), instructions, cycles,
+                         100.0 * cycles / all_cycles));
+      lines.append("");
+      lines.append("opcode             instrs     cycles  cycles%");
+      by_cycles = sorted(totals["opcodes"].items(), key = lambda e: -e[1][1]);
+      for (name, (instructions, cycles)) in by_cycles:
+         lines.append("%-16s %8d %10d %7.1f%%"
+                      % (name, instructions, cycles,
+                         100.0 * cycles / all_cycles));
+      lines.append("");
+      lines.append("microstate         cycles  cycles%");
+      by_cycles = sorted(totals["ustates"].items(), key = lambda e: -e[1][0]);
+      for (name, (cycles,)) in by_cycles:
+         lines.append("%-12s %12d %7.1f%%"
+                      % (name, cycles, 100.0 * cycles / all_cycles));
+      return lines;
+
+# Finds the control states an instruction went through from control state
+# start, given its opcode state (where DECODE goes) and the cycles it took.
+# Branch states are the only choice points, and their two paths take
+# different numbers of cycles, so the path is unique.
+# Returns a list of state numbers, or None if no path fits.
+def ustate_path(start, opcode, cycles):
+   name = ustate_names[start];
+   if (cycles == 1):
+      return [start] if (ustate_next(name, opcode) & terminal_states) else None;
+   for next_name in ustate_next(name, opcode) - terminal_states:
+      rest = ustate_path(ustate_ids[next_name], opcode, cycles - 1);
+      if (rest != None):
+         return [start] + rest;
+   return None;
+
+terminal_states = set(["FETCH", "STOP1"]);
+
+# Returns the set of control state names that can follow state name
+def ustate_next(name, opcode):
+   if (name == "DECODE"):
+      return set([ustate_names[opcode]]);
+   if (name in branch_flags):
+      return set([name + "1", name + "2"]);
+   return set([nextState_logic[name][7]]);
+
+# Returns the label an address falls under, as LABEL or LABEL+offset (hex),
+# or "" if no label is at or before it. labels maps names to hex addresses.
+def label_for(addr, labels):
+   best = None;
+   for (name, label_addr) in labels.items():
+      label_addr = int(label_addr, 16);
+      if (name and label_addr <= addr and
+          (best == None or label_addr > best[1] or
+           (label_addr == best[1] and name < best[0]))):
+         best = (name, label_addr);
+   if (best == None):
+      return "";
+   if (best[1] == addr):
+      return best[0];
+   return "%s+%X" % (best[0], addr - best[1]);
+
+########################
+# Snapshots
+########################
+
+# Memory is shared with snapshots, and randomized, in pages of
+# 1 << page_bits words
+page_bits = 8;
+page_size = 1 << page_bits;
+num_pages = (1 << 16) >> page_bits;
+
+# Returns the random words page starts with under seed: the same for a seed
+# whenever (and in whatever order) pages are filled, on any host. The bits
+# are read as little endian words whatever the host's byte order.
+def random_page(seed, page):
+   bits = Random(seed * num_pages + page).getrandbits(16 * page_size);
+   return array('H', page_words.unpack(unhexlify("%0*x" %
+                                                 (4 * page_size, bits))));
+
+page_words = Struct("<%dH" % page_size);
+
+# History checkpoints (see Simulator.checkpoint): cycles between them at
+# first, and how many are kept before thinning them out
+first_checkpoint_interval = 10000;
+max_checkpoints = 64;
+
+# A copy of the simulator's registers, cycle count and memory, made by
+# Simulator.snapshot. Memory pages are copied lazily: a snapshot shares
+# every page with the simulator until the page is written (or another
+# snapshot is restored over it), and only then is given its own copy.
+# pages maps page numbers to (words, valid) copies of those pages. Pages
+# of random memory not filled yet hold nothing, so the seed and which
+# pages those were are kept instead.
+class Snapshot(object):
+   def __init__(self, state, cycle_num, seed, page_unfilled):
+      self.state = dict(state);
+      self.state["regFile"] = list(state["regFile"]);
+      self.cycle_num = cycle_num;
+      self.seed = seed;
+      self.page_unfilled = bytearray(page_unfilled);
+      self.pages = {};
+
+########################
+# State Files
+########################
+
+# A saved simulator state: what save writes and load and check read, in
+# either the text .state format or the binary format below.
+#  * seed: the Seed: header of the file, None if it had none
+#  * breakpoints: list of addresses
+#  * values: register values keyed by the labels of wide_header. Cycle is
+#    an int, STATE a control state name, ZNCV the flags as a 4 bit int (Z
+#    highest) and the rest ints.
+#  * dont_care: set of labels whose value is XXXX in the file
+#  * raw: text of the labels whose value the file has but that can't be
+#    read as one (like ZNCV 0x1x), keyed by label. They never match.
+#  * memory, valid: 64K words, and 1 for each address the file holds
+class SavedState(object):
+   def __init__(self):
+      self.seed = None;
+      self.breakpoints = [];
+      self.values = {};
+      self.dont_care = set();
+      self.raw = {};
+      self.memory = array('H', [0]) * (1 << 16);
+      self.valid = bytearray(1 << 16);
+
+   # Returns the addresses the file holds, in order
+   def valid_addrs(self):
+      valid = self.valid;
+      return [addr for addr in xrange(1 << 16) if valid[addr]];
+
+   # Returns the value of register label formatted as in get_state, or
+   # XXXX if it is a don't care
+   def format_value(self, label):
+      if (label in self.dont_care):
+         return "XXXX";
+      if (label in self.raw):
+         return self.raw[label];
+      value = self.values[label];
+      if (label == "Cycle"):
+         return "%0.4d" % value;
+      elif (label == "STATE"):
+         return value;
+      elif (label == "ZNCV"):
+         return "%d%d%d%d" % tuple([(value >> bit) & 1 for bit in [3,2,1,0]]);
+      return "%04X" % value;
+
+   # Returns the State: line, laid out as get_state does
+   def state_line(self):
+      state_line = self.format_value("Cycle");
+      state_line += " " * (7 - len(self.format_value("STATE")));
+      for label in state_labels[1:]:
+         state_line += self.format_value(label) + " ";
+      return state_line.rstrip();
+
+# the labels of wide_header, in order
+state_labels = wide_header.split();
+
+# text of each kind of value in the State: line, by label (registers not
+# listed are hex)
+state_value_formats = {"Cycle" : "^\d+$", "ZNCV" : "^[01]{4}$",
+                       "STATE" : "^\w+$"};
+
+# Reads the lines of a text .state file.
+# Returns a SavedState
+def parse_state_text(lines):
+   saved = SavedState();
+   dont_care = "^\s*x{1,4}\s*$";
+   section = None;
+   for line in lines:
+      line = line.strip();
+      if (line.startswith("Seed:")):
+         saved.seed = line[5:].strip();
+      elif (line in ["Breakpoints:", "State:", "Memory:"]):
+         section = line;
+      elif (not line):
+         continue;
+      elif (section == "Breakpoints:"):
+         saved.breakpoints.append(int(line, 16));
+      elif (section == "State:"):
+         fields = line.split();
+         for i in xrange(len(state_labels)):
+            label = state_labels[i];
+            if (match(dont_care, fields[i], IGNORECASE)):
+               saved.dont_care.add(label);
+            elif (not match(state_value_formats.get(label, "^[0-9a-f]+$"),
+                            fields[i], IGNORECASE) or
+                  (label == "STATE" and fields[i].upper() not in ustate_ids)):
+               saved.raw[label] = fields[i];
+            elif (label == "Cycle"):
+               saved.values[label] = int(fields[i]);
+            elif (label == "STATE"):
+               saved.values[label] = fields[i].upper();
+            elif (label == "ZNCV"):
+               saved.values[label] = int(fields[i], 2);
+            else:
+               saved.values[label] = int(fields[i], 16);
+         section = None; # only one line of state
+      elif (section == "Memory:"):
+         addr = int(line[4:8], 16);
+         saved.memory[addr] = int(line[11:15], 16);
+         saved.valid[addr] = 1;
+   return saved;
+
+# Returns the text .state file for a SavedState, as save writes it
+def format_state_text(saved):
+   text = [];
+   if (saved.seed != None):
+      text.append("Seed: " + saved.seed + "\n");
+   text.append("Breakpoints:\n");
+   for addr in saved.breakpoints:
+      text.append(to_4_digit_uc_hex(addr) + "\n");
+   text.append("\nState:\n");
+   text.append(saved.state_line() + "\n\n");
+   text.append("Memory:\n");
+   for addr in saved.valid_addrs():
+      value = saved.memory[addr];
+      text.append("mem[%04X]: %04X %s %d %d\n" % (addr, value,
+                  hex_to_state(value), (value >> rd_shift) & reg_mask,
+                  (value >> rs_shift) & reg_mask));
+   return "".join(text);
+
+# Binary state files. Everything is little endian and at a fixed offset,
+# so the file can be mmapped or read in one go:
+#  * header (binary_header, 80 bytes): magic, version, memory layout,
+#    cycle count, don't care mask (bit i for state_labels[i]), STATE name,
+#    seed, PC IR SP MAR MDR R0-R7, flags (ZNCV, Z highest), whether there
+#    is a seed, breakpoint count, count of valid memory words
+#  * breakpoints: one word each, padded to a multiple of 4 bytes
+#  * memory, dense: valid bitmap (8K, address a is bit a & 7 of byte
+#    a >> 3) then all 64K words; or sparse: the valid addresses (one word
+#    each) then their values
+# Sparse memory is written when it is smaller.
+binary_magic = "S240";
+binary_version = 1;
+binary_dense = 0;
+binary_sparse = 1;
+binary_header = "<4sHHQI8s16s13HBBHxxI";
+binary_header_size = calcsize(binary_header);
+binary_regs = ["PC", "IR", "SP", "MAR", "MDR",
+               "R0", "R1", "R2", "R3", "R4", "R5", "R6", "R7"];
+
+# byte of a valid bitmap -> its 8 addresses as 0/1 bytes
+bitmap_bytes = ["".join([chr((byte >> bit) & 1) for bit in xrange(8)])
+                for byte in xrange(256)];
+
+# Returns True if data (at least its first 4 bytes) is a binary state file
+def is_binary_state(data):
+   return data[:4] == binary_magic;
+
+# Returns the binary state file for a SavedState as a string; raises
+# ValueError if it has values that can't be read (see SavedState)
+def format_state_binary(saved):
+   for label in state_labels:
+      if (label in saved.raw):
+         raise ValueError("%s = %s can't be written to a binary state file"
+                          % (label, saved.raw[label]));
+   mask = 0;
+   for i in xrange(len(state_labels)):
+      if (state_labels[i] in saved.dont_care):
+         mask |= 1 << i;
+   values = saved.values;
+   addrs = saved.valid_addrs();
+   layout = binary_sparse if (len(addrs) < 1 << 14) else binary_dense;
+   data = [pack(binary_header, binary_magic, binary_version, layout,
+                values.get("Cycle", 0), mask, values.get("STATE", "FETCH"),
+                saved.seed if (saved.seed != None) else "",
+                *([values.get(reg, 0) for reg in binary_regs] +
+                  [values.get("ZNCV", 0), saved.seed != None,
+                   len(saved.breakpoints), len(addrs)]))];
+   breakpoints = list(saved.breakpoints);
+   if (len(breakpoints) & 1): breakpoints.append(0);
+   data.append(words_to_le(array('H', breakpoints)));
+   if (layout == binary_sparse):
+      data.append(words_to_le(array('H', addrs)));
+      data.append(words_to_le(array('H', [saved.memory[addr]
+                                           for addr in addrs])));
+   else:
+      bitmap = bytearray(1 << 13);
+      for addr in addrs:
+         bitmap[addr >> 3] |= 1 << (addr & 7);
+      data.append(str(bitmap));
+      data.append(words_to_le(saved.memory));
+   return "".join(data);
+
+# Reads a binary state file from a string (or mmap).
+# Returns a SavedState; raises ValueError if data isn't a state file this
+# version can read
+def parse_state_binary(data):
+   if (not is_binary_state(data) or len(data) < binary_header_size):
+      raise ValueError("not a binary state file");
+   fields = unpack(binary_header, data[:binary_header_size]);
+   (magic, version, layout, cycle, mask, state_name, seed) = fields[:7];
+   if (version != binary_version):
+      raise ValueError("binary state file version %d not supported" % version);
+   (flags, has_seed, num_breakpoints, num_valid) = fields[20:];
+   saved = SavedState();
+   if (has_seed): saved.seed = seed.rstrip("\0");
+   for i in xrange(len(state_labels)):
+      if (mask & (1 << i)):
+         saved.dont_care.add(state_labels[i]);
+   saved.values["Cycle"] = cycle;
+   saved.values["STATE"] = state_name.rstrip("\0");
+   saved.values["ZNCV"] = flags;
+   for (reg, value) in zip(binary_regs, fields[7:20]):
+      saved.values[reg] = value;
+
+   offset = binary_header_size;
+   breakpoints = le_to_words(data[offset:offset + 2 * num_breakpoints]);
+   saved.breakpoints = breakpoints.tolist();
+   offset += 2 * (num_breakpoints + (num_breakpoints & 1));
+   if (layout == binary_sparse):
+      addrs = le_to_words(data[offset:offset + 2 * num_valid]);
+      offset += 2 * num_valid;
+      values = le_to_words(data[offset:offset + 2 * num_valid]);
+      for (addr, value) in zip(addrs, values):
+         saved.memory[addr] = value;
+         saved.valid[addr] = 1;
+   else:
+      bitmap = bytearray(data[offset:offset + (1 << 13)]);
+      saved.valid[:] = bytearray("".join([bitmap_bytes[byte]
+                                           for byte in bitmap]));
+      offset += 1 << 13;
+      saved.memory = le_to_words(data[offset:offset + (2 << 16)]);
+   return saved;
+
+# Returns an array of words as little endian bytes
+def words_to_le(words):
+   if (sys.byteorder == "big"):
+      words = array('H', words);
+      words.byteswap();
+   return words.tostring();
+
+# Returns an array of the words in a string of little endian bytes
+def le_to_words(data):
+   words = array('H', data);
+   if (sys.byteorder == "big"):
+      words.byteswap();
+   return words;
+
+# Reads a state file, text or binary.
+# Returns a SavedState
+def read_state_file(filename):
+   fh = open(filename, "rb");
+   data = fh.read();
+   fh.close();
+   if (is_binary_state(data)):
+      return parse_state_binary(data);
+   return parse_state_text(data.splitlines());
+
+# A state file compiled for checking the simulator against it many times:
+# the registers that aren't don't cares as a tuple of expected values, and
+# the memory it holds as address and value arrays, fetched from the
+# simulator with one itemgetter call. Files have no partial don't cares,
+# so a word is checked whole or (if the file doesn't hold it) not at all.
+class StateComparator(object):
+   def __init__(self, saved):
+      self.saved = saved;
+      self.labels = [label for label in state_labels
+                     if (label not in saved.dont_care)];
+      expected = dict(saved.values);
+      if ("STATE" in expected):
+         expected["STATE"] = ustate_ids[expected["STATE"]];
+      # values that couldn't be read stay text, so they never match
+      expected.update(saved.raw);
+      self.expected = tuple([expected[label] for label in self.labels]);
+      self.get_regs = itemgetter(*self.labels) if (self.labels) else None;
+
+      self.addrs = array('H', saved.valid_addrs());
+      self.values = tuple(saved.memory[addr] for addr in self.addrs);
+      # a tuple even for one address
+      self.get_memory = itemgetter(*self.addrs) if (self.addrs) else None;
+      if (len(self.addrs) == 1):
+         self.get_memory = lambda memory, addr = self.addrs[0]: (memory[addr],);
+      # pages of those addresses, filled before they are compared
+      self.pages = sorted(set([addr >> page_bits for addr in self.addrs]));
+
+   # Returns the simulator's registers under state_labels, as the file
+   # holds them
+   def sim_values(self, sim):
+      state = sim.state;
+      values = dict(state);
+      for i in xrange(8):
+         values["R%d" % i] = state["regFile"][i];
+      values["Cycle"] = sim.cycle_num;
+      values["ZNCV"] = ((state["Z"] << 3) | (state["N"] << 2) |
+                        (state["C"] << 1) | state["V"]);
+      return values;
+
+   # Returns True if the simulator matches the file
+   def matches(self, sim):
+      if (self.get_regs and
+          self.get_regs(self.sim_values(sim)) != self.expected):
+         return False;
+      if (not self.get_memory):
+         return True;
+      sim.fill_pages(self.pages);
+      return self.get_memory(sim.memory) == self.values;
+
+   # Compares the simulator against the file.
+   # Return value:
+   #  * a line describing each difference, empty if the state matches
+   def diff(self, sim):
+      differences = [];
+      if (self.get_regs and
+          self.get_regs(self.sim_values(sim)) != self.expected):
+         sim_state = sim.get_state().split();
+         for i in xrange(len(state_labels)):
+            label = state_labels[i];
+            if (label in self.saved.dont_care): continue;
+            file_value = self.saved.format_value(label);
+            if (file_value != sim_state[i]):
+               differences.append(label + " differs: sim = " + sim_state[i]
+                                  + ", file = " + file_value);
+      if (self.get_memory):
+         sim.fill_pages(self.pages);
+         sim_values = self.get_memory(sim.memory);
+         if (sim_values != self.values):
+            for i in xrange(len(self.addrs)):
+               if (sim_values[i] != self.values[i]):
+                  differences.append("Mem[" + to_4_digit_uc_hex(self.addrs[i])
+                                     + "] differs: sim = "
+                                     + to_4_digit_uc_hex(sim_values[i])
+                                     + ", file = "
+                                     + to_4_digit_uc_hex(self.values[i]));
+      return differences;
+
+# StateComparators of the files read by compile_state_file, by file name:
+# (modification time, size, comparator)
+compiled_states = {};
+
+# Returns a StateComparator for a state file (text or binary), reusing the
+# last one made for it unless the file has changed
+def compile_state_file(filename):
+   info = stat(filename);
+   key = (info.st_mtime, info.st_size);
+   cached = compiled_states.get(filename);
+   if (cached and cached[0] == key):
+      return cached[1];
+   comparator = StateComparator(read_state_file(filename));
+   compiled_states[filename] = (key, comparator);
+   return comparator;
+
+# Writes a SavedState to a file, binary if its name ends in .bstate
+def write_state_file(filename, saved):
+   if (filename.endswith(".bstate")):
+      data = format_state_binary(saved);
+   else:
+      data = format_state_text(saved);
+   fh = open(filename, "wb");
+   fh.write(data);
+   fh.close();
+
+########################
+# Breakpoint Conditions
+########################
+
+# Condition of a conditional breakpoint, like R3 == 0 and m[20] != FFFF.
+# The text is checked and compiled once into test(s, r, read_memory),
+# which takes the register dict, register file and Simulator.read_memory.
+class Condition(object):
+   def __init__(self, text):
+      self.text = text;
+      self.test = compile_condition(text);
+
+# Turns the text of a condition into a function, or raises ValueError.
+# Operands are registers (PC, SP, IR, MAR, MDR, R0-R7, flags Z N C V),
+# memory words m[addr] and hex constants, which must start with a digit
+# where they could be read as a flag (0C, not C). Operators are the
+# comparisons, and, or, not and parentheses.
+def compile_condition(text):
+   expr = [];
+   pos = 0;
+   text = text.strip();
+   while (pos < len(text)):
+      matchObj = match(condition_token, text[pos:]);
+      if (not matchObj):
+         raise ValueError("bad condition at '" + text[pos:] + "'");
+      pos += matchObj.end();
+      token = matchObj.group(1);
+      upper = token.upper();
+      if (upper in ["PC", "SP", "IR", "MAR", "MDR", "Z", "N", "C", "V"]):
+         expr.append('s["%s"]' % upper);
+      elif (match("^R[0-7]$", upper)):
+         expr.append("r[%s]" % upper[1]);
+      elif (match("^(MEM|M)\[", upper)):
+         addrObj = match("^(MEM|M)\[\s*([0-9A-F]{1,4})\s*\]$", upper);
+         if (not addrObj):
+            raise ValueError("bad memory address in '" + token + "'");
+         expr.append("read_memory(0x%s)" % addrObj.group(2));
+      elif (match("^[0-9A-F]{1,4}$", upper)):
+         expr.append("0x" + upper);
+      elif (token.lower() in ["and", "or", "not"]):
+         expr.append(token.lower());
+      elif (token in ["==", "!=", "<", "<=", ">", ">=", "(", ")"]):
+         expr.append(token);
+      else:
+         raise ValueError("bad condition at '" + token + "'");
+   try:
+      return eval("lambda s, r, read_memory: " + " ".join(expr));
+   except SyntaxError:
+      raise ValueError("bad condition '" + text + "'");
+
+condition_token = \
+    "\s*((?i)m(em)?\[\s*[0-9a-f]{1,4}\s*\]|==|!=|<=|>=|<|>|\(|\)|\w+)\s*";
+
+# Bits of Simulator.watch_map
+watch_read = 1;
+watch_write = 2;
+watch_modes = {"r" : watch_read, "w" : watch_write,
+               "rw" : watch_read | watch_write};
+
+# Follows every path of the instruction at control state name (after
+# DECODE) to FETCH or STOP1.
+# Returns (cycles, accesses): the most cycles it can take, and whether it
+# reads or writes memory.
+def trace_instruction(name):
+   (re, we) = nextState_logic[name][5:7];
+   accesses = (re == 'MEM_RD' or we == 'MEM_WR');
+   cycles = 0;
+   for next_name in ustate_next(name, None) - terminal_states:
+      (next_cycles, next_accesses) = trace_instruction(next_name);
+      cycles = max(cycles, next_cycles);
+      accesses = accesses or next_accesses;
+   return (cycles + 1, accesses);
+
+# whether the instruction at each opcode state touches memory, and the
+# most cycles an instruction (fetch included) can take
+instr_accesses = [True] * len(ustate_names);
+max_instr_cycles = 0;
+for state_id in set(decode_table):
+   if (state_id not in fetch_ids):
+      (cycles, instr_accesses[state_id]) = \
+          trace_instruction(ustate_names[state_id]);
+      max_instr_cycles = max(max_instr_cycles, fetch_cycles + cycles);
+
+########################
+# Simulator
+########################
+
+class Simulator(object):
+   # Arguments:
+   #  * randomize_memory: fill memory with random words on reset, as the
+   #    hardware would power up (-n turns this off)
+   #  * memory_seed: seed for the random memory, None for a fresh one each
+   #    time a program is loaded
+   #  * fast_engine: run whole instructions at once when microstates aren't
+   #    printed (--reference turns this off)
+   #  * jit: translate blocks that run often into Python functions (--jit)
+   #  * out: file that printed output goes to, sys.stdout by default
+   def __init__(self, randomize_memory = True, memory_seed = None,
+                fast_engine = True, jit = False, out = None):
+      self.randomize_memory = randomize_memory;
+      self.memory_seed = memory_seed;
+      self.fast_engine = fast_engine;
+      self.jit = jit;
+      self.out = out if (out) else sys.stdout;
+
+      # file (usually a TranscriptWriter) that gets a transcript of every
+      # line printed, None for no transcript
+      self.transcript = None;
+
+      # print_per determines when the simulator prints the state.
+      # 'i' prints the state on every instruction.
+      # 'u' prints the state on every microinstruction.
+      # 'q' is for 'quiet'; it does not ever print
+      self.print_per = "i";
+
+      self.cycle_num = 0; # cycle counter
+
+      # 64K words of memory, indexed by address
+      self.memory = array('H', [0]) * (1 << 16);
+
+      # 1 for each address that is saved to state files. By heuristic,
+      # memory is invalid until changed.
+      self.memory_valid = bytearray(1 << 16);
+
+      # all the regs in the processor. Register values are held as ints and
+      # only formatted as hex when printed (see get_state).
+      self.state = {
+         'PC' : 0,
+         'SP' : 0,
+         'IR' : 0,
+         'MAR' : 0,
+         'MDR' : 0,
+         'regFile' : [0, 0, 0, 0, 0, 0, 0, 0],
+         'Z' : 0,
+         'N' : 0,
+         'C' : 0,
+         'V' : 0,
+         'STATE' : fetch_id, # index into ustate_names
+      };
+
+      # keys are label strings, values are addresses
+      self.labels = {};
+
+      # keys are addresses (ints), value is always 1
+      self.breakpoints = {};
+
+      # keys are addresses of conditional breakpoints, values Conditions
+      self.break_conditions = {};
+
+      # cycle counts to stop at; keys are ints, value is always 1
+      self.cycle_breakpoints = {};
+
+      # watched memory as (lo, hi, mode) ranges, and the watch_read and
+      # watch_write bits of every address
+      self.watchpoints = [];
+      self.watch_map = bytearray(1 << 16);
+
+      # lines of the loaded .list file, without its header (none when the
+      # program was loaded from an as240 Image)
+      self.list_lines = [];
+
+      # (address, word) for every word of the loaded program
+      self.program_words = [];
+
+      self.block_cache = {}; # start address -> block
+      self.block_covers = {}; # address -> start addresses of blocks on it
+      self.block_stats = {"hits" : 0, "misses" : 0, "invalidations" : 0,
+                          "translated" : 0};
+
+      # runs of a block before the JIT translates it (--jit-threshold)
+      self.jit_threshold = jit_threshold;
+
+      # code the JIT translated blocks into, keyed by the addresses a block
+      # was decoded from and the words there
+      self.jit_code = {};
+
+      # Profile counting what run() simulates, None when not profiling
+      self.profile = None;
+
+      # TraceWriter recording every cycle or instruction, None when not
+      # tracing (see set_trace)
+      self.trace = None;
+      self.trace_cycles = False;
+
+      # keys are snapshot names, values are Snapshots. The snapshot taken
+      # after loading the program, which reset restores, is under None,
+      # and history checkpoints are under ("checkpoint", cycle).
+      self.snapshots = {};
+
+      # History for back, uback and seek: the cycles of the checkpoints
+      # kept (oldest first), the cycle run takes the next one at, and the
+      # most memory (in bytes) the checkpoints may use, 0 for no history
+      self.checkpoints = [];
+      self.next_checkpoint = 0;
+      self.checkpoint_interval = first_checkpoint_interval;
+      self.history_budget = 16 << 20;
+
+      # 1 for each memory page some snapshot still shares; a write there
+      # has to call preserve_page first
+      self.page_shared = bytearray(num_pages);
+
+      # Random memory is made a page at a time, the first time the page is
+      # read or written (see fill_page): seed is what it is made from
+      # (memory_seed, or a fresh one), and page_unfilled is 1 for each page
+      # that hasn't been made yet. Unfilled pages are always page_shared,
+      # so writes to them go through preserve_page, which fills them.
+      self.seed = None;
+      self.page_unfilled = bytearray(num_pages);
+
+      self.bind_engine();
+
+   # Makes this simulator's instruction functions from the compiled engine
+   # code, with its own memory and block cache as their globals.
+   def bind_engine(self):
+      env = {"memory" : self.memory, "memory_valid" : self.memory_valid,
+             "block_covers" : self.block_covers,
+             "invalidate_blocks" : self.invalidate_blocks,
+             "page_shared" : self.page_shared, "page_bits" : page_bits,
+             "preserve_page" : self.preserve_page,
+             "page_unfilled" : self.page_unfilled,
+             "fill_page" : self.fill_page};
+      self.engine_env = env;
+      exec(fetch_code, env);
+      self.fetch_fn = env["instr_fn"];
+      self.instr_fns = [None] * len(ustate_names);
+      for state_id in xrange(len(instr_codes)):
+         if (instr_codes[state_id]):
+            exec(instr_codes[state_id], env);
+            self.instr_fns[state_id] = env["instr_fn"];
+
+   ########################
+   # Program Interface
+   ########################
+
+   # Loads a program from the lines of a .list file (header included) and
+   # initializes the simulator (see start_program).
+   def load_program(self, lines):
+      self.list_lines = list(lines);
+      strip_list_header(self.list_lines);
+      self.labels.clear();
+      self.get_labels();
+      self.start_program(list_words(self.list_lines));
+
+   # Loads a program assembled in this process: image is what as240's
+   # assemble() returns. Its words and labels are taken as they are, with
+   # no .list text to format and parse. Labels are those the symbol table
+   # has for addresses, so they include labels on lines of their own.
+   def load_image(self, image):
+      self.list_lines = [];
+      self.labels.clear();
+      for (label, addr) in image.labels.items():
+         self.labels[label] = "%04X" % addr;
+      self.start_program(image.words);
+
+   # Initializes the simulator to run the program made of words, a list of
+   # (address, word). Snapshots of the last program are dropped, and the
+   # fresh state is snapshotted for reset.
+   def start_program(self, words):
+      self.program_words = words;
+      self.snapshots.clear();
+      self.jit_code.clear();
+      del self.checkpoints[:];
+      self.checkpoint_interval = first_checkpoint_interval;
+      self.init_p18240(); #put p18240 into a known state
+      self.init_memory(); #initalize the memory
+      self.snapshot(None);
+      self.mark_history();
+
+   # Returns a copy of the registers, with STATE as its name and the cycle
+   # count under "Cycle"
+   def read_state(self):
+      regs = dict(self.state);
+      regs["regFile"] = list(self.state["regFile"]);
+      regs["STATE"] = ustate_names[self.state["STATE"]];
+      regs["Cycle"] = self.cycle_num;
+      return regs;
+
+   # Returns the word at addr
+   def read_memory(self, addr):
+      if (self.page_unfilled[addr >> page_bits]):
+         self.fill_page(addr >> page_bits);
+      return self.memory[addr];
+
+   # Gives an unfilled page of memory its random words (see random_page)
+   def fill_page(self, page):
+      lo = page << page_bits;
+      self.memory[lo:lo + page_size] = random_page(self.seed, page);
+      self.page_unfilled[page] = 0;
+
+   # Fills any of a list of pages that aren't yet, so self.memory can be
+   # read there directly
+   def fill_pages(self, pages):
+      page_unfilled = self.page_unfilled;
+      for page in pages:
+         if (page_unfilled[page]): self.fill_page(page);
+
+   ########################
+   # Output
+   ########################
+
+   # adds a new line to the transcript - line doesn't include \n
+   def tran(self, line):
+      if (self.transcript):
+         self.transcript.write(line);
+
+   # add the string to the transcript and print it
+   def tran_print(self, line):
+      self.tran(line + "\n");
+      self.out.write(line + "\n");
+
+   ########################
+   # Commands
+   ########################
+
+   # Executes one line of user or sim file input.
+   # Return value:
+   #  * True if the line asks to quit
+   def do_command(self, line):
+      done = False;
+      # assume user input is valid until discovered not to be
+      valid = True;
+      #line = line.upper(); #should be independent of case
+      if (match(menu["quit"], line, IGNORECASE)):
+         done = True;
+      elif (match(menu["help"], line, IGNORECASE)):
+         self.print_help();
+      elif (match(menu["reset"], line, IGNORECASE)):
+         self.reset();
+      elif (match(menu["run"], line, IGNORECASE)):
+         matchObj = match(menu["run"], line, IGNORECASE);
+         self.run(matchObj.group(2), matchObj.group(3));
+      elif (match(menu["step"], line, IGNORECASE)):
+         if (self.print_per == "i"): self.tran_print(wide_header);
+         self.step();
+         if (self.trace and not self.trace_cycles): self.trace.record(self);
+         if (self.print_per == "i"): self.tran_print(self.get_state());
+      elif (match(menu["ustep"], line, IGNORECASE)):
+         if (self.print_per != "q"): self.tran_print(wide_header);
+         self.cycle();
+         if (self.trace and not self.trace_cycles and
+             self.state["STATE"] in [fetch_id, stop1_id]):
+            self.trace.record(self);
+         if (self.print_per != "q"): self.tran_print(self.get_state());
+      elif (match(menu["break_cycle"], line, IGNORECASE)):
+         matchObj = match(menu["break_cycle"], line, IGNORECASE);
+         self.cycle_breakpoints[int(matchObj.group(1))] = 1;
+      elif (match(menu["clear_cycle"], line, IGNORECASE)):
+         matchObj = match(menu["clear_cycle"], line, IGNORECASE);
+         if (self.cycle_breakpoints.pop(int(matchObj.group(1)), None) == None):
+            self.tran_print("No breakpoint at cycle " + matchObj.group(1) + ".");
+      elif (match(menu["break"], line, IGNORECASE)):
+         matchObj = match(menu["break"], line, IGNORECASE);
+         self.set_breakpoint(matchObj.group(1), matchObj.group(3));
+      elif (match(menu["clear"], line, IGNORECASE)):
+         matchObj = match(menu["clear"], line, IGNORECASE);
+         self.clear_breakpoint(matchObj.group(1));
+      elif (match(menu["watch"], line, IGNORECASE)):
+         matchObj = match(menu["watch"], line, IGNORECASE);
+         self.set_watchpoint(matchObj.group(1), matchObj.group(3),
+                             matchObj.group(5));
+      elif (match(menu["unwatch"], line, IGNORECASE)):
+         matchObj = match(menu["unwatch"], line, IGNORECASE);
+         self.clear_watchpoint(matchObj.group(1), matchObj.group(3));
+      elif (match(menu["lsbrk"], line, IGNORECASE)):
+         self.list_breakpoints();
+      elif (match(menu["load"], line, IGNORECASE)):
+         matchObj = match(menu["load"], line, IGNORECASE);
+         self.load(matchObj.group(1));
+      elif (match(menu["save"], line, IGNORECASE)):
+         matchObj = match(menu["save"], line, IGNORECASE);
+         self.save(matchObj.group(1));
+      elif (match(menu["set_reg"], line, IGNORECASE)):
+         matchObj = match(menu["set_reg"], line, IGNORECASE);
+         self.set_reg(matchObj.group(1), matchObj.group(2));
+      elif (match(menu["get_reg"], line, IGNORECASE)):
+         matchObj = match(menu["get_reg"], line, IGNORECASE);
+         self.get_reg(matchObj.group(1));
+      elif (match(menu["set_mem"], line, IGNORECASE)):
+         matchObj = match(menu["set_mem"], line, IGNORECASE);
+         self.set_memory(matchObj.group(2), matchObj.group(3), 1);
+      elif (match(menu["get_mem"], line, IGNORECASE)):
+         matchObj = match(menu["get_mem"], line, IGNORECASE);
+         self.fget_memory({"lo" : matchObj.group(2),
+                           "hi" : matchObj.group(4)});
+      elif (match(menu["check"], line, IGNORECASE)):
+         matchObj = match(menu["check"], line, IGNORECASE);
+         self.check_state(matchObj.group(1));
+      elif (match(menu["back"], line, IGNORECASE)):
+         self.reverse_command("i");
+      elif (match(menu["uback"], line, IGNORECASE)):
+         self.reverse_command("u");
+      elif (match(menu["seek"], line, IGNORECASE)):
+         matchObj = match(menu["seek"], line, IGNORECASE);
+         self.reverse_command(matchObj.group(1));
+      elif (match(menu["history"], line, IGNORECASE)):
+         matchObj = match(menu["history"], line, IGNORECASE);
+         self.history_command(matchObj.group(2));
+      elif (match(menu["snapshot"], line, IGNORECASE)):
+         matchObj = match(menu["snapshot"], line, IGNORECASE);
+         self.snapshot(matchObj.group(1));
+      elif (match(menu["restore"], line, IGNORECASE)):
+         matchObj = match(menu["restore"], line, IGNORECASE);
+         if (not self.restore(matchObj.group(1))):
+            self.tran_print("No snapshot named " + matchObj.group(1));
+      elif (match(menu["labels"], line, IGNORECASE)):
+         self.print_labels();
+      elif (match(menu["stats"], line, IGNORECASE)):
+         self.print_stats();
+      elif (match(menu["profile"], line, IGNORECASE)):
+         matchObj = match(menu["profile"], line, IGNORECASE);
+         self.profile_command(matchObj.group(2));
+      elif (match("^$", line, IGNORECASE)): # user just struck enter
+         pass; # something needs to be here for python
+      else:
+         valid = False;
+
+      if (not valid): self.tran_print("Invalid input. Type 'help' for help.");
+      return done;
+
+   # prints help message
+   def print_help(self):
+      help_msg = '';
+      help_msg += "\n";
+      help_msg += "quit,q,exit             Quit the simulator.\n";
+      help_msg += "help,h,?                Print this help message.\n";
+      help_msg += "step,s                  Simulate one instruction.\n";
+      help_msg += "ustep,u                 Simulate one micro-instruction.\n";
+      help_msg += "run,r [n]               Simulate the next n instructions.\n";
+      help_msg += "run nu                  Same as above, but print ever ustep\n";
+      help_msg += "back                    Go back one instruction.\n";
+      help_msg += "uback                   Go back one micro-instruction.\n";
+      help_msg += "seek [n]                Go back or forward to cycle n (decimal).\n";
+      help_msg += "history [kb]            Show the history kept, or set its size (0 for none).\n";
+      help_msg += "break [addr/label]      Set a breakpoint at [addr] or [label].\n";
+      help_msg += "break [addr] if [cond]  Same, but only stop if [cond] holds (R3 == 0).\n";
+      help_msg += "break cycle [n]         Stop once the cycle count reaches n (decimal).\n";
+      help_msg += "watch [lo:hi] [r/w/rw]  Stop after an access to memory lo to hi.\n";
+      help_msg += "lsbrk                   List all set breakpoints and watchpoints.\n";
+      help_msg += "clear [addr/label/*]    Clear breakpoint at [addr]/[label], or clear all.\n";
+      help_msg += "clear cycle [n]         Clear the breakpoint at cycle n.\n";
+      help_msg += "unwatch [lo:hi/*]       Clear the watchpoint on lo to hi, or all of them.\n";
+      help_msg += "reset                   Reset the processor to initial state.\n";
+      help_msg += "save [file]             Save the current state to a file.\n";
+      help_msg += "load [file]             Load the state from a given file.\n";
+      help_msg += "check [file]            Checks state against state described in file.\n";
+      help_msg += "snapshot [name]         Keep a copy of the current state in memory.\n";
+      help_msg += "restore [name]          Go back to the state kept by snapshot [name].\n";
+      help_msg += "labels                  Prints the lables described in the .list file.\n";
+      help_msg += "stats                   Print cycle count and block cache hit rate.\n";
+      help_msg += "profile [on/off/clear]  Count instructions and cycles per address during run.\n";
+      help_msg += "profile [save file]     Print the hot spots, or save the profile as JSON.\n";
+      help_msg += "\n";
+      help_msg += "You may set registers like so:          PC=100\n";
+      help_msg += "You may view register contents like so: PC?\n";
+      help_msg += "You may view the register file like so: R*?\n";
+      help_msg += "You may view all registers like so:     *?\n";
+      help_msg += "\n";
+      help_msg += "You may set memory like so:  m[00A0]=100\n";
+      help_msg += "You may view memory like so: m[00A0]? or with a range: m[0:A]?\n";
+      help_msg += "\n";
+      help_msg += "Note: All constants are interpreted as hexadecimal.";
+      self.tran_print(help_msg);
+
+   # puts the simulator back in the state it was in after loading the
+   # program (breakpoints are kept)
+   def reset(self):
+      self.restore(None);
+      self.block_stats.update(hits = 0, misses = 0, invalidations = 0,
+                              translated = 0);
+      if (self.profile): self.profile.clear();
+
+   # Reads label from list file and adds them to the labels hash.
+   # Currently based on spacing format of list file.
+   def get_labels(self):
+      #check each line for a label
+      for line in self.list_lines:
+         if (len(line) < 11): continue; #must not be a lebel on this line
+         addr = line[0:4];
+         line_start_at_label = line[11:];
+         end_of_label = line_start_at_label.find(' '); #first space (label end)
+         label = line_start_at_label[0:end_of_label];
+         self.labels[label] = addr;
+
+   # initalizes the processor (registers zeroed, state = FETCH)
+   def init_p18240(self):
+      self.cycle_num = 0;
+
+      state = self.state;
+      for key in state:
+         if (key == "regFile"):
+            state["regFile"][:] = [0] * 8;
+         elif (key == "STATE"):
+            state[key] = fetch_id;
+         else:
+            state[key] = 0;
+
+   # initalizes the memory, sets the memory locations of the program
+   # memory is filled in place, so generated code can hold on to it.
+   # Random memory is only made as pages are used, starting with those the
+   # program is loaded into. Snapshots must have been dropped first.
+   def init_memory(self):
+      self.memory[:] = array('H', [0]) * (1 << 16);
+      if (self.randomize_memory):
+         self.seed = (self.memory_seed if (self.memory_seed != None) else
+                      Random().getrandbits(16));
+         self.page_unfilled[:] = bytearray([1]) * num_pages;
+         self.page_shared[:] = self.page_unfilled;
+         self.fill_pages(set([addr >> page_bits
+                              for (addr, word) in self.program_words]));
+      else:
+         self.seed = None;
+         self.page_unfilled[:] = bytearray(num_pages);
+      self.memory_valid[:] = bytearray(1 << 16);
+      self.flush_blocks();
+      self.block_stats.update(hits = 0, misses = 0, invalidations = 0,
+                              translated = 0);
+      if (self.profile): self.profile.clear();
+
+      for (addr, word) in self.program_words:
+         self.memory[addr] = word;
+         self.memory_valid[addr] = 1;
+
+   # Run simulator for n instructions
+   # If n is undefined, run indefinitely
+   # In either case, the exception is to stop
+   # at breakpoints or the STOP microinstruction
+   # print_per_requested is how often state is printer (per U-instruction,
+   # per Instruction, Quiet)
+   # Returns the number of instructions simulated
+   def run(self, num = None, print_per_requested = None):
+      num = int(num) if num else (1 << 32); # num = None if not defined
+
+      old_print_per = self.print_per;
+      if (print_per_requested):
+         self.print_per = print_per_requested;
+      if (self.print_per != "q"):
+         self.tran_print(wide_header);
+
+      state = self.state;
+      # watchpoints, tracing and the profiler need every instruction looked
+      # at, so they don't cost anything when unused
+      monitored = (self.profile or self.watchpoints or self.trace);
+      # blocks are run until they could reach the next cycle breakpoint
+      next_cycle = min([cycle for cycle in self.cycle_breakpoints
+                        if (cycle > self.cycle_num)] or [None]);
+      block_fence = ((1 << 64) if (next_cycle == None) else
+                     next_cycle - max_block_len * max_instr_cycles);
+      i = 0;
+      while (i < num):
+         if (monitored):
+            hit = self.monitored_step();
+            i += 1;
+            if (hit):
+               if (self.print_per == "i"):
+                  self.tran_print(self.get_state());
+               self.tran_print(hit + "\n");
+               break;
+         elif (self.fast_engine and self.print_per == "q" and
+               state["STATE"] == fetch_id and self.cycle_num < block_fence):
+            i += self.execute_block(num - i);
+         else:
+            self.step();
+            i += 1;
+         if (self.print_per == "i"):
+            self.tran_print(self.get_state());
+         if (self.cycle_num >= self.next_checkpoint):
+            self.checkpoint();
+         if (next_cycle != None and self.cycle_num >= next_cycle):
+            self.tran_print("Hit breakpoint at cycle %d.\n" % next_cycle);
+            break;
+         if (state["PC"] in self.breakpoints and
+             (state["PC"] not in self.break_conditions or
+              self.break_conditions[state["PC"]].test(state, state["regFile"],
+                                                      self.read_memory))):
+            self.tran_print("Hit breakpoint at " +
+                            to_4_digit_uc_hex(state["PC"]) + ".\n");
+            break;
+
+         if (state["STATE"] == stop1_id):
+            break;
+
+      self.print_per = old_print_per;
+      return i;
+
+   # Simulate one instruction. Unless microinstructions are being printed,
+   # an instruction starting at FETCH is run by the instruction-level engine.
+   def step(self):
+      state = self.state;
+      if (self.fast_engine and self.print_per != "u" and
+          state["STATE"] == fetch_id and not self.trace_cycles):
+         self.execute_instruction();
+         return;
+
+      self.cycle(); # do-while in python
+      if (self.print_per == "u"): self.tran_print(self.get_state());
+      while (state["STATE"] != fetch_id and state["STATE"] != stop1_id):
+         self.cycle();
+         if (self.print_per == "u"): self.tran_print(self.get_state());
+
+   # step() for when the profiler, watchpoints or tracing are on: records
+   # the instruction in self.profile and the trace, and checks whether it
+   # hit a watchpoint.
+   # Return value:
+   #  * a message saying what was hit, or None
+   def monitored_step(self):
+      state = self.state;
+      pc = state["PC"];
+      start = state["STATE"];
+      cycles = self.cycle_num;
+      hit = None;
+      if (self.watchpoints):
+         hit = self.watched_step();
+      else:
+         self.step();
+      if (self.profile):
+         self.profile.record(pc, start,
+                             decode_table[state["IR"] >> opcode_shift],
+                             self.cycle_num - cycles);
+      if (self.trace and not self.trace_cycles):
+         self.trace.record(self);
+      if (hit != None):
+         hit += " by the instruction at " + to_4_digit_uc_hex(pc) + ".";
+      return hit;
+
+   # step() one microinstruction at a time, watching memory accesses made
+   # after the instruction is fetched. Instructions that don't touch memory
+   # are left to step().
+   # Return value:
+   #  * a message describing the first watched access, or None
+   def watched_step(self):
+      state = self.state;
+      if (state["STATE"] == fetch_id and not self.trace_cycles and
+          not instr_accesses[decode_table[self.read_memory(state["PC"])
+                                          >> opcode_shift]]):
+         self.step();
+         return None;
+      watch_map = self.watch_map;
+      hit = None;
+      while (True):
+         state_id = state["STATE"];
+         if (hit == None and state_id not in fetch_ids):
+            (mem_rd, mem_wr) = microcode[state_id][5:7];
+            addr = state["MAR"];
+            if (mem_rd and watch_map[addr] & watch_read):
+               hit = "Hit watchpoint: read of " + to_4_digit_uc_hex(addr);
+            elif (mem_wr and watch_map[addr] & watch_write):
+               hit = "Hit watchpoint: write to " + to_4_digit_uc_hex(addr);
+         self.cycle();
+         if (self.print_per == "u"): self.tran_print(self.get_state());
+         if (state["STATE"] == fetch_id or state["STATE"] == stop1_id):
+            return hit;
+
+   # Handles the profile command: on, off, clear, save [file] or, with no
+   # argument, print the hot-spot report
+   def profile_command(self, arg):
+      if (arg == "on"):
+         if (not self.profile): self.profile = Profile();
+      elif (arg == "off"):
+         self.profile = None;
+      elif (not self.profile):
+         self.tran_print("Profiling is off. Use 'profile on' first.");
+      elif (arg == "clear"):
+         self.profile.clear();
+      elif (arg):
+         filename = match("save\s+([\w\.]+)", arg).group(1);
+         self.save_profile(filename);
+      else:
+         for line in self.profile.report(self.labels):
+            self.tran_print(line);
+
+   # Writes the profile to a file as JSON
+   def save_profile(self, filename):
+      try:
+         fh = open(filename, "w");
+      except:
+         self.tran_print("Unable to write to " + filename);
+         return;
+      json.dump(self.profile.to_json(self.labels), fh, indent = 1,
+                sort_keys = True);
+      fh.close();
+
+   # Starts recording a trace in TraceWriter trace (None stops), and makes
+   # the first record
+   def set_trace(self, trace):
+      self.trace = trace;
+      self.trace_cycles = (trace != None and trace.per == "u");
+      if (trace): trace.record(self);
+
+   # Set a break point at a given address or label.
+   # Any thing which matches a hex value (e.g. a, 0B, etc) is interpreted
+   # as such *unless* it is surrounded by '' e.g. 'A' in which case it is
+   # interpreted as a label and looked up in the labels hash.
+   # Anything which does not match a hex value is also interpreted as a label
+   # with or without surrounding ''.
+   def set_breakpoint(self, arg, condition = None):
+      is_label = False;
+      if (match("^'(\w+)'$", arg)):
+         label = match("^'(\w+)'$", arg).group(1);
+         is_label = True;
+      elif (match("^[0-9a-f]{1,4}$", arg, IGNORECASE)):
+         addr = int(arg,16);
+      else:
+         is_label = True;
+         label = arg;
+
+      if (is_label):
+         if (label in self.labels):
+            addr = int(self.labels[label], 16);
+         else:
+            self.tran_print("Invalid label.");
+            return;
+
+      if (condition):
+         try:
+            self.break_conditions[addr] = Condition(condition);
+         except ValueError, e:
+            self.tran_print("Invalid condition: " + str(e));
+            return;
+      else:
+         self.break_conditions.pop(addr, None);
+      self.breakpoints[addr] = 1;
+
+   # Clears a breakpoint at a given address or label
+   def clear_breakpoint(self, arg):
+      clear_all = False;
+      is_label = False;
+
+      if (match("^'(\w+)'$", arg)):
+         label = match("^'(\w+)'$", arg).group(1);
+         is_label = True;
+      elif (match("^[0-9a-f]{1,4}$", arg, IGNORECASE)):
+         addr = int(arg,16);
+      elif (arg == "*"):
+         clear_all = True;
+      else:
+         label = arg;
+         is_label = True;
+
+      if (is_label):
+         if (label in self.labels):
+            addr = int(self.labels[label], 16);
+         else:
+            self.tran_print("Invalid label.");
+            return;
+
+      if (clear_all):
+         self.breakpoints.clear();
+         self.break_conditions.clear();
+      else:
+         if (addr in self.breakpoints):
+            del self.breakpoints[addr];
+            self.break_conditions.pop(addr, None);
+         else: #no break point at that address
+            if (is_label):
+               self.tran_print("No breakpoint at " + label + ".");
+            else:
+               self.tran_print("No breakpoint at " + to_4_digit_uc_hex(addr)
+                               + ".");
+
+   # Print out all of the breakpoints and the addresses, with their
+   # conditions, then the cycle breakpoints and the watchpoints.
+   def list_breakpoints(self):
+      for key in self.breakpoints:
+         if (key in self.break_conditions):
+            self.tran_print(to_4_digit_uc_hex(key) + " if " +
+                            self.break_conditions[key].text);
+         else:
+            self.tran_print(to_4_digit_uc_hex(key));
+      for cycle in sorted(self.cycle_breakpoints):
+         self.tran_print("cycle %d" % cycle);
+      for (lo, hi, mode) in self.watchpoints:
+         self.tran_print("watch %04X:%04X %s" % (lo, hi, mode));
+
+   # Returns the address arg names: a hex address, a label or a label in
+   # quotes. Prints a message and returns None for an unknown label.
+   def parse_addr(self, arg):
+      label = arg.strip("'");
+      if (not match("^'", arg) and match("^[0-9a-f]{1,4}$", arg, IGNORECASE)):
+         return int(arg, 16);
+      if (label in self.labels):
+         return int(self.labels[label], 16);
+      self.tran_print("Invalid label.");
+      return None;
+
+   # Watches memory from lo to hi (addresses or labels; hi defaults to lo)
+   # for reads, writes or both (mode r, w or rw, w by default). run stops
+   # after an instruction that makes a watched access.
+   def set_watchpoint(self, lo, hi, mode):
+      lo = self.parse_addr(lo);
+      hi = self.parse_addr(hi) if (hi) else lo;
+      if (lo == None or hi == None):
+         return;
+      if (lo > hi):
+         self.tran_print("Did you mean watch %X:%X?" % (hi, lo));
+         return;
+      self.watchpoints.append((lo, hi, (mode or "w").lower()));
+      self.update_watch_map();
+
+   # Clears the watchpoints on exactly lo to hi, or all of them for *
+   def clear_watchpoint(self, lo, hi):
+      if (lo == "*"):
+         del self.watchpoints[:];
+      else:
+         lo = self.parse_addr(lo);
+         hi = self.parse_addr(hi) if (hi) else lo;
+         if (lo == None or hi == None):
+            return;
+         kept = [watch for watch in self.watchpoints
+                 if (watch[:2] != (lo, hi))];
+         if (len(kept) == len(self.watchpoints)):
+            self.tran_print("No watchpoint on %04X:%04X." % (lo, hi));
+            return;
+         self.watchpoints[:] = kept;
+      self.update_watch_map();
+
+   # Rebuilds watch_map from the watchpoints
+   def update_watch_map(self):
+      watch_map = bytearray(1 << 16);
+      for (lo, hi, mode) in self.watchpoints:
+         for addr in xrange(lo, hi + 1):
+            watch_map[addr] |= watch_modes[mode];
+      self.watch_map[:] = watch_map;
+
+   # Loads state from a given state file (usually made by save), text or
+   # binary. Registers that are don't cares in the file are left alone.
+   def load(self, filename):
+      self.tran_print("Loading from " + filename + "...");
+      try:
+         saved = read_state_file(filename);
+      except:
+         self.tran_print("Unable to read from " + filename);
+         return;
+      for addr in saved.breakpoints:
+         self.breakpoints[addr] = 1;
+      state = self.state;
+      for label in state_labels:
+         if (label in saved.dont_care or label in saved.raw): continue;
+         value = saved.values[label];
+         if (label == "STATE"):
+            state[label] = ustate_ids[value];
+         elif (label == "Cycle"):
+            self.cycle_num = value;
+         elif (label == "ZNCV"):
+            for (flag, bit) in [("Z", 3), ("N", 2), ("C", 1), ("V", 0)]:
+               state[flag] = (value >> bit) & 1;
+         elif (label in state):
+            state[label] = value;
+         else:
+            state["regFile"][int(label[1])] = value;
+      for addr in saved.valid_addrs():
+         if (self.page_shared[addr >> page_bits]):
+            self.preserve_page(addr >> page_bits);
+         self.memory[addr] = saved.memory[addr];
+         self.memory_valid[addr] = 1;
+         if (addr in self.block_covers): self.invalidate_blocks(addr);
+      self.mark_history();
+
+   # Save state of processor, memory, and breakpoints to a file. State
+   # file can be used to check against the current processor state, or can
+   # be loaded into simulation. Files ending in .bstate are saved in the
+   # binary format.
+   def save(self, filename):
+      self.tran_print("Saving to " + filename + "...");
+      try:
+         write_state_file(filename, self.saved_state());
+      except:
+         self.tran_print("Unable to write to " + filename);
+
+   # Returns the current state as a SavedState, holding the memory that
+   # save writes out: words that are valid and not zero
+   def saved_state(self):
+      saved = SavedState();
+      if (self.seed != None): saved.seed = "%04X" % self.seed;
+      saved.breakpoints = list(self.breakpoints);
+      state = self.state;
+      values = saved.values;
+      for label in state_labels:
+         if (label in state):
+            values[label] = state[label];
+         elif (label[0] == "R"):
+            values[label] = state["regFile"][int(label[1])];
+      values["Cycle"] = self.cycle_num;
+      values["STATE"] = ustate_names[state["STATE"]];
+      values["ZNCV"] = ((state["Z"] << 3) | (state["N"] << 2) |
+                        (state["C"] << 1) | state["V"]);
+      saved.memory[:] = self.memory;
+      memory = self.memory;
+      memory_valid = self.memory_valid;
+      valid = saved.valid;
+      for addr in xrange(1 << 16):
+         if (memory_valid[addr] and memory[addr]):
+            valid[addr] = 1;
+      return saved;
+
+   # Keeps a copy of the registers, cycle count and memory under name,
+   # replacing any snapshot of that name. Memory isn't copied until written.
+   def snapshot(self, name):
+      self.snapshots[name] = Snapshot(self.state, self.cycle_num, self.seed,
+                                      self.page_unfilled);
+      self.page_shared[:] = bytearray([1]) * num_pages;
+
+   # Puts the registers, cycle count and memory back as they were when
+   # snapshot name was taken. Only pages written since then are copied.
+   # Return value:
+   #  * False if there is no snapshot called name
+   def restore(self, name):
+      snap = self.snapshots.get(name);
+      if (snap == None):
+         return False;
+      self.restore_snapshot(snap);
+      self.mark_history();
+      return True;
+
+   # Puts the registers, cycle count and memory back as they were when
+   # snap was taken
+   def restore_snapshot(self, snap):
+      state = self.state;
+      regFile = state["regFile"];
+      state.update(snap.state);
+      state["regFile"] = regFile;
+      regFile[:] = snap.state["regFile"];
+      self.cycle_num = snap.cycle_num;
+
+      block_covers = self.block_covers;
+      for (page, (words, valid)) in snap.pages.items():
+         self.preserve_page(page);
+         lo = page << page_bits;
+         self.memory[lo:lo + page_size] = words;
+         self.memory_valid[lo:lo + page_size] = valid;
+         if (block_covers):
+            for addr in xrange(lo, lo + page_size):
+               if (addr in block_covers): self.invalidate_blocks(addr);
+      # memory matches snap again, so it can go back to sharing every page
+      snap.pages.clear();
+      self.page_shared[:] = bytearray([1]) * num_pages;
+      self.seed = snap.seed;
+      self.page_unfilled[:] = snap.page_unfilled;
+
+   # Gives each snapshot sharing page its own copy, before the page is
+   # changed (filling it first, if it isn't)
+   def preserve_page(self, page):
+      if (self.page_unfilled[page]):
+         self.fill_page(page);
+      lo = page << page_bits;
+      copy = None;
+      for snap in self.snapshots.itervalues():
+         if (page not in snap.pages):
+            if (copy == None):
+               copy = (self.memory[lo:lo + page_size],
+                       self.memory_valid[lo:lo + page_size]);
+            snap.pages[page] = copy;
+      self.page_shared[page] = 0;
+
+   # Takes a history checkpoint: a snapshot of the current state, kept
+   # under ("checkpoint", cycle). Past max_checkpoints, every other one is
+   # dropped and they are taken half as often, so history reaches back
+   # further while seeks replay at most checkpoint_interval cycles. The
+   # oldest are dropped to stay within history_budget.
+   def checkpoint(self):
+      if (not self.history_budget):
+         self.next_checkpoint = 1 << 64;
+         return;
+      checkpoints = self.checkpoints;
+      checkpoints.append(self.cycle_num);
+      self.snapshot(("checkpoint", self.cycle_num));
+      if (len(checkpoints) > max_checkpoints):
+         for cycle in checkpoints[1:-1:2]:
+            del self.snapshots[("checkpoint", cycle)];
+         checkpoints[:] = checkpoints[0:-1:2] + checkpoints[-1:];
+         self.checkpoint_interval *= 2;
+      while (len(checkpoints) > 1 and
+             self.history_size() > self.history_budget):
+         del self.snapshots[("checkpoint", checkpoints.pop(0))];
+      self.next_checkpoint = self.cycle_num + self.checkpoint_interval;
+
+   # Returns about how many bytes the history checkpoints take up
+   def history_size(self):
+      size = 0;
+      for cycle in self.checkpoints:
+         pages = len(self.snapshots[("checkpoint", cycle)].pages);
+         size += 1024 + pages * page_size * 3; # a word and a valid byte
+      return size;
+
+   # Records that the state was changed other than by simulating (set by
+   # hand, loaded or restored): the history after this cycle no longer
+   # applies, and the new state is checkpointed.
+   def mark_history(self):
+      while (self.checkpoints and self.checkpoints[-1] >= self.cycle_num):
+         del self.snapshots[("checkpoint", self.checkpoints.pop())];
+      self.checkpoint();
+
+   # Moves to the start of cycle target, by going to the last checkpoint
+   # before it (unless the current cycle is closer) and simulating forward.
+   # Checkpoints past the current cycle are still good, as nothing but
+   # simulating has changed the state since (see mark_history). Breakpoints
+   # and watchpoints are ignored on the way, and nothing is printed.
+   # Return value:
+   #  * False if target is older than the history kept
+   def seek(self, target):
+      older = [cycle for cycle in self.checkpoints if (cycle <= target)];
+      if (target < self.cycle_num and not older):
+         return False;
+      if (older and (target < self.cycle_num or older[-1] > self.cycle_num)):
+         self.restore_snapshot(self.snapshots[("checkpoint", older[-1])]);
+      trace_cycles = self.trace_cycles;
+      self.trace_cycles = False; # replayed cycles aren't traced again
+      self.replay(target);
+      self.trace_cycles = trace_cycles;
+      return True;
+
+   # Simulates until the start of cycle target, whole instructions at a
+   # time where that can't overshoot it, taking checkpoints on the way
+   # Return value:
+   #  * the cycles instructions started at along the way
+   def replay(self, target):
+      state = self.state;
+      starts = [];
+      while (self.cycle_num < target):
+         if (state["STATE"] == fetch_id):
+            starts.append(self.cycle_num);
+            if (self.fast_engine and
+                self.cycle_num + max_instr_cycles <= target):
+               self.execute_instruction();
+            else:
+               self.cycle();
+         else:
+            self.cycle();
+         if (self.cycle_num >= self.next_checkpoint):
+            self.checkpoint();
+      return starts;
+
+   # Moves back to the start of the instruction before the current cycle.
+   # Return value:
+   #  * False if that is older than the history kept
+   def back(self):
+      target = self.cycle_num;
+      for cycle in reversed(self.checkpoints):
+         if (cycle >= target): continue;
+         self.restore_snapshot(self.snapshots[("checkpoint", cycle)]);
+         starts = self.replay(target);
+         if (starts):
+            return self.seek(starts[-1]);
+      self.seek(target);
+      return False;
+
+   # Handles the history command: prints what history is kept, or sets the
+   # budget to kb kilobytes (0 turns history off)
+   def history_command(self, kb):
+      if (kb != None):
+         self.history_budget = int(kb) << 10;
+         if (not self.history_budget):
+            for cycle in self.checkpoints:
+               del self.snapshots[("checkpoint", cycle)];
+            del self.checkpoints[:];
+         self.mark_history();
+      elif (not self.checkpoints):
+         self.tran_print("History is off. Use 'history [kb]' to turn it on.");
+      else:
+         self.tran_print("History: %d checkpoints from cycle %d, %dK of %dK"
+                         % (len(self.checkpoints), self.checkpoints[0],
+                            self.history_size() >> 10,
+                            self.history_budget >> 10));
+
+   # Handles back, uback and seek. target is a cycle, or "i" for the
+   # previous instruction or "u" for the previous cycle. The state is
+   # printed afterwards unless running quietly.
+   def reverse_command(self, target):
+      if (not self.checkpoints):
+         self.tran_print("History is off. Use 'history [kb]' to turn it on.");
+         return;
+      if (target == "i"):
+         found = self.back();
+      elif (target == "u"):
+         found = (self.cycle_num > 0 and self.seek(self.cycle_num - 1));
+      else:
+         found = self.seek(int(target));
+      if (not found):
+         self.tran_print("That is before the oldest cycle kept (%d)."
+                         % self.checkpoints[0]);
+      elif (self.print_per != "q"):
+         self.tran_print(wide_header);
+         self.tran_print(self.get_state());
+
+   # Sets the value of a register
+   def set_reg(self, reg_name, value):
+      state = self.state;
+      reg_name = reg_name.upper(); #keys stored as uppercase
+      value = int(value,16);
+      if (match('^R([0-7])$', reg_name, IGNORECASE)):
+         matchObj = match('^R([0-7])$', reg_name, IGNORECASE);
+         state["regFile"][int(matchObj.group(1))] = value;
+      elif (match("^[ZNCV]$", reg_name)):
+         if (match("^[01]$", reg_name)):
+            state[reg_name] = value;
+         else:
+            self.tran_print("Value must be 0 or 1 for this register.");
+      else:
+         state[reg_name] = value;
+      self.mark_history();
+
+   # Gets the value of a register
+   def get_reg(self, reg_name):
+      state = self.state;
+      reg_name = reg_name.upper();
+      if (reg_name == "*"):
+         self.tran_print(self.get_state());
+      elif (reg_name == "R*"):
+         self.print_regfile();
+      elif (match("R([0-7])", reg_name, IGNORECASE)):
+         reg_num = int(match("R([0-7])", reg_name, IGNORECASE).group(1));
+         self.tran_print("R%d: %04X" % (reg_num, state["regFile"][reg_num]));
+      elif (reg_name == "STATE"):
+         self.tran_print("%s: %s" % (reg_name, ustate_names[state[reg_name]]));
+      elif (reg_name in ["Z", "N", "C", "V"]):
+         self.tran_print("%s: %d" % (reg_name, state[reg_name]));
+      else:
+         self.tran_print("%s: %04X" % (reg_name, state[reg_name]));
+
+   # Gets a string containing all the state information
+   def get_state(self):
+      state = self.state;
+      state_name = ustate_names[state["STATE"]];
+      state_info = "%0.4d" % self.cycle_num;
+      state_info += " " * (7 - len(state_name));
+      state_info += "%s %04X %04X %04X %d%d%d%d %04X %04X" % (state_name,
+                                               state["PC"], state["IR"],
+                                               state["SP"], state["Z"],
+                                               state["N"], state["C"],
+                                               state["V"], state["MAR"],
+                                               state["MDR"]);
+      state_info += " %04X %04X %04X %04X %04X %04X %04X %04X" % tuple(
+                                               state["regFile"]);
+      return state_info;
+
+   # prints the state of R0-R7
+   def print_regfile(self):
+      for index in xrange(0,8,2):
+         value = self.state["regFile"][index];
+         reg_str = "R%d: %04X \t" % (index, value);
+         value = self.state["regFile"][index+1];
+         reg_str += "R%d: %04X" %(index+1, value);
+         self.tran_print(reg_str);
+
+   # Sets a memory value from hex strings. The valid bit specifies if it
+   # will be store in a save state file.
+   def set_memory(self, addr, value, valid):
+      addr = int(addr, 16);
+      if (self.page_shared[addr >> page_bits]):
+         self.preserve_page(addr >> page_bits);
+      self.memory[addr] = int(value,16);
+      self.memory_valid[addr] = valid;
+      if (addr in self.block_covers): self.invalidate_blocks(addr);
+      self.mark_history();
+
+   # Gets the state of a selection of memory, arguments are passed in a dict
+   # get_zeros specifies if zeros will be printed when they are reached
+   # lo - the inclusive lower bound of memory
+   # hi - the inclusive upper bound
+   def fget_memory(self, args):
+      if ("zeros" in args):
+         print_zeros = args["zeros"];
+      else:
+         print_zeros = True;
+      lo = int(args["lo"], 16);
+      if ("hi" in args and args["hi"] != None):
+         hi = int(args["hi"],16);
+      else:
+         hi = lo;
+
+      if (lo > hi):
+         self.tran_print("Did you mean mem[%x:%x]?" % (hi,lo));
+         return;
+
+      for index in xrange(lo, hi+1):
+         value = self.read_memory(index);
+         # Value in memory location that we care about
+         if (value != 0 or print_zeros):
+            state_str = hex_to_state(value);
+            rd = (value >> rd_shift) & reg_mask;
+            rs = (value >> rs_shift) & reg_mask;
+            mem_val = "mem[%04X]: %04X %s %d %d" % (index, value,
+                                            state_str, rd, rs);
+            self.tran_print(mem_val);
+
+   # Checks the state of the processor and memory against a given state file
+   # (text or binary). Prints out differences. Registers set to XXXX/xxxx in
+   # state file are ignored for comparison. Memory not specified in state
+   # file is also ignored. Breakpoints are always ignored. Registers are
+   # compared ignoring case, since older versions of sim240 could save MDR
+   # in lowercase. The file is compiled once and reused while unchanged.
+   def check_state(self, state_file):
+      try:
+         comparator = compile_state_file(state_file);
+      except (IOError, OSError):
+         self.tran_print("Failed to open state file");
+         return;
+      for difference in comparator.diff(self):
+         self.tran_print(difference);
+
+   # Compares the simulator against the lines of a text state file.
+   # Return value:
+   #  * a line describing each difference, empty if the state matches
+   def diff_state(self, lines):
+      return StateComparator(parse_state_text(lines)).diff(self);
+
+   # Prints all the labels associated with the given .list file
+   def print_labels(self):
+      for key in self.labels:
+         if (len(key) > 0): # ignores spuriously created labels
+            self.tran_print(key + ": " + self.labels[key]);
+
+   # Prints simulation statistics
+   def print_stats(self):
+      stats = self.block_stats;
+      self.tran_print("Cycles: %d" % self.cycle_num);
+      lookups = stats["hits"] + stats["misses"];
+      rate = (100.0 * stats["hits"] / lookups) if (lookups) else 0.0;
+      self.tran_print("Block cache: %d hits, %d misses (%.1f%% hit rate), "
+                      "%d invalidated, %d cached"
+                      % (stats["hits"], stats["misses"], rate,
+                         stats["invalidations"], len(self.block_cache)));
+      if (self.jit):
+         self.tran_print("JIT: %d blocks translated" % stats["translated"]);
+
+   ########################
+   # Simulator Code
+   ########################
+
+   # Simulate one cycle in the processor
+   def cycle(self):
+      state = self.state;
+      # Control Path ###
+      (alu_op, srcA, srcB, dest, load_CC, mem_rd, mem_wr, next_state,
+       branch_flag, branch_state) = microcode[state["STATE"]];
+      if (next_state is None): # DECODE
+         next_state = decode_table[state["IR"] >> opcode_shift];
+      elif (branch_flag and state[branch_flag]):
+         next_state = branch_state;
+
+      ### Start of ALU ###
+      if (srcA is None):
+         inA = 0;
+      elif (srcA == "REG"):
+         inA = state["regFile"][(state["IR"] >> rd_shift) & reg_mask];
+      else:
+         inA = state[srcA];
+
+      if (srcB is None):
+         inB = 0;
+      elif (srcB == "REG"):
+         inB = state["regFile"][(state["IR"] >> rs_shift) & reg_mask];
+      else:
+         inB = state[srcB];
+
+      (alu_result, carry, overflow) = alu_op(inA, inB, state["C"]);
+      ### End of ALU ##
+
+      ### Memory ###
+      mem_data = self.memory_sim(mem_rd, mem_wr, state["MAR"], state["MDR"]);
+
+      ### Sequential Logic ###
+      if (dest == "REG"):
+         state["regFile"][(state["IR"] >> rd_shift) & reg_mask] = alu_result;
+      elif (dest):
+         state[dest] = alu_result;
+
+      # store memory output to MDR
+      if (mem_rd):
+         state["MDR"] = mem_data;
+
+      # load condition codes
+      if (load_CC):
+         state["Z"] = 1 if (alu_result == 0) else 0;
+         state["N"] = alu_result >> 15;
+         state["C"] = carry;
+         state["V"] = overflow;
+
+      state["STATE"] = next_state;
+
+      self.cycle_num += 1;
+      if (self.trace_cycles): self.trace.record(self);
+
+   # Simulates a memory.
+   # If re is set, read from memory.
+   # If we is set, write data_in to memory.
+   # Reading and writing both use addr.
+   # Return value:
+   # Returns the data stored at addr when reading; 0 otherwise.
+   def memory_sim(self, re, we, addr, data_in):
+      data_out = 0; # data_in would mimic bus more accurately...
+      if (re):
+         if (self.page_unfilled[addr >> page_bits]):
+            self.fill_page(addr >> page_bits);
+         data_out = self.memory[addr];
+      if (we):
+         if (self.page_shared[addr >> page_bits]):
+            self.preserve_page(addr >> page_bits);
+         self.memory[addr] = data_in;
+         self.memory_valid[addr] = 1;
+         if (addr in self.block_covers): self.invalidate_blocks(addr);
+
+      return data_out;
+
+   # Simulates the instruction starting at FETCH in one go.
+   def execute_instruction(self):
+      state = self.state;
+      cycles = self.fetch_fn(state, state["regFile"]);
+      next_state = decode_table[state["IR"] >> opcode_shift];
+      instr_fn = self.instr_fns[next_state];
+      if (instr_fn):
+         self.cycle_num += cycles + instr_fn(state, state["regFile"]);
+      else:
+         self.cycle_num += cycles;
+         state["STATE"] = next_state;
+         while (state["STATE"] != fetch_id and state["STATE"] != stop1_id):
+            self.cycle();
+
+   # Decodes the block starting at start and adds it to the cache. The block
+   # stops at the first instruction that can jump or the engine doesn't
+   # handle, and is empty if the first one is such an instruction.
+   def decode_block(self, start):
+      instrs = [];
+      covered = [];
+      addr = start;
+      while (len(instrs) < max_block_len):
+         ir = self.read_memory(addr);
+         state_id = decode_table[ir >> opcode_shift];
+         if (not self.instr_fns[state_id]):
+            covered.append(addr);
+            break;
+         (words, ends_block) = instr_shapes[state_id];
+         instrs.append((addr, ir, self.instr_fns[state_id]));
+         for i in xrange(words):
+            covered.append(addr);
+            addr = (addr + 1) & 0xffff;
+         if (ends_block):
+            break;
+      block = [instrs, covered, 0, None, None];
+      self.block_cache[start] = block;
+      for addr in covered:
+         self.block_covers.setdefault(addr, set()).add(start);
+      return block;
+
+   # Drops every cached block decoded from addr
+   def invalidate_blocks(self, addr):
+      block_covers = self.block_covers;
+      for start in block_covers.pop(addr, ()):
+         covered = self.block_cache.pop(start)[1];
+         for other in covered:
+            if (other != addr and other in block_covers):
+               block_covers[other].discard(start);
+               if (not block_covers[other]):
+                  del block_covers[other];
+         self.block_stats["invalidations"] += 1;
+
+   # Empties the cache, for when all of memory is rewritten
+   def flush_blocks(self):
+      self.block_cache.clear();
+      self.block_covers.clear();
+
+   # Translates a block with the JIT (or finds code it was translated into
+   # before, if memory there still holds the same words), and keeps the
+   # function in the block.
+   # Returns the function.
+   def translate_block(self, block):
+      (instrs, covered) = block[0:2];
+      key = (tuple(covered), tuple(self.memory[addr] for addr in covered));
+      code = self.jit_code.get(key);
+      if (code == None):
+         code = BlockTranslator(instrs, covered, self.memory).compile();
+         self.jit_code[key] = code;
+      exec(code, self.engine_env);
+      block[3] = self.engine_env["block_fn"];
+      block[4] = set(addr for (addr, ir, instr_fn) in instrs[1:]);
+      self.block_stats["translated"] += 1;
+      return block[3];
+
+   # Simulates up to limit instructions of the block at PC (at least one).
+   # Stops early at a breakpoint or when the block is thrown away by a write
+   # into it. The fetch of a cached instruction only loads MAR, MDR, IR and
+   # PC, so it is done without reading memory or decoding.
+   # Returns the number of instructions simulated.
+   def execute_block(self, limit):
+      state = self.state;
+      stats = self.block_stats;
+      block = self.block_cache.get(state["PC"]);
+      if (block == None):
+         stats["misses"] += 1;
+         block = self.decode_block(state["PC"]);
+      else:
+         stats["hits"] += 1;
+      if (not block[0]):
+         self.execute_instruction();
+         return 1;
+
+      regFile = state["regFile"];
+      breakpoints = self.breakpoints;
+      if (self.jit):
+         block_fn = block[3];
+         if (block_fn == None):
+            block[2] += 1;
+            if (block[2] >= self.jit_threshold):
+               block_fn = self.translate_block(block);
+         # the translated function can't stop partway through the block
+         if (block_fn and limit >= len(block[0]) and
+             (not breakpoints or block[4].isdisjoint(breakpoints))):
+            (count, cycles) = block_fn(state, regFile);
+            self.cycle_num += cycles;
+            return count;
+      invalidations = stats["invalidations"];
+      cycles = 0;
+      count = 0;
+      for (addr, ir, instr_fn) in block[0]:
+         state["MAR"] = addr;
+         state["MDR"] = ir;
+         state["IR"] = ir;
+         state["PC"] = (addr + 1) & 0xffff;
+         cycles += fetch_cycles + instr_fn(state, regFile);
+         count += 1;
+         if (count == limit or state["PC"] in breakpoints or
+             stats["invalidations"] != invalidations):
+            break;
+      self.cycle_num += cycles;
+      return count;
+
+########################
+# Supporting Subroutines
+########################
+
+# Streams a transcript to a file as it is written, so it takes bounded
+# memory and little is lost if sim240 dies. Writes go through a 64K file
+# buffer that is flushed at least every flush_interval seconds (checked
+# every check_every writes). Files ending in .gz are gzip compressed.
+class TranscriptWriter(object):
+   check_every = 256;
+   flush_interval = 1.0;
+
+   def __init__(self, fname):
+      if (fname.endswith(".gz")):
+         self.fh = gzip.open(fname, "wb");
+      else:
+         self.fh = open(fname, "w", 1 << 16);
+      self.writes = 0;
+      self.last_flush = time();
+
+   def write(self, text):
+      self.fh.write(text);
+      self.writes += 1;
+      if (self.writes >= self.check_every):
+         self.writes = 0;
+         if (time() - self.last_flush >= self.flush_interval):
+            self.flush();
+
+   def flush(self):
+      self.fh.flush();
+      self.last_flush = time();
+
+   def close(self):
+      self.fh.close();
+
+# Binary execution traces, written by a TraceWriter as the simulator runs
+# and read back by read_trace (trace240 prints them). A trace starts with
+# a header: trace_magic, the version (a word), u or i (a byte: a record
+# per cycle or per instruction), then the number of control states (a
+# byte) and their names (each a length byte and the name). Each record
+# then holds only what changed since the last one: a word with bit i set
+# for each of trace_fields[i] that changed, the cycle (a byte counting up
+# from the last record's, or 8 bytes if bit 15 is set, as in the first
+# record and after a jump), and the changed fields in order (STATE and
+# ZNCV a byte, the rest a word).
+# Everything is little endian; files ending in .gz are gzip compressed.
+trace_magic = "T240";
+trace_version = 1;
+trace_fields = state_labels[1:]; # STATE PC IR SP ZNCV MAR MDR R0-R7
+trace_jump = 1 << 15;
+trace_formats = ["B" if (field in ["STATE", "ZNCV"]) else "H"
+                 for field in trace_fields];
+
+# Makes the function TraceWriter.record uses to find what changed:
+# trace_changes(s, r, last) takes the register dict and register file and
+# the list of the fields last recorded, which it updates.
+# Returns (mask, changed): the record's mask and the changed values.
+def gen_trace_changes():
+   exprs = ['s["%s"]' % field for field in trace_fields];
+   exprs[trace_fields.index("ZNCV")] = \
+       '(s["Z"] << 3) | (s["N"] << 2) | (s["C"] << 1) | s["V"]';
+   for i in xrange(8):
+      exprs[trace_fields.index("R%d" % i)] = "r[%d]" % i;
+   src = "def trace_changes(s, r, last):\n";
+   src += "   mask = 0\n";
+   src += "   changed = []\n";
+   for i in xrange(len(exprs)):
+      src += "   v = %s\n" % exprs[i];
+      src += "   if (v != last[%d]):\n" % i;
+      src += "      mask |= %d\n" % (1 << i);
+      src += "      changed.append(v)\n";
+      src += "      last[%d] = v\n" % i;
+   src += "   return (mask, changed)\n";
+   env = {};
+   exec(compile(src, "<trace>", "exec"), env);
+   return env["trace_changes"];
+
+trace_changes = gen_trace_changes();
+
+# Writes a trace of a simulator (see trace_magic). The simulator records
+# into it on each cycle (per u) or instruction (per i).
+class TraceWriter(TranscriptWriter):
+   def __init__(self, fname, per = "u"):
+      TranscriptWriter.__init__(self, fname);
+      self.per = per;
+      self.last = [None] * len(trace_fields);
+      self.last_cycle = None;
+      self.structs = {}; # mask -> Struct packing a record with that mask
+      header = [trace_magic, pack("<HcB", trace_version, per,
+                                  len(ustate_names))];
+      for name in ustate_names:
+         header.append(chr(len(name)) + name);
+      self.write("".join(header));
+
+   # Writes a record of the simulator's current state
+   def record(self, sim):
+      state = sim.state;
+      (mask, changed) = trace_changes(state, state["regFile"], self.last);
+      cycle = sim.cycle_num;
+      if (self.last_cycle != None and 0 <= cycle - self.last_cycle < 256):
+         changed.insert(0, cycle - self.last_cycle);
+      else:
+         changed.insert(0, cycle);
+         mask |= trace_jump;
+      self.last_cycle = cycle;
+      record = self.structs.get(mask);
+      if (record == None):
+         fmt = "<HQ" if (mask & trace_jump) else "<HB";
+         for i in xrange(len(trace_fields)):
+            if (mask & (1 << i)):
+               fmt += trace_formats[i];
+         record = self.structs[mask] = Struct(fmt);
+      self.write(record.pack(mask, *changed));
+
+# Reads a trace file (see trace_magic) one record at a time.
+# Return value (a generator):
+#  * the per of the trace ("u" or "i"), then for each record a dict of
+#    its values under state_labels (STATE is a name, ZNCV a 4 bit int).
+#    The same dict is updated and yielded each time.
+def read_trace(fname):
+   if (is_vcd(fname)):
+      return read_vcd(fname);
+   return read_binary_trace(fname);
+
+def read_binary_trace(fname):
+   if (fname.endswith(".gz")):
+      fh = gzip.open(fname, "rb");
+   else:
+      fh = open(fname, "rb", 1 << 16);
+   if (fh.read(4) != trace_magic):
+      raise ValueError(fname + " is not a sim240 trace");
+   (version, per, num_states) = unpack("<HcB", fh.read(4));
+   if (version != trace_version):
+      raise ValueError("trace version %d not supported" % version);
+   names = [];
+   for i in xrange(num_states):
+      names.append(fh.read(ord(fh.read(1))));
+   yield per;
+
+   sizes = [calcsize("<" + fmt) for fmt in trace_formats];
+   values = {};
+   while (True):
+      data = fh.read(2);
+      if (len(data) < 2): break;
+      mask = unpack("<H", data)[0];
+      if (mask & trace_jump):
+         values["Cycle"] = unpack("<Q", fh.read(8))[0];
+      else:
+         values["Cycle"] += ord(fh.read(1));
+      for i in xrange(len(trace_fields)):
+         if (mask & (1 << i)):
+            value = unpack("<" + trace_formats[i], fh.read(sizes[i]))[0];
+            values[trace_fields[i]] = names[value] if (i == 0) else value;
+      yield values;
+   fh.close();
+
+# Formats the values of a trace record as get_state does. Values a VCD
+# has as unknown (None) are printed as XXXX.
+def trace_line(values):
+   return ("%0.4d%7s " % (values["Cycle"], values["STATE"]) +
+           " ".join([trace_value(field, values[field])
+                     for field in trace_fields[1:]]));
+
+# Formats one field of a trace record as get_state does
+def trace_value(field, value):
+   if (value == None):
+      return "XXXX";
+   if (field == "STATE"):
+      return value;
+   if (field == "ZNCV"):
+      return "%d%d%d%d" % ((value >> 3) & 1, (value >> 2) & 1,
+                           (value >> 1) & 1, value & 1);
+   return "%04X" % value;
+
+# Returns the current state of a simulator as a trace record (see
+# read_trace)
+def trace_values(sim):
+   state = sim.state;
+   r = state["regFile"];
+   return {"Cycle" : sim.cycle_num, "STATE" : ustate_names[state["STATE"]],
+           "PC" : state["PC"], "IR" : state["IR"], "SP" : state["SP"],
+           "ZNCV" : ((state["Z"] << 3) | (state["N"] << 2) |
+                     (state["C"] << 1) | state["V"]),
+           "MAR" : state["MAR"], "MDR" : state["MDR"],
+           "R0" : r[0], "R1" : r[1], "R2" : r[2], "R3" : r[3],
+           "R4" : r[4], "R5" : r[5], "R6" : r[6], "R7" : r[7]};
+
+# Co-simulation with the RTL model of the p18240 (processor/p18240.sv).
+# A VCD dump of p18240_top is read as a stream of trace records, one per
+# cycle, sampled on the falling edge of the clock as p18240_top's $display
+# is (and skipping cycles in reset), so they line up with sim240's cycles.
+# rtl_signals maps trace fields to the p18240_top signals holding them
+# (with their widths); condCodes is ordered ZCNV. A VcdWriter writes
+# sim240's trace as the same signals, and compare_traces checks any two
+# traces against each other a cycle at a time.
+rtl_top = "p18240_top";
+rtl_clock = "clock";
+rtl_reset = "reset_L";
+rtl_signals = [("STATE", "currState", 10), ("PC", "pc", 16),
+               ("IR", "ir", 16), ("SP", "sp", 16), ("ZNCV", "condCodes", 4),
+               ("MAR", "memAddr", 16), ("MDR", "memData", 16)] + \
+              [("R%d" % i, "r%d" % i, 16) for i in xrange(8)];
+# currState values (opcode_t in processor/constants.sv); UNDEF is all x
+rtl_state_codes = dict([(name, "{0:010b}".format(code))
+                        for (name, code) in state_codes.items()]);
+rtl_state_codes["UNDEF"] = "x" * 10;
+rtl_state_names = dict([(code, name)
+                        for (name, code) in state_codes.items()]);
+
+# Returns True if fname names a VCD file (.vcd, or .vcd.gz compressed)
+def is_vcd(fname):
+   return fname.endswith(".vcd") or fname.endswith(".vcd.gz");
+
+# Swaps the C and N bits of condition codes, which turns the RTL's ZCNV
+# order into sim240's ZNCV and back
+def swap_cn(flags):
+   return (flags & 9) | ((flags & 4) >> 1) | ((flags & 2) << 1);
+
+# Converts a VCD value of a trace field to a trace record value. Values
+# with unknown (x or z) bits are None, except currState, where they are
+# UNDEF as in opcode_t.
+def vcd_value(field, bits):
+   bits = bits.lower();
+   known = ("x" not in bits and "z" not in bits);
+   if (field == "STATE"):
+      if (not known): return "UNDEF";
+      code = int(bits, 2);
+      return rtl_state_names.get(code, "?%03X" % code);
+   if (not known): return None;
+   if (field == "ZNCV"): return swap_cn(int(bits, 2));
+   return int(bits, 2);
+
+# Splits a file into whitespace separated tokens, a line at a time
+def vcd_tokens(fh):
+   for line in fh:
+      for token in line.split():
+         yield token;
+
+# Reads the signals of rtl_signals from a VCD dump of p18240_top, as a
+# generator like read_binary_trace: yields "u", then one trace record per
+# cycle (the same dict, updated). p18240_top is the first scope with all
+# its signals, or the one named by scope (like tb.dut). Only the
+# signals being compared are kept, so dumps of any length can be read.
+def read_vcd(fname, scope = None):
+   if (fname.endswith(".gz")):
+      fh = BufferedReader(gzip.open(fname, "rb"), 1 << 16); # fast readline
+   else:
+      fh = open(fname, "r", 1 << 16);
+   tokens = vcd_tokens(fh);
+
+   # the header: $scope, $var and $upscope declarations, each ended by $end
+   scopes = [];
+   found = {}; # scope path -> {signal name : id code}
+   directive = [];
+   for token in tokens:
+      if (token != "$end"):
+         directive.append(token);
+         continue;
+      if (directive[0] == "$scope"):
+         scopes.append(directive[2]);
+      elif (directive[0] == "$upscope"):
+         scopes.pop();
+      elif (directive[0] == "$var"):
+         found.setdefault(".".join(scopes), {})[directive[4]] = directive[3];
+      elif (directive[0] == "$enddefinitions"):
+         break;
+      directive = [];
+   names = [rtl_clock] + [name for (field, name, width) in rtl_signals];
+   paths = [path for path in sorted(found)
+            if ((scope == None or path == scope or
+                 path.endswith("." + scope)) and
+                not [name for name in names if (name not in found[path])])];
+   if (not paths):
+      raise ValueError("%s has no scope with the signals of %s (%s)" %
+                       (fname, scope or rtl_top, " ".join(names)));
+   signals = found[paths[0]];
+   fields = {}; # id code -> trace fields it holds
+   for (field, name, width) in rtl_signals:
+      fields.setdefault(signals[name], []).append(field);
+   clock_code = signals[rtl_clock];
+   reset_code = signals.get(rtl_reset);
+   yield "u";
+
+   # value changes, sampled after the last change at a falling clock edge
+   values = {"Cycle" : 0};
+   for (field, name, width) in rtl_signals:
+      values[field] = vcd_value(field, "x");
+   clock = None;
+   reset = None;
+   sample = False;
+   for token in tokens:
+      char = token[0];
+      if (char == "#"):
+         if (sample):
+            yield values;
+            values["Cycle"] += 1;
+            sample = False;
+         continue;
+      if (char in "bB"):
+         (bits, code) = (token[1:], tokens.next());
+      elif (char in "01xXzZ"):
+         (bits, code) = (char, token[1:]);
+      else:
+         if (token == "$comment"):
+            for token in tokens:
+               if (token == "$end"): break;
+         elif (char in "rR"):
+            tokens.next(); # real values aren't compared
+         continue; # $dumpvars and the like
+      if (code == clock_code):
+         sample = (clock == "1" and bits == "0" and reset != "0");
+         clock = bits;
+      if (code == reset_code):
+         reset = bits;
+      for field in fields.get(code, ()):
+         values[field] = vcd_value(field, bits);
+   if (sample):
+      yield values;
+   fh.close();
+
+# Writes a trace of a simulator as a VCD of p18240_top (see rtl_signals),
+# like a dump of the RTL: a clock period of 10ns, with state changing on
+# the rising edge. Records are always per cycle. A VCD has every cycle and
+# can't go back, so the trace ends if the simulator skips cycles or goes
+# back to earlier ones (seek, back, reset, restore).
+class VcdWriter(TranscriptWriter):
+   def __init__(self, fname):
+      TranscriptWriter.__init__(self, fname);
+      self.per = "u";
+      self.last = [None] * len(trace_fields);
+      self.last_cycle = None;
+      self.ended = False;
+      self.codes = [chr(ord("A") + i) for i in xrange(len(trace_fields))];
+      header = ["$version sim240 $end\n", "$timescale 1ns $end\n",
+                "$scope module %s $end\n" % rtl_top,
+                "$var wire 1 ! %s $end\n" % rtl_clock];
+      for (field, name, width) in rtl_signals:
+         header.append("$var wire %d %s %s $end\n" %
+                       (width, self.codes[trace_fields.index(field)], name));
+      header.append("$upscope $end\n$enddefinitions $end\n");
+      self.write("".join(header));
+
+   # Writes the changes in the simulator's state since the last record
+   def record(self, sim):
+      if (self.ended):
+         return;
+      cycle = sim.cycle_num;
+      if (self.last_cycle != None and cycle != self.last_cycle + 1):
+         self.write("$comment sim240 went to cycle %d, the trace ends "
+                    "$end\n" % cycle);
+         self.ended = True;
+         return;
+      self.last_cycle = cycle;
+      state = sim.state;
+      (mask, changed) = trace_changes(state, state["regFile"], self.last);
+      lines = ["#%d\n1!\n" % (cycle * 10)];
+      for i in xrange(len(trace_fields)):
+         if (mask & (1 << i)):
+            value = changed.pop(0);
+            if (i == 0):
+               bits = rtl_state_codes[ustate_names[value]];
+            elif (trace_fields[i] == "ZNCV"):
+               bits = format(swap_cn(value), "b");
+            else:
+               bits = format(value, "b");
+            lines.append("b%s %s\n" % (bits, self.codes[i]));
+      lines.append("#%d\n0!\n" % (cycle * 10 + 5));
+      self.write("".join(lines));
+
+# Runs a simulator a cycle at a time from where it is, as a stream of trace
+# records (see read_trace) that ends with the cycle reaching STOP1
+def sim_records(sim):
+   while (True):
+      yield trace_values(sim);
+      if (sim.state["STATE"] == stop1_id):
+         return;
+      sim.cycle();
+
+# Compares two streams of trace records (from read_trace or sim_records)
+# record by record, keeping only the records being compared and the ones
+# before them, so traces of any length can be checked. Unknown (None)
+# values match anything. Once both stop (STOP1), extra records in the
+# longer one (like the RTL running on in STOP1) are ignored.
+# names are what to call the two traces.
+# Returns (records compared, lines describing the first difference, or
+# None if there isn't one)
+def compare_traces(expected, actual, names = ("RTL", "sim240")):
+   width = max([len(name) for name in names]) + 1;
+   count = 0;
+   last = None;
+   while (True):
+      e = next(expected, None);
+      a = next(actual, None);
+      if (e == None or a == None):
+         break;
+      for field in ([] if (e == a) else state_labels):
+         if (e[field] != a[field] and e[field] != None and a[field] != None):
+            lines = ["First difference at cycle %d: %s is %s in %s, %s in %s"
+                     % (e["Cycle"], field, trace_value(field, e[field]),
+                        names[0], trace_value(field, a[field]), names[1]),
+                     " " * width + wide_header];
+            for records in ([last] if (last) else []) + [(e, a)]:
+               lines.append(names[0].ljust(width) + trace_line(records[0]));
+               lines.append(names[1].ljust(width) + trace_line(records[1]));
+            return (count, lines);
+      last = (dict(e), dict(a));
+      count += 1;
+   if (e == a or (last and last[0]["STATE"] == last[1]["STATE"] == "STOP1")):
+      return (count, None);
+   (ended, going) = (names[0], names[1]) if (e == None) else names;
+   return (count, ["%s ends after %d records, but %s goes on" %
+                   (ended, count, going)]);
+
+# removes the two header lines from the lines of a list file
+def strip_list_header(lines):
+   lines.pop(0); # remove 'addr data  label   opcode  operands'
+   lines.pop(0); # remove '---- ----  -----   ------  --------'
+
+# Returns (address, word) for each line of a list file (without its header)
+def list_words(lines):
+   words = [];
+   for line in lines:
+      arr = line.split(" ");
+      words.append((int(arr[0], 16), int(arr[1], 16)));
+   return words;
+
+# Takes an instruction word (int) and outputs the string corresponding
+# to that opcode.
+def hex_to_state(value):
+   return ustate_names[decode_table[value >> opcode_shift]];
+
+# Takes a hexadecimal number as input and outputs a canonical form
+# The cacnonical form is a 4 digit uppercase hexadecimal number
+# Input can be 1 to 4 digits with any case.
+def to_4_digit_uc_hex(num):
+   return ("%.4x" % num).upper();
@@ -0,0 +1,200 @@
+# Benchmark suite for sim240. Loads the simulator module in-process and
+# times the test programs and the synthetic loops in bench/ in each print
+# mode (q, i and u, with printed output thrown away). Startup (importing
+# the module and making a Simulator), program loading and running are
+# timed separately; runs report cycles/sec and instructions/sec, best of
+# the repeats.
+#
+# It also runs the loop program with each kind of breakpoint and watchpoint
+# set somewhere it is never hit, to show what they cost (breakpoints on
+# addresses cost nothing; the rest make run look at every instruction),
+# and without history recording.
+#
+# Results are compared against a baseline file, and the run fails (exit
+# status 1) if any throughput drops by more than the threshold. With no
+# baseline file, or with --save, the results become the new baseline.
+# Baselines are specific to a machine, so they aren't checked in.
+#
+# With --jit the simulators are made with the JIT on, to compare against a
+# baseline saved without it.
+#
+# To Run : python bench.py [options]       (python bench.py -h for options)
+# To compare against an older version of the simulator, check it out to a
+# file (for example git show HEAD~1:sim240core.py > old_core.py) and pass
+# it with -m.
+
+from optparse import OptionParser;
+from time import time;
+from os import path;
+import json;
+import imp;
+import sys;
+
+sys.dont_write_bytecode = True;
+
+test_files = ["gcd", "fibo", "powers", "testRest"];
+synthetic_files = ["loop", "calls"];
+modes = ["q", "i", "u"];
+
+# most instructions simulated per print mode; the synthetic loops are cut
+# short when state is printed
+mode_limits = {"q" : None, "i" : 20000, "u" : 5000};
+
+# Debugging features, each set up in a fresh simulator (by these commands)
+# before running the loop program quietly. None of them ever stops the
+# run; "none" should match the plain run and "break" cost nothing.
+# "no history" turns off the checkpoints kept for back and seek, to show
+# what recording them costs.
+debug_cases = [
+	("none", []),
+	("no history", ["history 0"]),
+	("break", ["break 11"]),
+	("break if", ["break 4 if R1 == FF"]),
+	("cycle", ["break cycle 1000000000"]),
+	("watch", ["watch 8000:8FFF rw"]),
+];
+debug_limit = 50000;
+
+# runs shorter than this (in seconds) are too noisy to check for regressions
+min_check_time = 0.01;
+
+# Stands in for stdout so printing modes pay for formatting, not the terminal
+class NullOut(object):
+	def write(self, text):
+		pass;
+
+def parse_args():
+	parser = OptionParser();
+	default_module = path.join(path.dirname(path.realpath("sim240")),
+	                           "sim240core.py");
+	parser.add_option("-m", "--module", dest = "module",
+	                  default = default_module,
+	                  help = "simulator module to benchmark");
+	parser.add_option("-r", "--repeats", dest = "repeats", type = "int",
+	                  default = 3, help = "runs of each program, best is kept");
+	parser.add_option("-b", "--baseline", dest = "baseline",
+	                  default = "bench_baseline.json",
+	                  help = "baseline file to compare against");
+	parser.add_option("-s", "--save", dest = "save", action = "store_true",
+	                  default = False, help = "save results as the baseline");
+	parser.add_option("--jit", dest = "jit", action = "store_true",
+	                  default = False, help = "turn the simulator's JIT on");
+	parser.add_option("-t", "--threshold", dest = "threshold", type = "float",
+	                  default = 0.2,
+	                  help = "fraction of baseline throughput that may be lost");
+	(options, args) = parser.parse_args();
+	return options;
+
+# Returns the list file lines of a benchmark program
+def read_program(fname):
+	if (fname in synthetic_files):
+		return open("bench/" + fname + ".list").readlines();
+	return open(fname + "/" + fname + ".list").readlines();
+
+# Times loading and running one program in one print mode.
+# Returns a dict of the results.
+def bench_program(sim, fname, mode, repeats, limit = None):
+	list_lines = read_program(fname);
+	if (limit == None and fname in synthetic_files):
+		limit = mode_limits[mode];
+	best_load = None;
+	best_run = None;
+	for i in range(repeats):
+		start = time();
+		sim.load_program(list_lines);
+		load_time = time() - start;
+		start = time();
+		instructions = sim.run(limit, mode);
+		run_time = time() - start;
+		if (best_run == None or run_time < best_run):
+			best_run = run_time;
+		if (best_load == None or load_time < best_load):
+			best_load = load_time;
+	return {"cycles" : sim.cycle_num, "instructions" : instructions,
+	        "load_time" : best_load, "run_time" : best_run,
+	        "cycles_per_sec" : sim.cycle_num / best_run,
+	        "instructions_per_sec" : instructions / best_run};
+
+# Returns a Simulator from the module core, with the JIT on if asked for
+def make_simulator(core, options):
+	if (options.jit):
+		return core.Simulator(out = NullOut(), jit = True);
+	return core.Simulator(out = NullOut());
+
+# Times the loop program with each of the debug_cases set.
+# Returns a dict of the results, by case.
+def bench_debug(core, repeats, options):
+	list_lines = read_program("loop");
+	results = {};
+	for (case, commands) in debug_cases:
+		sim = make_simulator(core, options);
+		for command in commands:
+			sim.do_command(command);
+		sim.print_per = "q";
+		results[case] = bench_program(sim, "loop", "q", repeats, debug_limit);
+	return results;
+
+def main():
+	options = parse_args();
+
+	# the simulator imports isa240.py, which sits next to the real script
+	sys.path.insert(0, path.dirname(path.realpath("sim240")));
+	start = time();
+	core = imp.load_source("sim240core_bench", options.module);
+	sim = make_simulator(core, options);
+	startup = time() - start;
+
+	print(options.module);
+	print("startup (import and Simulator()): %.3fs" % startup);
+	print("%-10s %4s %10s %10s %9s %9s %12s %12s" % ("program", "mode",
+	      "cycles", "instrs", "load", "run", "cycles/sec", "instrs/sec"));
+	results = {};
+	for fname in test_files + synthetic_files:
+		for mode in modes:
+			result = bench_program(sim, fname, mode, options.repeats);
+			results[fname + " " + mode] = result;
+			print("%-10s %4s %10d %10d %8.3fs %8.3fs %12.0f %12.0f" % (fname,
+			      mode, result["cycles"], result["instructions"],
+			      result["load_time"], result["run_time"],
+			      result["cycles_per_sec"], result["instructions_per_sec"]));
+
+	print("");
+	print("debugging features set but never hit (loop, q, %d instructions)"
+	      % debug_limit);
+	print("%-10s %9s %12s %9s" % ("feature", "run", "instrs/sec", "speed"));
+	debug_results = bench_debug(core, options.repeats, options);
+	plain = debug_results["none"]["instructions_per_sec"];
+	for (case, commands) in debug_cases:
+		result = debug_results[case];
+		results["loop q " + case] = result;
+		print("%-10s %8.3fs %12.0f %8.0f%%" % (case, result["run_time"],
+		      result["instructions_per_sec"],
+		      100.0 * result["instructions_per_sec"] / plain));
+
+	if (options.save or not path.exists(options.baseline)):
+		fh = open(options.baseline, "w");
+		json.dump({"startup" : startup, "results" : results}, fh,
+		          indent = 1, sort_keys = True);
+		fh.close();
+		print("Saved baseline to " + options.baseline);
+		return;
+
+	# throughput below (1 - threshold) of the baseline is a regression
+	baseline = json.load(open(options.baseline))["results"];
+	regressions = 0;
+	for key in sorted(results):
+		if (key not in baseline): continue;
+		if (baseline[key]["run_time"] < min_check_time): continue;
+		for measure in ["cycles_per_sec", "instructions_per_sec"]:
+			old = baseline[key][measure];
+			new = results[key][measure];
+			if (new < old * (1 - options.threshold)):
+				print("Regression in %s %s: %.0f, baseline %.0f (%.0f%%)" %
+				      (key, measure, new, old, 100.0 * (new - old) / old));
+				regressions += 1;
+	if (regressions):
+		print("Benchmark failed: %d regressions" % regressions);
+		exit(1);
+	print("No regressions against " + options.baseline);
+
+main();
@@ -0,0 +1,23 @@
+        ; Synthetic benchmark for sim240: a loop calling a subroutine that uses
+        ; the stack and every kind of memory access, about 1.6 million cycles.
+        .ORG    $0000
+start   LDI     R0, $0
+        LDSP    R0              ; stack grows down from the top of memory
+        LDI     R1, $4000       ; calls to make
+loop    JSR     work
+        DECR    R1
+        BRZ     done
+        BRA     loop
+done    STOP
+
+work    PUSH    R1
+        LDA     R2, count
+        INCR    R2
+        STA     count, R2
+        LDI     R3, $8000
+        STR     R3, R2
+        LDR     R4, R3
+        POP     R1
+        RTN
+
+count   .DW     $0
@@ -0,0 +1,15 @@
+        ; Synthetic benchmark for sim240: nested countdown loops of ALU and
+        ; branch instructions, about 2.2 million cycles.
+        .ORG    $0000
+start   LDI     R1, $10         ; outer count
+outer   LDI     R2, $1000       ; inner count
+inner   ADD     R3, R2
+        XOR     R4, R3
+        LSHR    R4
+        DECR    R2
+        BRZ     next
+        BRA     inner
+next    DECR    R1
+        BRZ     done
+        BRA     outer
+done    STOP
@@ -9,7 +9,13 @@
 # Written by Neil Ryan <nryan@andrew.cmu.edu>
 # Last updated 6/18/2015
 
-from subprocess import check_output;
+from subprocess import check_output, CalledProcessError;
+from tempfile import mkdtemp;
+from shutil import rmtree;
+from os import path, devnull;
+import json;
+import imp;
+import sys;
 
 sim_name = "sim240";
 test_files = ["gcd", "fibo", "powers", "testRest"];
@@ -23,4 +29,306 @@ for fname in test_files:
 		print(out);
 		exit();
 	print("Done testing " + fname);
+
+# the same programs again, graded in one process
+out = check_output(["python", sim_name, "--batch", "batch.manifest"]);
+if (len(out.splitlines()) != len(test_files)):
+	print("batch mode failed");
+	print(out);
+	exit();
+for line in out.splitlines():
+	record = json.loads(line);
+	if (record["result"] != "pass"):
+		print(record["list"] + " failed in batch mode");
+		print(line);
+		exit();
+print("Done testing batch mode");
+
+# the state files converted to the binary format, graded against
+tmp_dir = mkdtemp();
+for fname in test_files:
+	list_name = fname + "/" + fname + ".list";
+	binary_name = path.join(tmp_dir, fname + ".bstate");
+	out = check_output(["python", sim_name, "--convert",
+	                    fname + "/" + fname + ".state", binary_name]);
+	out += check_output(["python", sim_name, list_name, "-g", binary_name,
+	                     "-r"]);
+	if (len(out) > 0):
+		print(fname + " failed with a binary state file");
+		print(out);
+		exit();
+rmtree(tmp_dir);
+print("Done testing binary state files");
+
+# gcd's state file with values that can't be read (flags that are only
+# partly don't cares, a register that isn't hex): they are differences,
+# printed by -g and graded in batch mode like any other
+tmp_dir = mkdtemp();
+unreadable_name = path.join(tmp_dir, "gcd.state");
+state_text = open("gcd/gcd.state").read();
+good_line = [line for line in state_text.splitlines()
+             if (line.startswith("1108"))][0];
+fields = good_line.split();
+fields[5] = "0x1x";
+fields[10] = "00G0";
+open(unreadable_name, "w").write(state_text.replace(good_line,
+                                                    " ".join(fields)));
+manifest_name = path.join(tmp_dir, "unreadable.manifest");
+open(manifest_name, "w").write("gcd/gcd.list - " + unreadable_name + "\n");
+record = json.loads(check_output(["python", sim_name, "--batch",
+                                  manifest_name]));
+unreadable_differences = ["ZNCV differs: sim = 1010, file = 0x1x",
+                          "R2 differs: sim = 0000, file = 00G0"];
+if (record["result"] != "fail" or
+    record["differences"] != unreadable_differences):
+	print("unreadable state file values failed in batch mode");
+	print(record);
+	exit();
+out = check_output(["python", sim_name, "gcd/gcd.list", "-g",
+                    unreadable_name, "-r"]);
+if (out.splitlines() != unreadable_differences):
+	print("unreadable state file values failed");
+	print(out);
+	exit();
+rmtree(tmp_dir);
+print("Done testing unreadable state file values");
+
+# gcd again, snapshotting part way, changing state and going back
+out = check_output(["python", sim_name, "gcd/gcd.list", "snapshot.sim", "-g",
+                    "gcd/gcd.state"]);
+if (len(out) > 0):
+	print("snapshots failed");
+	print(out);
+	exit();
+print("Done testing snapshots");
+
+# one Simulator loading gcd after running it: the registers should start
+# out zeroed again, and reset should go back to that
+sys.dont_write_bytecode = True;
+sys.path.insert(0, path.dirname(path.realpath(sim_name)));
+core = imp.load_source("sim240core_test",
+                       path.join(sys.path[0], "sim240core.py"));
+sim = core.Simulator(out = open(devnull, "w"));
+gcd_lines = open("gcd/gcd.list").readlines();
+sim.load_program(gcd_lines);
+sim.run(None, "q");
+ran = sim.read_state()["regFile"];
+sim.load_program(gcd_lines);
+loaded = sim.read_state()["regFile"];
+sim.run(None, "q");
+sim.reset();
+if (ran == [0] * 8 or loaded != [0] * 8 or
+    sim.read_state()["regFile"] != [0] * 8):
+	print("registers kept from the last program");
+	print(ran, loaded, sim.read_state()["regFile"]);
+	exit();
+print("Done testing reloading programs");
+
+# breakpoints and watchpoints on gcd: conditions that don't parse (a name
+# that only starts like mem[]) are reported, and m[] addresses may be in
+# either case. A false condition doesn't stop the run, a true one does, a
+# cycle breakpoint stops at the end of the instruction that reaches it, and
+# watchpoints stop after a write or a read until they're cleared. The state
+# printed after each run gives the cycle and PC it stopped at. The JIT
+# (translating every block) has to end its blocks at the breakpoints.
+script = open("conditions.sim").read().splitlines();
+expected = [
+	"Invalid condition: bad condition at 'MEMBER'",
+	"Invalid condition: bad condition at 'MEM'",
+	"1108  STOP1 000D 3000 0000 1010 000D 3000 0021 0048 0000 0000 0000 0000 0000 0003",
+	"Hit breakpoint at 2006.",
+	"0151  FETCH 2006 4009 FFF6 0000 FFF9 0048 0021 0048 0000 0000 0000 0000 0000 0000",
+	"Hit breakpoint at cycle 1000.",
+	"1005  FETCH 1018 3400 FFEE 1010 FFED 0021 0021 0006 0000 0000 0000 0000 0000 0003",
+	"Hit watchpoint: write to FFFC by the instruction at 1000.",
+	"0057  FETCH 1001 3200 FFFC 0000 FFFC 0021 0021 0048 0000 0000 0000 0000 0000 0000",
+	"Hit watchpoint: read of FFFC by the instruction at 1017.",
+	"1089  FETCH 1018 3400 FFFD 1010 FFFC 0021 0021 0048 0000 0000 0000 0000 0000 0003",
+	"1108  STOP1 000D 3000 0000 1010 000D 3000 0021 0048 0000 0000 0000 0000 0000 0003"];
+for flags in [[], ["--reference"], ["--jit", "--jit-threshold", "1"]]:
+	out = check_output(["python", sim_name, "gcd/gcd.list", "conditions.sim",
+	                    "-q"] + flags);
+	lines = [line for line in out.splitlines()
+	         if (line not in script and len(line) > 0)];
+	if (lines != expected):
+		print("breakpoint conditions failed " + " ".join(flags));
+		print(out);
+		exit();
+print("Done testing breakpoint conditions");
+
+# gcd profiled with the profile command and with --profile: the counts per
+# address should add up to the run's instructions (a state is printed per
+# instruction with -r) and cycles, and both should save the same JSON
+tmp_dir = mkdtemp();
+open(path.join(tmp_dir, "profile.sim"), "w").write(
+	"profile on\nrun\nstats\nprofile save gcd.profile\nquit\n");
+out = check_output(["python", path.abspath(sim_name),
+                    path.abspath("gcd/gcd.list"), "profile.sim", "-q"],
+                   cwd = tmp_dir);
+cycles = [int(line.split()[1]) for line in out.splitlines()
+          if (line.startswith("Cycles:"))];
+instructions = len([line for line in check_output(["python", sim_name,
+                    "gcd/gcd.list", "-r"]).splitlines()
+                    if (line.split()[1] in ["FETCH", "STOP1"])]);
+check_output(["python", sim_name, "gcd/gcd.list", "-r", "-q", "--profile",
+              path.join(tmp_dir, "flag.profile")]);
+profile = json.load(open(path.join(tmp_dir, "gcd.profile")));
+flag_profile = json.load(open(path.join(tmp_dir, "flag.profile")));
+rmtree(tmp_dir);
+totals = [sum([entry["instructions"] for entry in profile["pcs"]]),
+          sum([entry["cycles"] for entry in profile["pcs"]])];
+if (totals != [instructions] + cycles or
+    [profile["instructions"], profile["cycles"]] != totals or
+    flag_profile != profile):
+	print("profiling failed");
+	print(out);
+	print(totals, instructions, cycles);
+	exit();
+print("Done testing profiling");
+
+# a program that reads memory it never wrote: the random memory it sees
+# comes from the state file's seed, with either engine
+for flags in [[], ["--reference"]]:
+	out = check_output(["python", sim_name, "uninit/uninit.list", "-g",
+	                    "uninit/uninit.state"] + flags);
+	if (len(out) > 0):
+		print("random memory from the seed failed");
+		print(out);
+		exit();
+print("Done testing seeded random memory");
+
+# gcd ends the same way whatever the random memory; uninit doesn't
+out = check_output(["python", sim_name, "gcd/gcd.list", "--sweep", "4"]);
+try:
+	check_output(["python", sim_name, "uninit/uninit.list", "--sweep", "4"]);
+	out += "uninit ended the same way under every seed";
+except CalledProcessError, e:
+	if ("Seed 0001: R3 = " not in e.output):
+		out += e.output;
+if ("Every seed ends the same way" not in out or len(out.splitlines()) != 2):
+	print("seed sweeps failed");
+	print(out);
+	exit();
+print("Done testing seed sweeps");
+
+# gcd traced every cycle: trace240 should print one record per cycle, the
+# last stopped
+tmp_dir = mkdtemp();
+trace_name = path.join(tmp_dir, "gcd.trace");
+out = check_output(["python", sim_name, "gcd/gcd.list", "-r", "-q",
+                    "--trace", trace_name]);
+lines = check_output(["python", "../trace240", trace_name]).splitlines();
+rmtree(tmp_dir);
+last = lines[-1].split();
+if (last[1] != "STOP1" or len(lines) - 1 != int(last[0]) + 1):
+	print("tracing failed");
+	print(out);
+	print("\n".join(lines[-2:]));
+	exit();
+print("Done testing traces");
+
+# gcd dumped as a VCD of p18240_top, then co-simulated against it (as it
+# would be against the RTL's); fibo should differ from it
+tmp_dir = mkdtemp();
+vcd_name = path.join(tmp_dir, "gcd.vcd");
+check_output(["python", sim_name, "gcd/gcd.list", "-r", "-q", "--trace",
+              vcd_name]);
+out = check_output(["python", sim_name, "gcd/gcd.list", "--cosim", vcd_name]);
+try:
+	check_output(["python", sim_name, "fibo/fibo.list", "--cosim", vcd_name]);
+	out += "fibo matched gcd";
+except CalledProcessError, e:
+	if (not e.output.startswith("First difference at cycle")):
+		out += e.output;
+rmtree(tmp_dir);
+if (not out.startswith("Matched") or len(out.splitlines()) != 1):
+	print("co-simulation failed");
+	print(out);
+	exit();
+print("Done testing co-simulation");
+
+# every program run with the JIT translating each block the first time it
+# runs, against the microcoded engine: the final state, memory and cycle
+# count should come out the same
+# (run in a scratch directory, as save only takes a file name)
+tmp_dir = mkdtemp();
+open(path.join(tmp_dir, "final.sim"), "w").write(
+	"run\nstats\nsave final.state\nquit\n");
+programs = [fname + "/" + fname for fname in test_files + ["uninit"]];
+for program in programs + ["bench/loop", "bench/calls"]:
+	results = [];
+	for flags in [["--reference"], ["--jit", "--jit-threshold", "1"]]:
+		out = check_output(["python", path.abspath(sim_name),
+		                    path.abspath(program + ".list"), "final.sim",
+		                    "-q", "--seed", "0240"] + flags, cwd = tmp_dir);
+		cycles = [line for line in out.splitlines()
+		          if (line.startswith("Cycles:"))];
+		results.append((cycles,
+		                open(path.join(tmp_dir, "final.state")).read()));
+	if (results[0] != results[1]):
+		print(program + " differs with the JIT");
+		print(results[0][0] + results[1][0]);
+		exit();
+rmtree(tmp_dir);
+print("Done testing the JIT");
+
+# the loop program run to the end (so checkpoints are thinned out and taken
+# less often), then taken back to cycles near the start with seek, uback and
+# back, against states saved by running that far with the microcoded
+# engine: 4001 instructions end at cycle 22007, and take 5 cycles each there
+tmp_dir = mkdtemp();
+references = {"seek.state" : "run 4001\n",
+              "uback.state" : "run 4000\nu\nu\nu\nu\n",
+              "back.state" : "run 4000\n", "back2.state" : "run 3999\n"};
+for (state_name, commands) in references.items():
+	open(path.join(tmp_dir, "reference.sim"), "w").write(
+		commands + "save " + state_name + "\nquit\n");
+	check_output(["python", path.abspath(sim_name),
+	              path.abspath("bench/loop.list"), "reference.sim", "-q",
+	              "--seed", "0240", "--reference"], cwd = tmp_dir);
+script = open("history.sim").read().splitlines();
+for flags in [[], ["--jit"]]:
+	out = check_output(["python", path.abspath(sim_name),
+	                    path.abspath("bench/loop.list"),
+	                    path.abspath("history.sim"), "-q", "--seed",
+	                    "0240"] + flags, cwd = tmp_dir);
+	lines = [line for line in out.splitlines() if (line not in script)];
+	if (len(lines) > 0):
+		print("history failed " + " ".join(flags));
+		print(out);
+		exit();
+# with room for only a few checkpoints, the oldest are dropped
+open(path.join(tmp_dir, "evict.sim"), "w").write(
+	"history 4\nrun\nseek 22007\nquit\n");
+out = check_output(["python", path.abspath(sim_name),
+                    path.abspath("bench/loop.list"), "evict.sim", "-q"],
+                   cwd = tmp_dir);
+rmtree(tmp_dir);
+if ("That is before the oldest cycle kept" not in out):
+	print("history failed with a small budget");
+	print(out);
+	exit();
+print("Done testing history");
+
+# the programs that still assemble, run from their .asm files (assembled in
+# the simulator's process, with no .list file) and graded against the same
+# state files; gcd's labels should be the ones its .list file has
+for fname in ["gcd", "fibo", "testRest"]:
+	out = check_output(["python", sim_name, fname + "/" + fname + ".asm",
+	                    "-g", fname + "/" + fname + ".state", "-r"]);
+	if (len(out) > 0):
+		print(fname + " failed from its .asm file");
+		print(out);
+		exit();
+labels = [];
+for ext in [".list", ".asm"]:
+	out = check_output(["python", sim_name, "gcd/gcd" + ext, "labels.sim",
+	                    "-q"]);
+	labels.append(sorted([line.strip("> ").upper()
+	                      for line in out.splitlines() if (": " in line)]));
+if (labels[0] != labels[1]):
+	print("gcd's labels differ from its .asm file");
+	print(labels);
+	exit();
+print("Done testing .asm files");
 print("Tests sucessful.")
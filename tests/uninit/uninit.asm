@@ -0,0 +1,14 @@
+        .ORG $0000; sums words of memory the program never writes, so the
+        ; result depends on the random memory (and its seed)
+        LDI R1, $40; count
+        LDI R2, $8000; pointer
+        LDI R3, $0; sum
+loop    LDR R4, R2;
+        ADD R3, R4;
+        LDI R5, $101; stride
+        ADD R2, R5;
+        DECR R1;
+        BRZ done;
+        BRA loop;
+done    STA $9000, R3;
+        STOP;